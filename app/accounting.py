@@ -0,0 +1,306 @@
+#运行统计模块：按会话记录每一步的LLM排队、请求延迟、token用量和工具耗时
+import asyncio
+import json
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Union
+
+from pydantic import BaseModel, Field
+
+from app.logger import logger
+
+
+class StepRecord(BaseModel):
+    """单个步骤的统计"""
+    step: int
+    started_at: float = Field(default_factory=time.time)
+    duration: float = 0.0
+    llm_calls: int = 0
+    llm_queue_wait: float = 0.0  #在LLM调度器中排队的时间(秒)
+    llm_latency: float = 0.0  #LLM请求本身的耗时(秒),不含排队
+    input_tokens: int = 0  #来自服务端usage
+    output_tokens: int = 0
+    tool_time: Dict[str, float] = Field(default_factory=dict)  #工具名 -> 累计执行时间(秒)
+    tool_calls: Dict[str, int] = Field(default_factory=dict)  #工具名 -> 调用次数
+    tool_cache_hits: Dict[str, int] = Field(default_factory=dict)  #工具名 -> 结果缓存命中次数
+    tool_cache_misses: Dict[str, int] = Field(default_factory=dict)  #工具名 -> 结果缓存未命中次数(可缓存工具实际执行的次数)
+
+
+class RunAccounting(BaseModel):
+    """一次BaseAgent.run的统计,由run创建并通过current_run传递给LLM和工具"""
+    session_id: str
+    agent_name: str
+    started_at: float = Field(default_factory=time.time)
+    finished_at: Optional[float] = None
+    steps: List[StepRecord] = Field(default_factory=list)
+
+    def start_step(self, step: int) -> StepRecord:
+        record = StepRecord(step=step)
+        self.steps.append(record)
+        return record
+
+    def end_step(self) -> None:
+        if self.steps:
+            current = self.steps[-1]
+            current.duration = time.time() - current.started_at
+
+    @property
+    def current(self) -> StepRecord:
+        """当前步骤;run开始前的调用(如预热)记入第0步"""
+        if not self.steps:
+            self.steps.append(StepRecord(step=0))
+        return self.steps[-1]
+
+    def record_queue_wait(self, seconds: float) -> None:
+        self.current.llm_queue_wait += seconds
+
+    def record_llm_call(self, latency: float) -> None:
+        step = self.current
+        step.llm_calls += 1
+        step.llm_latency += latency
+
+    def record_llm_usage(self, input_tokens: int, output_tokens: int) -> None:
+        step = self.current
+        step.input_tokens += input_tokens
+        step.output_tokens += output_tokens
+
+    def record_tool(self, name: str, seconds: float) -> None:
+        step = self.current
+        step.tool_time[name] = step.tool_time.get(name, 0.0) + seconds
+        step.tool_calls[name] = step.tool_calls.get(name, 0) + 1
+
+    def record_tool_cache(self, name: str, hit: bool) -> None:
+        counts = self.current.tool_cache_hits if hit else self.current.tool_cache_misses
+        counts[name] = counts.get(name, 0) + 1
+
+    def finish(self) -> None:
+        self.finished_at = time.time()
+        metrics_registry.observe(self)
+
+    def totals(self) -> dict:
+        """整个会话的汇总"""
+        tool_time: Dict[str, float] = defaultdict(float)
+        tool_calls: Dict[str, int] = defaultdict(int)
+        cache_hits: Dict[str, int] = defaultdict(int)
+        cache_misses: Dict[str, int] = defaultdict(int)
+        for step in self.steps:
+            for name, seconds in step.tool_time.items():
+                tool_time[name] += seconds
+            for name, count in step.tool_calls.items():
+                tool_calls[name] += count
+            for name, count in step.tool_cache_hits.items():
+                cache_hits[name] += count
+            for name, count in step.tool_cache_misses.items():
+                cache_misses[name] += count
+        return {
+            "session_id": self.session_id,
+            "agent": self.agent_name,
+            "steps": len([s for s in self.steps if s.step > 0]),
+            "duration": (self.finished_at or time.time()) - self.started_at,
+            "llm_calls": sum(s.llm_calls for s in self.steps),
+            "llm_queue_wait": sum(s.llm_queue_wait for s in self.steps),
+            "llm_latency": sum(s.llm_latency for s in self.steps),
+            "input_tokens": sum(s.input_tokens for s in self.steps),
+            "output_tokens": sum(s.output_tokens for s in self.steps),
+            "tool_time": dict(tool_time),
+            "tool_calls": dict(tool_calls),
+            "tool_cache_hits": dict(cache_hits),
+            "tool_cache_misses": dict(cache_misses),
+        }
+
+    def to_jsonl(self) -> str:
+        """每一步一行,最后一行为会话汇总"""
+        lines = [
+            json.dumps({"type": "step", "session_id": self.session_id, **step.model_dump()}, ensure_ascii=False)
+            for step in self.steps
+        ]
+        lines.append(json.dumps({"type": "run", **self.totals()}, ensure_ascii=False))
+        return "\n".join(lines) + "\n"
+
+    def write_jsonl(self, path: Union[str, Path]) -> None:
+        """追加写入JSON Lines文件"""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("a", encoding="utf-8") as f:
+            f.write(self.to_jsonl())
+
+
+#当前协程所属会话的统计,由BaseAgent.run设置
+current_run: ContextVar[Optional[RunAccounting]] = ContextVar("current_run", default=None)
+
+
+class MetricsRegistry:
+    """进程级指标汇总,以Prometheus文本格式导出"""
+
+    def __init__(self):
+        self.runs = 0
+        self.steps = 0
+        self.llm_calls = 0
+        self.llm_queue_wait = 0.0
+        self.llm_latency = 0.0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.tool_time: Dict[str, float] = defaultdict(float)
+        self.tool_calls: Dict[str, int] = defaultdict(int)
+        self.tool_cache_hits: Dict[str, int] = defaultdict(int)
+        self.tool_cache_misses: Dict[str, int] = defaultdict(int)
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._gauges: Optional[Dict[str, Dict[str, int]]] = None  #合并快照得到的仪表值,None表示读取本进程
+
+    def observe(self, run: RunAccounting) -> None:
+        totals = run.totals()
+        self.runs += 1
+        self.steps += totals["steps"]
+        self.llm_calls += totals["llm_calls"]
+        self.llm_queue_wait += totals["llm_queue_wait"]
+        self.llm_latency += totals["llm_latency"]
+        self.input_tokens += totals["input_tokens"]
+        self.output_tokens += totals["output_tokens"]
+        for name, seconds in totals["tool_time"].items():
+            self.tool_time[name] += seconds
+        for name, count in totals["tool_calls"].items():
+            self.tool_calls[name] += count
+        for name, count in totals["tool_cache_hits"].items():
+            self.tool_cache_hits[name] += count
+        for name, count in totals["tool_cache_misses"].items():
+            self.tool_cache_misses[name] += count
+
+    def snapshot(self) -> dict:
+        """可跨进程传递的指标快照(含本进程调度器的队列深度和在途请求数)"""
+        from app.scheduler import LLMScheduler
+
+        return {
+            "runs": self.runs,
+            "steps": self.steps,
+            "llm_calls": self.llm_calls,
+            "llm_queue_wait": self.llm_queue_wait,
+            "llm_latency": self.llm_latency,
+            "input_tokens": self.input_tokens,
+            "output_tokens": self.output_tokens,
+            "tool_time": dict(self.tool_time),
+            "tool_calls": dict(self.tool_calls),
+            "tool_cache_hits": dict(self.tool_cache_hits),
+            "tool_cache_misses": dict(self.tool_cache_misses),
+            "queue_depth": {url: s.queue_depth for url, s in LLMScheduler._schedulers.items()},
+            "in_flight": {url: s.in_flight for url, s in LLMScheduler._schedulers.items()},
+        }
+
+    @classmethod
+    def merged(cls, snapshots: List[dict]) -> "MetricsRegistry":
+        """合并多个进程的快照(如工作进程池),计数器相加,队列深度等仪表取各进程之和"""
+        registry = cls()
+        registry._gauges = {"queue_depth": defaultdict(int), "in_flight": defaultdict(int)}
+        for snapshot in snapshots:
+            for field in ("runs", "steps", "llm_calls", "llm_queue_wait", "llm_latency", "input_tokens", "output_tokens"):
+                setattr(registry, field, getattr(registry, field) + snapshot.get(field, 0))
+            for name, seconds in snapshot.get("tool_time", {}).items():
+                registry.tool_time[name] += seconds
+            for name, count in snapshot.get("tool_calls", {}).items():
+                registry.tool_calls[name] += count
+            for name, count in snapshot.get("tool_cache_hits", {}).items():
+                registry.tool_cache_hits[name] += count
+            for name, count in snapshot.get("tool_cache_misses", {}).items():
+                registry.tool_cache_misses[name] += count
+            for gauge in ("queue_depth", "in_flight"):
+                for url, value in snapshot.get(gauge, {}).items():
+                    registry._gauges[gauge][url] += value
+        return registry
+
+    def _gauge(self, name: str) -> Dict[str, int]:
+        if self._gauges is not None:
+            return dict(self._gauges[name])
+        from app.scheduler import LLMScheduler
+
+        if name == "queue_depth":
+            return {url: s.queue_depth for url, s in LLMScheduler._schedulers.items()}
+        return {url: s.in_flight for url, s in LLMScheduler._schedulers.items()}
+
+    def render_prometheus(self) -> str:
+        """Prometheus文本格式(text/plain; version=0.0.4)"""
+        lines = []
+
+        def metric(name: str, kind: str, help_text: str, samples: Dict[str, float]):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples.items():
+                lines.append(f"{name}{labels} {value}")
+
+        metric("cogniself_runs_total", "counter", "Finished agent runs", {"": self.runs})
+        metric("cogniself_steps_total", "counter", "Executed agent steps", {"": self.steps})
+        metric("cogniself_llm_calls_total", "counter", "LLM requests", {"": self.llm_calls})
+        metric("cogniself_llm_queue_wait_seconds_total", "counter", "Time spent queued for LLM", {"": self.llm_queue_wait})
+        metric("cogniself_llm_latency_seconds_total", "counter", "Time spent in LLM requests", {"": self.llm_latency})
+        metric(
+            "cogniself_llm_tokens_total",
+            "counter",
+            "LLM tokens reported by the server",
+            {'{direction="input"}': self.input_tokens, '{direction="output"}': self.output_tokens},
+        )
+        metric(
+            "cogniself_tool_seconds_total",
+            "counter",
+            "Tool execution time",
+            {f'{{tool="{_escape(name)}"}}': seconds for name, seconds in self.tool_time.items()},
+        )
+        metric(
+            "cogniself_tool_calls_total",
+            "counter",
+            "Tool executions",
+            {f'{{tool="{_escape(name)}"}}': count for name, count in self.tool_calls.items()},
+        )
+        metric(
+            "cogniself_tool_cache_requests_total",
+            "counter",
+            "Result cache lookups for cacheable tools",
+            {
+                **{f'{{tool="{_escape(name)}",result="hit"}}': count for name, count in self.tool_cache_hits.items()},
+                **{f'{{tool="{_escape(name)}",result="miss"}}': count for name, count in self.tool_cache_misses.items()},
+            },
+        )
+        metric(
+            "cogniself_llm_queue_depth",
+            "gauge",
+            "Requests waiting in the LLM scheduler",
+            {f'{{endpoint="{_escape(url)}"}}': value for url, value in self._gauge("queue_depth").items()},
+        )
+        metric(
+            "cogniself_llm_in_flight",
+            "gauge",
+            "LLM requests in flight",
+            {f'{{endpoint="{_escape(url)}"}}': value for url, value in self._gauge("in_flight").items()},
+        )
+        return "\n".join(lines) + "\n"
+
+    async def serve(
+        self, host: str = "127.0.0.1", port: int = 9464, render: Optional[Callable[[], str]] = None
+    ) -> asyncio.AbstractServer:
+        """在当前事件循环中启动一个最小的HTTP服务,任意路径都返回指标文本(render可替换指标来源)"""
+        render = render or self.render_prometheus
+
+        async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            try:
+                await reader.readuntil(b"\r\n\r\n")
+                body = render().encode("utf-8")
+                writer.write(
+                    b"HTTP/1.1 200 OK\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                    + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+                    + body
+                )
+                await writer.drain()
+            except (asyncio.IncompleteReadError, ConnectionResetError):
+                pass
+            finally:
+                writer.close()
+
+        self._server = await asyncio.start_server(handle, host, port)
+        logger.info(f"指标服务已启动：http://{host}:{port}/metrics")
+        return self._server
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+metrics_registry = MetricsRegistry()
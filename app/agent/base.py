@@ -1,11 +1,20 @@
 #基础智能体类
+import uuid
 from abc import ABC, abstractmethod
+from pathlib import Path
 from contextlib import asynccontextmanager
-from typing import Optional, List  # Optional用于定义可选参数
+from typing import Deque, Optional, List, Union  # Optional用于定义可选参数
+from app.accounting import RunAccounting, current_run
+from app.checkpoint import Checkpoint
+from app.config import config
+from app.message_store import MessageStore
 from app.llm import LLM  # LLM是语言模型的抽象基类
+from app.router import LLMRouter
 from pydantic import BaseModel, Field, model_validator  # pydantic库的BaseModel类用于定义智能体的属性和方法，并提供数据校验和序列化功能。
 from app.schema import AgentState, ROLE_TYPE, Memory, Message  # 导入AgentState、ROLE_TYPE、Memory类
 from app.logger import logger
+from app.scheduler import Priority, current_session
+from app.tracing import TraceFile, tracer
 
 class BaseAgent(BaseModel, ABC):
     """智能体的抽象基类，用于管理智能体的状态和执行。为状态转换、内存管理提供基础功能，以及基于步骤的执行循环。子类必须实现step方法。"""
@@ -17,15 +26,49 @@ class BaseAgent(BaseModel, ABC):
     system_prompt: Optional[str] = Field(None, description="系统级别提示信息")
     next_step_prompt: Optional[str] = Field(None, description="下一步提示信息")
     #依赖性
-    llm: LLM = Field(default_factory=LLM, description="智能体的语言模型实例")
+    llm: Union[LLM, LLMRouter] = Field(default_factory=LLM, description="智能体的语言模型实例(或多配置路由)")
     memory: Memory = Field(default_factory=Memory, description="智能体的内存实例")
     state: AgentState = Field(default=AgentState.IDLE, description="智能体的当前状态")
     max_steps: int = Field(default=10, description="最大执行步骤数")
     current_step: int = Field(default=0, description="当前执行步骤数")
+    #会话标识与调度优先级,LLM调度器据此在会话之间公平排队
+    session_id: str = Field(default_factory=lambda: uuid.uuid4().hex, description="会话ID")
+    priority: Priority = Field(default=Priority.NORMAL, description="LLM请求的调度优先级")
+    #运行统计
+    accounting: Optional[RunAccounting] = Field(default=None, description="最近一次run的统计")
+    accounting_log: Optional[Path] = Field(default=None, description="run结束后追加写入统计的JSON Lines文件")
+    #检查点：设置后每一步结束时把状态追加写入checkpoint_dir/<session_id>.jsonl,可通过resume继续
+    checkpoint_dir: Optional[Path] = Field(default=None, description="检查点目录")
+    _checkpoint: Optional[Checkpoint] = None
+    #卡住检测：同一回复(或同一工具调用得到相同结果)重复duplicate_threshold次视为卡住
+    duplicate_threshold: int = Field(default=2, description="判定卡住的重复次数")
+    max_stuck_prompts: int = Field(default=2, description="提示更换策略的次数上限,之后仍然循环则提前结束")
+    _stuck_prompts: int = 0  #连续卡住期间已提示的次数,出现新的回复后清零
+    _stuck_prompt_active: bool = False  #本步的next_step_prompt带有卡住提示
+    _prompt_before_stuck: Optional[str] = None
+    #链路追踪：设置后把本次run的span(run/step/think/act/LLM/工具)追加写入该Chrome trace文件
+    trace_file: Optional[Path] = Field(default=None, description="Chrome trace-event JSON文件")
 
     class Config:
         arbitrary_types_allowed = True  # 允许任意类型，包括自定义类型。
         extra = "allow"  # 允许额外的属性。
+
+    @model_validator(mode="after")
+    def bind_token_counter(self) -> "BaseAgent":
+        """将LLM的逐条消息计数函数绑定到内存，使内存随追加/截断维护累计token数。"""
+        if self.llm is not None and self.memory.token_counter is None:
+            self.memory.token_counter = self.llm.count_message_tokens
+        return self
+
+    @model_validator(mode="after")
+    def attach_message_store(self) -> "BaseAgent":
+        """配置了memory.store_dir时,消息落盘,内存中只保留最近的窗口。"""
+        settings = config.memory
+        if settings.store_dir and self.memory.store is None:
+            self.memory.max_messages = settings.resident_messages
+            self.memory.resident_token_budget = settings.resident_token_budget
+            self.memory.attach_store(MessageStore.for_session(settings.store_dir, self.session_id))
+        return self
     @asynccontextmanager
     async def state_context(self, new_state: AgentState) -> None:
         """状态上下文管理器，用于管理Agent的状态。"""
@@ -70,16 +113,80 @@ class BaseAgent(BaseModel, ABC):
             self.update_memory("user",request)   # 向Agent的内存中添加初始请求信息
 
         results: List[str] = []
-        async with self.state_context(AgentState.RUNNING):#异步上下文管理器，用于管理Agent的状态
-            while self.current_step < self.max_steps and self.state != AgentState.FINISHED:
-                self.current_step += 1
-                logger.info(f"智能体-当前步骤：{self.current_step}/{self.max_steps}")
-                step_result = await self.step()  # 执行智能体的step方法
-                logger.info(f"智能体-执行结果：{step_result}")
-                # 卡住状态检查
-                #if self.is_stuck():
-                #    self.handle_stuck_state()
-                #results.append(f"步骤{self.current_step}执行结果：{step_result}")  # 记录执行结果
+        checkpoint = self._checkpoint
+        if checkpoint is None and self.checkpoint_dir:
+            checkpoint = self._checkpoint = Checkpoint.for_session(self.checkpoint_dir, self.session_id)
+        if checkpoint is not None:
+            checkpoint.start(self.session_id, self.name)
+        current_session.set((self.session_id, self.priority))  #LLM调度器据此识别会话
+        self.accounting = RunAccounting(session_id=self.session_id, agent_name=self.name)
+        current_run.set(self.accounting)  #LLM和工具把按会话的用量记入这里
+        exporter = TraceFile.get(self.trace_file) if self.trace_file else None
+        with tracer.span("agent.run", exporter=exporter, agent=self.name, session_id=self.session_id) as run_span:
+            try:
+                await self.llm.warmup()  #按配置预热连接池,仅首次生效
+                tools = getattr(self, "available_tools", None)
+                if tools is not None:
+                    tools.warmup()  #工具在后台预热(如Python解释器进程),与第一次思考并行
+                async with self.state_context(AgentState.RUNNING):#异步上下文管理器，用于管理Agent的状态
+                    while self.current_step < self.max_steps and self.state != AgentState.FINISHED:
+                        self.current_step += 1
+                        logger.info(f"智能体-当前步骤：{self.current_step}/{self.max_steps}")
+                        self.accounting.start_step(self.current_step)
+                        try:
+                            with tracer.span("agent.step", step=self.current_step):
+                                step_result = await self.step()  # 执行智能体的step方法
+                        finally:
+                            self.accounting.end_step()
+                            self._clear_stuck_prompt()  #卡住提示只作用于下一步
+                        if checkpoint is not None:
+                            checkpoint.save_step(self.current_step, self.state.value, self.memory, getattr(self, "tool_calls", []))
+                        logger.info(f"智能体-执行结果：{step_result}")
+                        # 卡住状态检查
+                        if self.is_stuck():
+                            self.handle_stuck_state()
+                        elif not self.memory.repeated_response_count() and not self.memory.repeated_cycle_count():
+                            self._stuck_prompts = 0  #出现了新的回复,不再视为同一次卡住
+                        results.append(f"步骤{self.current_step}执行结果：{step_result}")  # 记录执行结果
+            finally:
+                run_span.set(steps=self.current_step, state=self.state.value)
+                self.close()
+                self.accounting.finish()
+                if self.accounting_log:
+                    self.accounting.write_jsonl(self.accounting_log)
+        return "\n".join(results) if results else "没有执行任何步骤"
+
+    async def resume(self, session_id: Optional[str] = None) -> str:
+        """从检查点恢复会话(内存、步骤数、状态和工具调用),从最后完成的步骤之后继续运行。
+        参数:
+            session_id:要恢复的会话ID,默认为当前会话
+        """
+        if not self.checkpoint_dir:
+            raise ValueError("未设置checkpoint_dir，无法恢复会话")
+        session_id = session_id or self.session_id
+        checkpoint = Checkpoint.for_session(self.checkpoint_dir, session_id)
+        saved = checkpoint.load()
+        if saved is None:
+            raise ValueError(f"没有找到会话{session_id}的检查点")
+        if self.memory.store is not None and session_id != self.session_id:
+            self.memory.store.close()
+            self.memory.attach_store(MessageStore.for_session(config.memory.store_dir, session_id))
+        self.session_id = session_id
+        self.memory.replace_messages(saved["messages"])
+        self.current_step = saved["step"]
+        if hasattr(self, "tool_calls"):
+            self.tool_calls = saved["tool_calls"]
+        self._checkpoint = checkpoint
+        logger.info(f"智能体-从检查点恢复会话{session_id}，已完成{self.current_step}步")
+        if saved["state"] == AgentState.FINISHED.value:
+            return f"会话{session_id}已在第{self.current_step}步完成"
+        self.state = AgentState.IDLE
+        return await self.run()
+
+    def close(self) -> None:
+        """释放会话占用的资源(落盘消息存储的连接);之后再次运行时按需重新打开"""
+        if self.memory.store is not None:
+            self.memory.store.close()
 
     @abstractmethod
     async def step(self) -> str:
@@ -87,21 +194,37 @@ class BaseAgent(BaseModel, ABC):
         logger.info(f"执行智能体的单步操作...")
 
     def handle_stuck_state(self):
-        """处理卡住状态。"""
-        logger.info(f"智能体卡住，进入错误状态...")
-        stuck_prompt = "\监视到重复响应。考虑新的部署及避免重复已尝试无效路径"
+        """处理卡住状态：先提示更换策略,多次提示后仍在重复相同的工具调用和结果则提前结束。"""
+        if self.memory.repeated_cycle_count() >= self.duplicate_threshold and self._stuck_prompts >= self.max_stuck_prompts:
+            logger.warning(f"智能体-已提示{self._stuck_prompts}次，仍在重复相同的工具调用和结果，提前结束")
+            self.state = AgentState.FINISHED
+            return
+        self._stuck_prompts += 1
+        stuck_prompt = "监视到重复响应。考虑新的策略，避免重复已尝试的无效路径"
         logger.warning(f"智能体检测到卡住状态。添加提示：{stuck_prompt}")
+        if not self._stuck_prompt_active:
+            self._prompt_before_stuck = self.next_step_prompt
+            self._stuck_prompt_active = True
+            self.next_step_prompt = f"{stuck_prompt}\n{self.next_step_prompt or ''}"
+
+    def _clear_stuck_prompt(self) -> None:
+        """一步结束后恢复原来的next_step_prompt"""
+        if self._stuck_prompt_active:
+            self.next_step_prompt = self._prompt_before_stuck
+            self._stuck_prompt_active = False
 
     def is_stuck(self) -> bool:
-        """检查智能体是否卡住。"""
-        if len(self.memory.messages) < 2:
-            return False
+        """检查智能体是否卡住：最近的回复或"工具调用+结果"在窗口内已重复出现,每步O(1)。"""
+        return (
+            self.memory.repeated_response_count() >= self.duplicate_threshold
+            or self.memory.repeated_cycle_count() >= self.duplicate_threshold
+        )
 
     @property
-    def messages(self) -> List[Message]:
+    def messages(self) -> Deque[Message]:
         return self.memory.messages
 
     @messages.setter
     def messages(self, value: List[Message]):
         """Set the list of messages in the agent's memory."""
-        self.memory.messages = value
\ No newline at end of file
+        self.memory.replace_messages(value)
\ No newline at end of file
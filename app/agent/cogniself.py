@@ -8,6 +8,7 @@ from app.logger import logger
 from app.tool import ToolCollection
 from app.tool.browser_use_tool import BrowserUseTool
 from app.tool.python_execute import PythonExecute
+from app.tool.read_observation import ReadObservation
 from app.prompt.browser import NEXT_STEP_PROMPT as BROWSER_NEXT_STEP_PROMPT
 
 
@@ -19,14 +20,14 @@ class CogniSelf(BrowserAgent):#CognSelf类继承自BrowserAgent类
     system_prompt: str = SYSTEM_PROMPT.format(directory=config.workspace_root)
     next_step_prompt: str = NEXT_STEP_PROMPT
 
-    max_observe: int = 10000
+    observation_max_tokens: int = 2500
     max_steps: int = 20
 
     #将通用工具添加到工具集合中
     logger.info(f"智能体-CogniSelf工具集正在添加工具：")
     available_tools: ToolCollection = Field(
         default_factory=lambda: ToolCollection(
-            PythonExecute()
+            PythonExecute(), ReadObservation()
         )
     )
     logger.info(f"智能体-CogniSelf工具集添加工具结束")
@@ -35,7 +36,7 @@ class CogniSelf(BrowserAgent):#CognSelf类继承自BrowserAgent类
         logger.info(f"智能体-CogniSelf正在执行思考：")
         original_prompt = self.next_step_prompt
 
-        recent_messages = self.memory.messages[-3:] if self.memory.messages else []
+        recent_messages = self.memory.get_recent_messages(3)
         browser_in_use = any(
             "browser_use" in msg.content.lower()
             for msg in recent_messages
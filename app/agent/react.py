@@ -1,13 +1,15 @@
 #智能体框架ReActAgent
 from abc import ABC, abstractmethod
-from typing import Optional
+from typing import Optional, Union
 
 from pydantic import Field
 
 from app.llm import LLM
+from app.router import LLMRouter
 from app.logger import logger
 from app.agent.base import BaseAgent
 from app.schema import Memory, AgentState
+from app.tracing import tracer
 
 
 class ReActAgent(BaseAgent, ABC):#继承自BaseAgent及ABC，ABC是抽象基类，BaseAgent是智能体的基类
@@ -17,7 +19,7 @@ class ReActAgent(BaseAgent, ABC):#继承自BaseAgent及ABC，ABC是抽象基类
     system_prompt: Optional[str] = None
     next_step_prompt: Optional[str] = None
 
-    llm: Optional[LLM] = Field(default_factory=LLM)
+    llm: Optional[Union[LLM, LLMRouter]] = Field(default_factory=LLM)
     memory: Memory = Field(default_factory=Memory)
     state: AgentState = AgentState.IDLE
 
@@ -31,7 +33,9 @@ class ReActAgent(BaseAgent, ABC):#继承自BaseAgent及ABC，ABC是抽象基类
 
     async def step(self) -> str:
         logger.info(f"智能体-执行动作：准备思考")
-        should_act = await self.think()
+        with tracer.span("agent.think"):
+            should_act = await self.think()
         if not should_act:
             return "思考结束，无需执行动作"
-        return await self.act()#调用act方法，返回执行结果
+        with tracer.span("agent.act"):
+            return await self.act()#调用act方法，返回执行结果
@@ -1,12 +1,24 @@
 #工具调用模块
-from typing import List, Optional, Union
+import asyncio
+import json
+import time
+from typing import Any, Dict, List, Optional, Tuple, Union
 
 from pydantic import Field
 
+from app.accounting import current_run
 from app.agent.react import ReActAgent
+from app.compaction import ContextCompactor, group_turns
+from app.exceptions import TokenLimitExceeded
 from app.logger import logger
-from app.schema import TOOL_CHOICE_TYPE, ToolChoice, ToolCall, Message
+from app.observation import ObservationShaper
+from app.relevance import RelevanceIndex
+from app.schema import TOOL_CHOICE_TYPE, AgentState, ToolChoice, ToolCall, Message, Role
 from app.tool import ToolCollection, CreateChatCompletion, Terminate
+from app.tool.read_observation import ReadObservation
+from app.tracing import current_span
+
+TOOL_CALL_REQUIRED = "需要工具调用,但模型没有提供任何工具调用"
 
 
 class ToolCallAgent(ReActAgent):#工具调用代理
@@ -26,27 +38,282 @@ class ToolCallAgent(ReActAgent):#工具调用代理
 
     max_steps: int = 30
     max_observe: Optional[Union[int, bool]] = None
+    #观察结果整形：按token(而非字符)裁剪工具输出,保留开头、结尾和错误行,完整输出可用read_observation分页查看
+    observation_max_tokens: Optional[int] = Field(default=None, description="单个观察结果的token上限")
+    observation_dedupe: bool = Field(default=True, description="是否合并连续重复的输出行")
+
+    #流式模式：工具参数一旦完整就开始执行,而不是等待整条消息生成完毕
+    stream_tools: bool = Field(default=False, description="是否使用流式请求并提前执行工具")
+    _pending_tool_tasks: Dict[str, asyncio.Task] = {}  #tool_call.id -> 已提前启动的执行任务
+
+    #并行执行：同一步的多个工具调用并发执行,每个工具的并发数由BaseTool.max_concurrency限制
+    parallel_tool_calls: bool = Field(default=True, description="是否并发执行同一步的多个工具调用")
+    tool_timeout: Optional[float] = Field(default=None, description="单个工具调用的超时时间(秒)")
+
+    #上下文压缩：每次请求模型前把记忆压缩到预算以内,未设置时使用LLM的max_input_tokens
+    context_budget: Optional[int] = Field(default=None, description="每一步记忆的token预算")
+    compactor: ContextCompactor = Field(default_factory=ContextCompactor)
+
+    #相关性筛选：设置后较早的观察结果只发送与当前子目标最相关的relevance_top_k条(本地TF-IDF,不修改记忆)
+    relevance_top_k: Optional[int] = Field(default=None, description="每一步保留的较早观察结果数,None表示不筛选")
+    relevance_keep_recent: int = Field(default=4, description="始终完整发送的最近单元数")
+    _relevance_index: Optional[RelevanceIndex] = None
+    _indexed_count: int = 0  #已建立索引的消息数(Memory.appended_count)
+    _indexed_dropped: int = -1  #上次清理索引时的Memory.dropped_count
+    _indexed_revision: int = -1  #上次重建索引时的Memory.revision,-1表示尚未建立
 
     async def think(self) -> bool:
         logger.info(f"智能体(工具调用)-执行动作：思考...")
         if self.next_step_prompt:
             user_msg = Message.user_message(self.next_step_prompt)
-            self.messages += [user_msg]
+            self.memory.add_message(user_msg)
+        system_msgs = [Message.system_message(self.system_prompt)] if self.system_prompt else None
+        tools = self.available_tools.to_params()
+        budget = self.context_budget or getattr(self.llm, "max_input_tokens", None)
+        if budget:
+            #系统提示词和工具定义也占用输入,记忆只能使用剩余的部分
+            reserved = self.llm.count_tools(tools) + sum(self.llm.count_message_tokens(m) for m in system_msgs or [])
+            self.compactor.compact(self.memory, max(budget - reserved, 0))
+        messages = self._select_context()
+        request = dict(
+            messages=messages,
+            system_msgs=system_msgs,
+            tools=tools,
+            tool_choice=self.tool_choices,
+        )
+        if self.memory.token_counter is not None and len(messages) == len(self.memory.messages):
+            request["message_tokens"] = self.memory.total_tokens  #未经相关性筛选时直接使用记忆的累计token数
         try:
-            response = await self.llm.ask_tool(
-                messages=self.messages,
-                system_msgs=(
-                    [Message.system_message(self.system_prompt)]
-                    if self.system_prompt
-                    else None
-                ),
-                tools=self.available_tools.to_params(),
-                tool_choice=self.tool_choices,
-            )
+            if self.stream_tools:
+                content, tool_calls = await self._think_stream(**request)
+            else:
+                response = await self.llm.ask_tool(**request)
+                if response is None:
+                    raise RuntimeError("没有收到模型的响应")
+                content = response.content or ""
+                tool_calls = response.tool_calls or []
         except ValueError:
             raise
         except Exception as e:
-            logger.info(f"智能体(工具调用)-发生错误：{e}")#####未完待续
+            #tenacity重试耗尽后会将原始异常包装为RetryError
+            token_limit_error = e if isinstance(e, TokenLimitExceeded) else getattr(e, "__cause__", None)
+            if isinstance(token_limit_error, TokenLimitExceeded):
+                logger.error(f"智能体(工具调用)-超出token限制：{token_limit_error}")
+                self.memory.add_message(Message.assistant_message(f"已达到最大token限制，无法继续执行：{token_limit_error}"))
+                self.state = AgentState.FINISHED
+                return False
+            logger.info(f"智能体(工具调用)-发生错误：{e}")
+            raise
+
+        self.tool_calls = tool_calls
+        current_span().set(tool_calls=len(tool_calls), context_messages=len(request["messages"]))
+        logger.info(f"智能体(工具调用)-思考结果：{content}")
+        logger.info(f"智能体(工具调用)-选择了{len(tool_calls)}个工具：{[call.function.name for call in tool_calls]}")
+
+        if self.tool_choices == ToolChoice.NONE:
+            if tool_calls:
+                logger.warning(f"智能体(工具调用)-当前不允许使用工具，但模型尝试调用工具")
+            if content:
+                self.memory.add_message(Message.assistant_message(content))
+                return True
+            return False
+
+        assistant_msg = (
+            Message.from_tool_calls(content=content, tool_calls=tool_calls)
+            if tool_calls
+            else Message.assistant_message(content)
+        )
+        self.memory.add_message(assistant_msg)
+
+        if self.tool_choices == ToolChoice.REQUIRED and not tool_calls:
+            return True  #由act处理
+        if self.tool_choices == ToolChoice.AUTO and not tool_calls:
+            return bool(content)
+        return bool(tool_calls)
+
+    def _select_context(self) -> List[Message]:
+        """本步发送给模型的消息：第一条用户请求、最近的单元、以及与当前子目标最相关的较早观察结果"""
+        messages = list(self.memory.messages)
+        if not self.relevance_top_k:
+            return messages
+        self._update_relevance_index()
+
+        groups = group_turns(messages)
+        head = groups[:1] if groups and groups[0][0].role == Role.USER else []
+        body = groups[len(head):]
+        recent = body[-self.relevance_keep_recent:] if self.relevance_keep_recent else []
+        older = body[: len(body) - len(recent)]
+        candidates = [i for i, group in enumerate(older) if any(m.role == Role.TOOL for m in group)]
+        if len(candidates) <= self.relevance_top_k:
+            return messages
+
+        #当前子目标：最近的assistant消息(思考内容和工具调用参数)
+        query = " ".join(
+            f"{m.content or ''} " + " ".join(call.function.arguments for call in m.tool_calls or [])
+            for group in recent
+            for m in group
+            if m.role == Role.ASSISTANT
+        )
+        keys = [m.tool_call_id for i in candidates for m in older[i] if m.role == Role.TOOL]
+        key_scores = dict(zip(keys, self._relevance_index.scores(query, keys)))
+        group_scores = {
+            i: max(key_scores.get(m.tool_call_id, 0.0) for m in older[i] if m.role == Role.TOOL) for i in candidates
+        }
+        selected = set(sorted(candidates, key=lambda i: group_scores[i], reverse=True)[: self.relevance_top_k])
+        dropped = set(candidates) - selected
+        logger.info(f"智能体(工具调用)-相关性筛选：保留{len(selected)}/{len(candidates)}个较早的观察结果")
+        return [m for group in head + [g for i, g in enumerate(older) if i not in dropped] + recent for m in group]
+
+    def _update_relevance_index(self) -> None:
+        """
+        只索引上次之后新增的观察结果;有消息被淘汰时清理索引。
+        消息被整体替换(恢复会话、上下文压缩、清空)时按当前消息重建索引,恢复的消息不计入appended_count。
+        """
+        memory = self.memory
+        if self._relevance_index is None or memory.revision != self._indexed_revision:
+            self._relevance_index = RelevanceIndex()
+            for message in memory.messages:
+                if message.role == Role.TOOL and message.tool_call_id and message.content:
+                    self._relevance_index.add(message.tool_call_id, message.content)
+            self._indexed_count = memory.appended_count
+            self._indexed_dropped = memory.dropped_count
+            self._indexed_revision = memory.revision
+            return
+        new = min(memory.appended_count - self._indexed_count, len(memory.messages))
+        for i in range(len(memory.messages) - new, len(memory.messages)):
+            message = memory.messages[i]
+            if message.role == Role.TOOL and message.tool_call_id and message.content:
+                self._relevance_index.add(message.tool_call_id, message.content)
+        self._indexed_count = memory.appended_count
+        if memory.dropped_count != self._indexed_dropped:
+            self._relevance_index.retain(m.tool_call_id for m in memory.messages if m.role == Role.TOOL)
+            self._indexed_dropped = memory.dropped_count
+
+    async def _think_stream(self, **request) -> tuple[str, List[ToolCall]]:
+        """流式思考：参数完整的工具调用立即在后台开始执行,act阶段只需等待结果"""
+        self._pending_tool_tasks = {}
+        content, tool_calls = "", []
+        try:
+            async for event in self.llm.ask_tool_stream(**request):
+                if event.type == "tool_call" and self.tool_choices != ToolChoice.NONE:
+                    call = event.tool_call
+                    if not self._is_special_tool(call.function.name):
+                        #特殊工具(如terminate)会改变智能体状态,保持在act阶段执行
+                        logger.info(f"智能体(工具调用)-提前执行工具：{call.function.name}")
+                        self._pending_tool_tasks[call.id] = asyncio.create_task(self._execute_tool_call(call))
+                elif event.type == "done":
+                    content, tool_calls = event.content or "", event.tool_calls
+        except BaseException:
+            #流中断时这条assistant消息不会写入记忆,已提前启动的工具也不能继续运行,否则下一步可能再次执行它们
+            pending = list(self._pending_tool_tasks.values())
+            self._pending_tool_tasks = {}
+            for task in pending:
+                task.cancel()
+            if pending:
+                logger.warning(f"智能体(工具调用)-流式响应中断，已取消{len(pending)}个提前执行的工具")
+                await asyncio.gather(*pending, return_exceptions=True)
+            raise
+        return content, tool_calls
+
+    async def act(self) -> str:
+        if not self.tool_calls:
+            if self.tool_choices == ToolChoice.REQUIRED:
+                raise ValueError(TOOL_CALL_REQUIRED)
+            return self.messages[-1].content or "没有可执行的内容或命令"
+
+        if self.parallel_tool_calls and len(self.tool_calls) > 1:
+            #同一步的多个工具调用并发执行,gather按原始顺序返回结果
+            outcomes = await asyncio.gather(*(self._run_tool_call(command) for command in self.tool_calls))
+        else:
+            outcomes = [await self._run_tool_call(command) for command in self.tool_calls]
+
+        results = []
+        for command, (result, base64_image) in zip(self.tool_calls, outcomes):
+            if self.max_observe:
+                result = result[: self.max_observe]
+            logger.info(f"智能体(工具调用)-工具'{command.function.name}'执行完成")
+            tool_msg = Message.tool_message(
+                content=result,
+                tool_call_id=command.id,
+                name=command.function.name,
+                base64_image=base64_image,
+            )
+            self.memory.add_message(tool_msg)
+            results.append(result)
+        return "\n\n".join(results)
+
+    async def _run_tool_call(self, command: ToolCall) -> Tuple[str, Optional[str]]:
+        """执行(或等待已提前启动的)工具调用,超过tool_timeout时取消并返回超时信息"""
+        pending = self._pending_tool_tasks.pop(command.id, None)
+        call = pending if pending else self._execute_tool_call(command)
+        if not self.tool_timeout:
+            return await call
+        try:
+            return await asyncio.wait_for(call, timeout=self.tool_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"智能体(工具调用)-工具'{command.function.name}'执行超过{self.tool_timeout}秒，已取消")
+            return f"错误：工具'{command.function.name}'执行超时（{self.tool_timeout}秒）", None
+
+    async def execute_tool(self, command: ToolCall) -> str:
+        """执行单个工具调用并返回观察结果"""
+        observation, base64_image = await self._execute_tool_call(command)
+        self._current_base64_image = base64_image
+        return observation
+
+    async def _execute_tool_call(self, command: ToolCall) -> Tuple[str, Optional[str]]:
+        """执行单个工具调用,返回(观察结果, base64图像);不修改共享状态,可安全并发"""
+        if not command or not command.function or not command.function.name:
+            return "错误：无效的命令格式", None
+        name = command.function.name
+        if name not in self.available_tools.tool_map:
+            return f"错误：未知工具'{name}'", None
+        try:
+            args = json.loads(command.function.arguments or "{}")
+            logger.info(f"智能体(工具调用)-正在执行工具：{name}")
+            start = time.perf_counter()
+            try:
+                result = await self.available_tools.execute(name=name, tool_input=args)
+            finally:
+                run = current_run.get()
+                if run is not None:
+                    run.record_tool(name, time.perf_counter() - start)
+            await self._handle_special_tool(name=name, result=result)
+
+            observation = (
+                f"执行命令`{name}`的观察结果：\n{self._shape_observation(name, str(result))}"
+                if result
+                else f"命令`{name}`执行完成，没有输出"
+            )
+            return observation, getattr(result, "base64_image", None)
+        except json.JSONDecodeError:
+            error_msg = f"解析{name}的参数出错：JSON格式无效"
+            logger.error(f"智能体(工具调用)-{error_msg}，参数：{command.function.arguments}")
+            return f"错误：{error_msg}", None
+        except Exception as e:
+            error_msg = f"工具'{name}'执行出错：{str(e)}"
+            logger.exception(f"智能体(工具调用)-{error_msg}")
+            return f"错误：{error_msg}", None
+
+    def _shape_observation(self, name: str, output: str) -> str:
+        """写入记忆之前按token上限整形工具输出"""
+        if not self.observation_max_tokens:
+            return output
+        shaper = ObservationShaper(self.observation_max_tokens, self.llm.count_tokens, dedupe=self.observation_dedupe)
+        return shaper.shape(output, keep_full=name != ReadObservation().name)
 
+    async def _handle_special_tool(self, name: str, result: Any, **kwargs):
+        """处理特殊工具的执行与状态变化"""
+        if not self._is_special_tool(name):
+            return
+        if self._should_finish_execution(name=name, result=result, **kwargs):
+            logger.info(f"智能体(工具调用)-特殊工具'{name}'结束了任务")
+            self.state = AgentState.FINISHED
 
+    @staticmethod
+    def _should_finish_execution(**kwargs) -> bool:
+        """判断工具执行后是否应结束智能体"""
+        return True
 
+    def _is_special_tool(self, name: str) -> bool:
+        """判断是否为特殊工具"""
+        return name.lower() in [n.lower() for n in self.special_tool_names]
@@ -0,0 +1,56 @@
+#批量运行的公共部分：任务解析与单个会话的执行(run_batch.py和工作进程共用)
+import json
+import time
+from typing import Optional
+
+from app.agent.cogniself import CogniSelf
+from app.logger import logger
+from app.scheduler import Priority
+from app.tool import Terminate, ToolCollection
+from app.tool.python_execute import PythonExecute
+from app.tool.read_observation import ReadObservation
+
+
+def default_tools() -> ToolCollection:
+    """批量运行时所有会话共享的工具集"""
+    return ToolCollection(PythonExecute(), ReadObservation(), Terminate())
+
+
+def parse_task(line: str, index: int) -> Optional[dict]:
+    """解析一行任务,空行返回None"""
+    line = line.strip()
+    if not line:
+        return None
+    task = json.loads(line)
+    if isinstance(task, str):
+        task = {"prompt": task}
+    if not isinstance(task, dict) or not task.get("prompt"):
+        raise ValueError(f"第{index}行缺少prompt")
+    task.setdefault("id", str(index))
+    return task
+
+
+async def run_session(task: dict, tools: ToolCollection, max_steps: Optional[int]) -> dict:
+    """运行一个会话并生成结果记录"""
+    agent = CogniSelf(available_tools=tools)
+    if max_steps:
+        agent.max_steps = max_steps
+    if task.get("priority"):
+        agent.priority = Priority[str(task["priority"]).upper()]
+
+    started_at = time.time()
+    record = {"id": task["id"], "session_id": agent.session_id, "started_at": started_at}
+    try:
+        result = await agent.run(task["prompt"])
+        final = next((m.content for m in reversed(agent.messages) if m.role == "assistant" and m.content), None)
+        record.update(status="ok", result=final, summary=result)
+    except Exception as e:
+        logger.exception(f"批量运行-任务{task['id']}失败：{e}")
+        record.update(status="error", error=f"{type(e).__name__}: {e}")
+    finally:
+        agent.close()
+    record["duration"] = time.time() - started_at
+    record["steps"] = agent.current_step
+    if agent.accounting:
+        record["usage"] = agent.accounting.totals()
+    return record
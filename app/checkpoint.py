@@ -0,0 +1,118 @@
+#检查点模块：每一步结束后把智能体状态增量追加到磁盘,崩溃后可从最后完成的步骤继续
+import json
+from collections import deque
+from itertools import islice
+from pathlib import Path
+from typing import Deque, List, Optional, Union
+
+from app.logger import logger
+from app.schema import Memory, Message, ToolCall
+
+
+class Checkpoint:
+    """
+    单个会话的检查点文件(JSON Lines,只追加)。
+    第一行为会话信息,之后每完成一步追加一行：
+        {"type": "step", "step": 3, "state": "RUNNING", "drop": 0, "keep": 12, "append": [...], "tool_calls": [...]}
+    表示在上一步的消息列表上丢弃开头drop条、保留随后keep条,再追加append中的新消息。
+    通常只有本步新增的消息被写入;截断或上下文压缩改写了旧消息时,只重写发生变化的部分。
+    崩溃时写了一半的最后一行在加载时被截掉。
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._persisted: Deque[Message] = deque()  #已写入磁盘的消息,与Memory中的对象相同
+        self._revision = -1  #上次写入时Memory的revision和dropped_count,-1表示尚未同步
+        self._dropped = 0
+
+    @classmethod
+    def for_session(cls, directory: Union[str, Path], session_id: str) -> "Checkpoint":
+        return cls(Path(directory) / f"{session_id}.jsonl")
+
+    def start(self, session_id: str, agent_name: str) -> None:
+        """新文件写入会话信息;已存在时(恢复后继续运行)直接在末尾追加"""
+        if not self.path.exists():
+            self._append({"type": "session", "session_id": session_id, "agent": agent_name})
+
+    def save_step(self, step: int, state: str, memory: Memory, tool_calls: List[ToolCall]) -> None:
+        """追加一步的增量;写入量只与本步新增(或被改写)的消息数成正比"""
+        messages = memory.messages
+        previous = len(self._persisted)
+        if memory.revision == self._revision:
+            #只有追加和头部淘汰：由Memory的计数直接得出增量,不需要比较消息
+            drop = min(memory.dropped_count - self._dropped, previous)
+            keep = previous - drop
+        else:
+            #消息被整体替换(如上下文压缩)：按对象身份找出仍然有效的部分
+            drop = next((i for i, m in enumerate(self._persisted) if messages and m is messages[0]), previous)
+            keep = 0
+            for old, new in zip(islice(self._persisted, drop, None), messages):
+                if old is not new:
+                    break
+                keep += 1
+        appended = list(islice(reversed(messages), len(messages) - keep))[::-1]
+        self._append(
+            {
+                "type": "step",
+                "step": step,
+                "state": state,
+                "drop": drop,
+                "keep": keep,
+                "append": [m.model_dump(exclude_none=True) for m in appended],
+                "tool_calls": [call.model_dump() for call in tool_calls],
+            }
+        )
+        for _ in range(drop):
+            self._persisted.popleft()
+        while len(self._persisted) > keep:
+            self._persisted.pop()
+        self._persisted.extend(appended)
+        self._sync(memory)
+
+    def _sync(self, memory: Memory) -> None:
+        self._revision = memory.revision
+        self._dropped = memory.dropped_count
+
+    def load(self) -> Optional[dict]:
+        """重放文件,返回最后完成的步骤(含完整消息列表);文件不存在或没有步骤时返回None"""
+        if not self.path.exists():
+            return None
+        messages: List[Message] = []
+        last: Optional[dict] = None
+        session: dict = {}
+        offset, complete = 0, True
+        with self.path.open("rb") as f:
+            for line in f:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("记录不完整")
+                    entry = json.loads(line)
+                except ValueError:  #json.JSONDecodeError是ValueError的子类
+                    complete = False
+                    break
+                offset += len(line)
+                if entry["type"] == "session":
+                    session = entry
+                    continue
+                messages = messages[entry["drop"]:][: entry["keep"]] + [Message(**m) for m in entry["append"]]
+                last = entry
+        if not complete:
+            #崩溃时写了一半的记录：截掉,之后的追加才能被正确读取
+            logger.warning(f"检查点-丢弃不完整的记录：{self.path}")
+            with self.path.open("r+b") as f:
+                f.truncate(offset)
+        if last is None:
+            return None
+        self._persisted = deque(messages)
+        return {
+            **session,
+            "step": last["step"],
+            "state": last["state"],
+            "messages": messages,
+            "tool_calls": [ToolCall(**call) for call in last["tool_calls"]],
+        }
+
+    def _append(self, entry: dict) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with self.path.open("a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n")
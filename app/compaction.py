@@ -0,0 +1,85 @@
+#上下文压缩模块：按token预算压缩Memory,保证每一步的输入token有上限
+from typing import List
+
+from app.logger import logger
+from app.schema import Memory, Message, Role
+
+
+def group_turns(messages: List[Message]) -> List[List[Message]]:
+    """
+    将消息划分为不可拆分的单元：
+    带tool_calls的assistant消息与紧随其后的对应tool消息构成一个单元,其他消息各自成为一个单元。
+    压缩和截断都以单元为粒度,从而不会把工具调用与其结果拆开。
+    """
+    groups: List[List[Message]] = []
+    for message in messages:
+        if (
+            message.role == Role.TOOL
+            and groups
+            and groups[-1][0].tool_calls
+            and message.tool_call_id in {call.id for call in groups[-1][0].tool_calls}
+        ):
+            groups[-1].append(message)
+        else:
+            groups.append([message])
+    return groups
+
+
+class ContextCompactor:
+    """
+    在每次ask_tool之前运行的token预算压缩。
+    1. 保留第一条用户请求和最近keep_recent个单元原样不动;
+    2. 更早的工具观察结果替换为存根(保留开头stub_chars个字符并注明原始token数);
+    3. 仍超出预算时,从最早的单元开始整体丢弃;
+    4. 若最近的单元本身就超出预算,除最后一个单元外的观察结果同样替换为存根。
+    系统提示由ask_tool单独传入,不在Memory中,因此始终保留。
+    """
+
+    STUB_PREFIX = "...[已压缩："
+    STUB_MARKER = STUB_PREFIX + "原始观察结果约{tokens}个token]"
+
+    def __init__(self, keep_recent: int = 6, stub_chars: int = 200):
+        self.keep_recent = keep_recent
+        self.stub_chars = stub_chars
+
+    def compact(self, memory: Memory, budget: int) -> bool:
+        """将memory压缩到budget个token以内,返回是否做了修改"""
+        if memory.token_counter is None or memory.total_tokens <= budget:
+            return False
+        before = memory.total_tokens
+        groups = group_turns(memory.messages)
+        head = groups[:1] if groups and groups[0][0].role == Role.USER else []
+        body = groups[len(head):]
+        recent = body[-self.keep_recent:] if self.keep_recent else []
+        older = body[: len(body) - len(recent)]
+
+        older = [[self._stub(message, memory) for message in group] for group in older]
+        total = sum(memory.token_counter(m) for group in head + older + recent for m in group)
+
+        #仍超出预算：按单元整体丢弃最早的内容
+        while older and total > budget:
+            total -= sum(memory.token_counter(m) for m in older.pop(0))
+
+        #最近的单元本身已超出预算：除最后一个单元外,观察结果也改为存根
+        if total > budget and len(recent) > 1:
+            recent = [[self._stub(m, memory) for m in group] for group in recent[:-1]] + recent[-1:]
+
+        memory.replace_messages([m for group in head + older + recent for m in group])
+        logger.info(f"上下文压缩-token数：{before} -> {memory.total_tokens}（预算：{budget}）")
+        return True
+
+    def _stub(self, message: Message, memory: Memory) -> Message:
+        if (
+            message.role != Role.TOOL
+            or not message.content
+            or len(message.content) <= self.stub_chars
+            or self.STUB_PREFIX in message.content
+        ):
+            return message.model_copy(update={"base64_image": None}) if message.base64_image else message
+        tokens = memory.token_counter(message)
+        return message.model_copy(
+            update={
+                "content": message.content[: self.stub_chars] + self.STUB_MARKER.format(tokens=tokens),
+                "base64_image": None,
+            }
+        )
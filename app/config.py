@@ -24,6 +24,19 @@ class LLMSettings(BaseModel):
     temperature: float = Field(1.0, description="模型生成的文本的随机性")
     api_type: str = Field(..., description="Azure,Openai, or Ollama")
     api_version: str = Field(..., description="模型API版本")
+    requests_per_minute: Optional[int] = Field(None, description="每分钟最大请求数,None表示不限制")
+    tokens_per_minute: Optional[int] = Field(None, description="每分钟最大token数,None表示不限制")
+    max_concurrent_requests: Optional[int] = Field(None, description="同一接口地址的最大并发请求数")
+    max_connections: int = Field(100, description="HTTP连接池最大连接数")
+    max_keepalive_connections: int = Field(20, description="HTTP连接池保持活动的最大空闲连接数")
+    keepalive_expiry: float = Field(60.0, description="空闲连接保持时间，单位为秒")
+    connect_timeout: float = Field(10.0, description="建立连接的超时时间，单位为秒")
+    http2: bool = Field(False, description="是否启用HTTP/2(需要安装h2)")
+    warmup_connections: int = Field(0, description="启动时预先建立的连接数，0表示不预热")
+    max_retries: int = Field(3, description="可重试错误(超时、429、5xx)的最大重试次数")
+    retry_max_wait: float = Field(20.0, description="单次重试的最长等待时间，Retry-After超过该值时不再重试")
+    circuit_failure_threshold: int = Field(5, description="连续失败多少次后熔断该接口")
+    circuit_reset_timeout: float = Field(30.0, description="熔断后多少秒进入半开探测")
     print("LLMSettings方法调用结束")
 
 class ProxySettings(BaseModel):
@@ -33,9 +46,11 @@ class ProxySettings(BaseModel):
 
 class SearchSettings(BaseModel):
     engine: str = Field(default="Baidu",description="要使用的LMM搜索引擎")
-    fallback_engines: List[str] = Field(default=lambda: ["Google", "Bing"],description="备用搜索引擎列表")
-    retry_delay: int = Field(default=60,description="搜索失败后重试间隔，单位为秒")
-    max_retries: int = Field(default=3,description="搜索失败后最大重试次数")
+    fallback_engines: List[str] = Field(default_factory=lambda: ["Google", "Bing"],description="备用搜索引擎列表")
+    retry_delay: float = Field(default=1.0,description="所有引擎都失败后重试间隔，单位为秒(正在熔断的引擎会被跳过，不需要长时间等待)")
+    max_retries: int = Field(default=3,description="所有引擎都失败后最大重试次数")
+    hedge_delay: float = Field(default=1.0,description="当前引擎多少秒内没有结果时并行启动下一个引擎(对冲请求)，0表示所有引擎同时搜索")
+    timeout: float = Field(default=10.0,description="单次搜索(所有引擎合计)的超时时间，单位为秒")
 
 class BrowserSettings(BaseModel):
     headless: bool = Field(False, description="是否在隐藏模式下运行浏览器")
@@ -55,6 +70,30 @@ class SandboxSettings(BaseModel):#xss沙箱配置
     cpu_limit: float = Field(1.0,description="沙箱CPU限制")
     timeout: int = Field(300,description="沙箱超时时间")
     network_enabled: bool = Field(False,description="是否允许网络访问")
+    pids_limit: int = Field(64,description="沙箱内的进程/线程数上限(防止fork炸弹)")
+
+class MemorySettings(BaseModel):#会话记忆配置
+    store_dir: Optional[str] = Field(None, description="落盘消息存储目录(每个会话一个SQLite文件)，None表示消息只保存在内存中")
+    resident_messages: int = Field(100, description="启用落盘存储时常驻内存的最近消息数")
+    resident_token_budget: Optional[int] = Field(None, description="启用落盘存储时常驻窗口的token预算")
+
+class PythonExecuteSettings(BaseModel):#python代码执行配置
+    pool_size: int = Field(4, description="预启动的解释器进程数上限,同时也是代码并发执行数的上限")
+    preload_modules: List[str] = Field(
+        default_factory=lambda: ["json", "math", "re", "datetime", "collections", "statistics", "numpy", "pandas"],
+        description="解释器进程启动时预先导入的模块(未安装的会被跳过)",
+    )
+    max_tasks_per_worker: int = Field(100, description="每个解释器进程执行多少次后回收重建,防止状态和内存泄漏累积")
+    persistent_kernels: bool = Field(False, description="是否为每个会话保留一个常驻解释器(全局变量在多次调用之间保留)")
+    max_kernels: int = Field(8, description="常驻解释器的最大数量,超出时回收最久未使用的;不计入pool_size,解释器进程总数最多为pool_size+max_kernels")
+    kernel_memory_limit_mb: int = Field(2048, description="常驻解释器的内存上限(MB),执行后超出则回收")
+    kernel_idle_timeout: float = Field(600.0, description="常驻解释器空闲多少秒后回收")
+    max_output_bytes: int = Field(1_048_576, description="每次执行的stdout和stderr各自保留的最大字节数(保留开头和结尾)")
+
+class ToolCacheSettings(BaseModel):#工具结果缓存配置
+    enabled: bool = Field(True, description="是否缓存可缓存工具(cacheable=True,如搜索)的结果")
+    max_entries: int = Field(1024, description="内存中缓存的最大结果数,超出时淘汰最久未使用的")
+    disk_path: Optional[str] = Field(None, description="磁盘缓存(SQLite)文件路径,多个工作进程可共享同一个文件;None表示只缓存在内存中")
 
 class AppConfig(BaseModel):
     llm: Dict[str, LLMSettings]
@@ -67,6 +106,15 @@ class AppConfig(BaseModel):
     search_config: Optional[SearchSettings] = Field(
         None, description="Search configuration"
     )
+    memory_config: MemorySettings = Field(
+        default_factory=MemorySettings, description="Memory configuration"
+    )
+    python_config: PythonExecuteSettings = Field(
+        default_factory=PythonExecuteSettings, description="Python execution configuration"
+    )
+    tool_cache_config: ToolCacheSettings = Field(
+        default_factory=ToolCacheSettings, description="Tool result cache configuration"
+    )
 
     class Config:
         arbitrary_types_allowed = True
@@ -123,6 +171,19 @@ class Config:                     #Config代表配置类
             "temperature": base_llm.get("temperature", 1.0),
             "api_type": base_llm.get("api_type", ""),
             "api_version": base_llm.get("api_version", ""),
+            "requests_per_minute": base_llm.get("requests_per_minute"),
+            "tokens_per_minute": base_llm.get("tokens_per_minute"),
+            "max_concurrent_requests": base_llm.get("max_concurrent_requests"),
+            "max_connections": base_llm.get("max_connections", 100),
+            "max_keepalive_connections": base_llm.get("max_keepalive_connections", 20),
+            "keepalive_expiry": base_llm.get("keepalive_expiry", 60.0),
+            "connect_timeout": base_llm.get("connect_timeout", 10.0),
+            "http2": base_llm.get("http2", False),
+            "warmup_connections": base_llm.get("warmup_connections", 0),
+            "max_retries": base_llm.get("max_retries", 3),
+            "retry_max_wait": base_llm.get("retry_max_wait", 20.0),
+            "circuit_failure_threshold": base_llm.get("circuit_failure_threshold", 5),
+            "circuit_reset_timeout": base_llm.get("circuit_reset_timeout", 30.0),
         }
 
         # handle browser config.
@@ -168,6 +229,10 @@ class Config:                     #Config代表配置类
         else:
             sandbox_settings = SandboxSettings()
 
+        memory_settings = MemorySettings(**raw_config.get("memory", {}))
+        python_settings = PythonExecuteSettings(**raw_config.get("python", {}))
+        tool_cache_settings = ToolCacheSettings(**raw_config.get("tool_cache", {}))
+
         config_dict = {
             "llm": {
                 "default": default_settings,
@@ -179,6 +244,9 @@ class Config:                     #Config代表配置类
             "sandbox": sandbox_settings,
             "browser_config": browser_settings,
             "search_config": search_settings,
+            "memory_config": memory_settings,
+            "python_config": python_settings,
+            "tool_cache_config": tool_cache_settings,
         }
 
         self._config = AppConfig(**config_dict)
@@ -187,6 +255,26 @@ class Config:                     #Config代表配置类
     def llm(self) -> Dict[str,LLMSettings]:
         return self._config.llm  #返回配置信息中的llm部分。
 
+    @property
+    def memory(self) -> MemorySettings:
+        return self._config.memory_config
+
+    @property
+    def search_config(self) -> Optional[SearchSettings]:
+        return self._config.search_config
+
+    @property
+    def sandbox(self) -> SandboxSettings:
+        return self._config.sandbox
+
+    @property
+    def python(self) -> PythonExecuteSettings:
+        return self._config.python_config
+
+    @property
+    def tool_cache(self) -> ToolCacheSettings:
+        return self._config.tool_cache_config
+
     @property
     def workspace_root(self) -> Path:
         return WORKSPACE_ROOT
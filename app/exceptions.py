@@ -2,4 +2,15 @@
 class ToolError(Exception):
     """当工具遇到错误是引发"""
     def __init__(self, message):
-        self.message = message
\ No newline at end of file
+        self.message = message
+
+class TokenLimitExceeded(Exception):
+    """当请求超出模型的token限制时引发"""
+
+
+class CircuitOpenError(Exception):
+    """当LLM接口处于熔断状态、请求被快速拒绝时引发"""
+
+
+class SearchError(Exception):
+    """当所有搜索引擎都失败或处于熔断状态时引发"""
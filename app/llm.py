@@ -1,14 +1,28 @@
+import asyncio
+import hashlib
+import importlib.util
+import json
 import math
+import time
+from collections import OrderedDict
+from itertools import chain
 
+import httpx
 import tiktoken
-from typing import Dict, Optional, List, Union
-from openai import OpenAI, AsyncOpenAI, OpenAIError
+from typing import AsyncIterator, Dict, Iterable, Literal, Optional, List, Tuple, Union
+from openai import OpenAI, AsyncOpenAI, DefaultAsyncHttpxClient, OpenAIError
+from openai.types.chat import ChatCompletion
+from pydantic import BaseModel, Field
 from openai.types.chat.chat_completion_message import ChatCompletionMessage
-from tenacity import retry, wait_random_exponential, stop_after_attempt, retry_if_exception_type
 
+from app.accounting import current_run
+from app.exceptions import CircuitOpenError, TokenLimitExceeded
 from app.logger import logger
 from app.config import config,LLMSettings
-from app.schema import Message, ToolChoice, TOOL_CHOICE_TYPE, TOOL_CHOICE_VALUES
+from app.resilience import CircuitBreaker, RetryPolicy
+from app.scheduler import LLMScheduler
+from app.tracing import tracer
+from app.schema import Function, Message, ToolCall, ToolChoice, ROLE_VALUES, TOOL_CHOICE_TYPE, TOOL_CHOICE_VALUES
 
 REASONING_MODELS=["R1"]#推理模型
 MULTIMODAL_MODELS=["Align-DS-V"]#多模态模型
@@ -22,8 +36,13 @@ class TokenCounter:
     HIGH_DETAIL_TARGET_SHORT_SIDE = 768
     TILE_SIZE = 512
 
+    MESSAGE_CACHE_SIZE = 4096 #单条消息token缓存的最大条目数
+    TOOLS_CACHE_SIZE = 16 #工具列表token缓存的最大条目数
+
     def __init__(self, tokenizer):
         self.tokenizer = tokenizer
+        self._message_cache: OrderedDict[str, int] = OrderedDict() #消息内容哈希 -> token数量
+        self._tools_cache: OrderedDict[str, int] = OrderedDict() #工具列表JSON -> token数量
 
     def count_text(self, text: str) -> int:
         #计算文本的token数量
@@ -92,19 +111,184 @@ class TokenCounter:
                 token_count += self.count_text(function.get("arguments",""))
         return token_count
 
+    def count_tools(self, tools: List[dict]) -> int:
+        #计算工具列表的token数量;优先使用工具注册表预先序列化的JSON(同一版本是同一个字符串,哈希值已缓存)
+        text = getattr(tools, "json", None) or json.dumps(tools, ensure_ascii=False)
+        cached = self._tools_cache.get(text)
+        if cached is not None:
+            self._tools_cache.move_to_end(text)
+            return cached
+        tokens = self._tools_cache[text] = self.count_text(text)
+        if len(self._tools_cache) > self.TOOLS_CACHE_SIZE:
+            self._tools_cache.popitem(last=False)
+        return tokens
+
+    @staticmethod
+    def _message_key(message: dict) -> str:
+        """按消息内容生成缓存键,内容相同的消息只编码一次"""
+        raw = json.dumps(message, sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def count_message_tokens(self, message: dict) -> int:
+        #计算单条消息的token数量,结果按内容哈希缓存
+        key = self._message_key(message)
+        cached = self._message_cache.get(key)
+        if cached is not None:
+            self._message_cache.move_to_end(key)
+            return cached
+
+        tokens = self.count_message_tokens_uncached(message)
+        self._message_cache[key] = tokens
+        if len(self._message_cache) > self.MESSAGE_CACHE_SIZE:
+            self._message_cache.popitem(last=False) #淘汰最久未使用的条目
+        return tokens
+
+    def count_message_tokens_uncached(self, message: dict) -> int:
+        #计算单条消息的token数量(调用方自行缓存,如Message对象)
+        tokens = self.BASE_MESSAGE_TOKENS #基础消息token
+        tokens += self.count_text(message.get("role", "")) #角色token
+        if "content" in message:
+            tokens += self.count_content(message["content"]) #消息内容token
+        if "tool_calls" in message:
+            tokens += self.count_tool_call(message["tool_calls"]) #工具调用token
+        tokens += self.count_text(message.get("name", ""))
+        tokens += self.count_text(message.get("tool_call_id", ""))
+        return tokens
 
     def count_messages_tokens(self, messages: List[dict]) -> int:
-        #计算消息的token数量
+        #计算消息列表的token数量
         total_tokens = self.FORMAT_TOKENS #格式化token
         for message in messages:
-            tokens = self.BASE_MESSAGE_TOKENS #基础消息token
+            total_tokens += self.count_message_tokens(message)
+        return total_tokens
+
+
+def parse_partial_json(text: str) -> Optional[dict]:
+    """容错解析流式输出中尚未完整的JSON参数。
+
+    补齐未闭合的字符串与括号后再尝试解析,仍无法解析时返回None。
+    用于在工具参数仍在生成时预览已到达的字段。
+    """
+    if not text or not text.strip():
+        return {}
+    try:
+        value = json.loads(text)
+        return value if isinstance(value, dict) else None
+    except json.JSONDecodeError:
+        pass
+
+    closers = []  #待补齐的闭合符号
+    in_string = False
+    escaped = False
+    string_is_key = False  #当前(或最后一个)字符串是否处于对象键的位置
+    previous = ""  #字符串之外最近的一个非空白字符
+    for char in text:
+        if in_string:
+            if escaped:
+                escaped = False
+            elif char == "\\":
+                escaped = True
+            elif char == '"':
+                in_string = False
+                previous = '"'
+            continue
+        if char.isspace():
+            continue
+        if char == '"':
+            in_string = True
+            string_is_key = bool(closers) and closers[-1] == "}" and previous in "{,"
+        elif char in "{[":
+            closers.append("}" if char == "{" else "]")
+        elif char in "}]" and closers:
+            closers.pop()
+        previous = char
+
+    repaired = text.rstrip()
+    if in_string:
+        repaired += '"'
+        previous = '"'
+    if previous == "," :
+        repaired = repaired[:-1]
+    elif previous == ":":
+        repaired += "null"  #键已到达但值尚未生成
+    elif previous == '"' and string_is_key:
+        repaired += ":null"
+    repaired += "".join(reversed(closers))
+    try:
+        value = json.loads(repaired)
+        return value if isinstance(value, dict) else None
+    except json.JSONDecodeError:
+        return None
+
+
+class ToolCallAssembler:
+    """将流式返回的tool_calls片段按index拼装为完整的ToolCall"""
+
+    def __init__(self):
+        self._calls: Dict[int, dict] = {}  #index -> {"id","name","arguments"}
+        self._completed: set = set()  #已经完成(参数JSON完整)的index
+
+    def add_delta(self, delta_tool_calls) -> List[ToolCall]:
+        """合并一批片段,返回本次新完成的工具调用(按index顺序)"""
+        for fragment in delta_tool_calls or []:
+            call = self._calls.setdefault(fragment.index, {"id": "", "name": "", "arguments": ""})
+            if fragment.id:
+                call["id"] = fragment.id
+            if fragment.function:
+                if fragment.function.name:
+                    call["name"] += fragment.function.name
+                if fragment.function.arguments:
+                    call["arguments"] += fragment.function.arguments
+
+        #模型按顺序生成工具调用,后一个开始意味着前面的都已完整
+        newest = max(self._calls) if self._calls else -1
+        ready = [i for i in sorted(self._calls) if i not in self._completed and (i < newest or self._is_complete(i))]
+        return self._mark_completed(ready)
+
+    def finish(self) -> List[ToolCall]:
+        """流结束时返回尚未交付的全部工具调用"""
+        return self._mark_completed([i for i in sorted(self._calls) if i not in self._completed])
+
+    def partial_arguments(self, index: int) -> Optional[dict]:
+        """预览仍在生成中的工具参数"""
+        call = self._calls.get(index)
+        return parse_partial_json(call["arguments"]) if call else None
+
+    @property
+    def tool_calls(self) -> List[ToolCall]:
+        """到目前为止拼装出的全部工具调用"""
+        return [self._to_tool_call(i) for i in sorted(self._calls)]
+
+    def _is_complete(self, index: int) -> bool:
+        #参数为空时还不能判断是否完整(首个片段通常只带id和name),无参数的调用在后一个调用开始或流结束时交付
+        call = self._calls[index]
+        if not call["id"] or not call["name"]:
+            return False
+        try:
+            return isinstance(json.loads(call["arguments"]), dict)
+        except json.JSONDecodeError:
+            return False
+
+    def _mark_completed(self, indexes: List[int]) -> List[ToolCall]:
+        self._completed.update(indexes)
+        return [self._to_tool_call(i) for i in indexes]
+
+    def _to_tool_call(self, index: int) -> ToolCall:
+        call = self._calls[index]
+        return ToolCall(id=call["id"], function=Function(name=call["name"], arguments=call["arguments"]))
+
+
+class LLMStreamEvent(BaseModel):
+    """ask_tool_stream产生的事件"""
+    type: Literal["content", "tool_call", "done"]
+    content: Optional[str] = None  #content事件为增量文本,done事件为完整文本
+    tool_call: Optional[ToolCall] = None  #tool_call事件:参数已完整的单个工具调用
+    tool_calls: List[ToolCall] = Field(default_factory=list)  #done事件:全部工具调用
 
-            tokens += self.count_text(message.get("role", "")) #消息内容token
 
-            if "content" in message:
-                tokens += self.count_conten(message["content"])
 class LLM:
     _instances: Dict[str, "LLM"] = {}#私有实例
+    _http_clients: Dict[tuple, httpx.AsyncClient] = {}#按接口地址和连接池配置共享的HTTP客户端
     def __new__(cls, config_name: str = "default", llm_config: Optional[LLMSettings]=None):#用于创建实例的特殊方法，在__init__之前调用
         if config_name not in cls._instances:
             instance = super().__new__(cls)
@@ -131,25 +315,237 @@ class LLM:
                 self.tokenizer = tiktoken.encoding_for_model(self.model)
             except KeyError:
                 self.tokenizer = tiktoken.get_encoding("cl100k_base")
-            self.client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url)
+            self.connect_timeout = llm_config.connect_timeout
+            self.warmup_connections = llm_config.warmup_connections
+            self._warmed = False
+            self.http_client = self._get_http_client(llm_config)
+            #重试由retry_policy统一负责,关闭openai客户端自带的重试
+            self.client = AsyncOpenAI(
+                api_key=self.api_key, base_url=self.base_url, http_client=self.http_client, max_retries=0
+            )
+            self.retry_policy = RetryPolicy(
+                CircuitBreaker.for_endpoint(
+                    self.base_url,
+                    failure_threshold=llm_config.circuit_failure_threshold,
+                    reset_timeout=llm_config.circuit_reset_timeout,
+                ),
+                max_retries=llm_config.max_retries,
+                max_wait=llm_config.retry_max_wait,
+            )
             self.tokens_counter = TokenCounter(self.tokenizer)
+            #同一接口地址的所有实例共享限流与公平调度
+            self.scheduler = LLMScheduler.for_endpoint(
+                self.base_url,
+                requests_per_minute=llm_config.requests_per_minute,
+                tokens_per_minute=llm_config.tokens_per_minute,
+                max_concurrent_requests=llm_config.max_concurrent_requests,
+            )
+
+    @classmethod
+    def _get_http_client(cls, llm_config: LLMSettings) -> httpx.AsyncClient:
+        """获取共享的HTTP客户端,接口地址与连接池配置相同的实例复用同一个连接池"""
+        http2 = llm_config.http2
+        if http2 and importlib.util.find_spec("h2") is None:
+            logger.warning("未安装h2，HTTP/2不可用，回退到HTTP/1.1")
+            http2 = False
+        key = (
+            llm_config.base_url,
+            llm_config.max_connections,
+            llm_config.max_keepalive_connections,
+            llm_config.keepalive_expiry,
+            llm_config.connect_timeout,
+            http2,
+        )
+        if key not in cls._http_clients:
+            cls._http_clients[key] = DefaultAsyncHttpxClient(
+                limits=httpx.Limits(
+                    max_connections=llm_config.max_connections,
+                    max_keepalive_connections=llm_config.max_keepalive_connections,
+                    keepalive_expiry=llm_config.keepalive_expiry,
+                ),
+                timeout=httpx.Timeout(300, connect=llm_config.connect_timeout),
+                http2=http2,
+            )
+        return cls._http_clients[key]
+
+    async def warmup(self) -> None:
+        """
+        预热连接池：并发向base_url发起轻量请求,提前完成TCP/TLS握手,
+        使第一次think()无需承担建连开销。warmup_connections为0时不做任何事。
+        """
+        if self._warmed or self.warmup_connections <= 0:
+            return
+        self._warmed = True
+        url = f"{self.base_url.rstrip('/')}/models"
+        headers = {"Authorization": f"Bearer {self.api_key}"}
+
+        async def _open_connection():
+            try:
+                await self.http_client.get(url, headers=headers, timeout=self.connect_timeout)
+            except httpx.HTTPError as e:
+                logger.warning(f"LLM连接预热失败：{e}")
+
+        start = time.perf_counter()
+        await asyncio.gather(*(_open_connection() for _ in range(self.warmup_connections)))
+        logger.info(f"LLM连接预热完成：{self.warmup_connections}个连接，耗时{time.perf_counter() - start:.3f}秒")
+
+    def count_tokens(self, text: str) -> int:
+        #计算文本的token数量
+        return self.tokens_counter.count_text(text)
+
+    def count_tools(self, tools: Optional[List[dict]]) -> int:
+        #计算工具列表(请求中的tools)的token数量
+        return self.tokens_counter.count_tools(tools) if tools else 0
+
+    def count_message_tokens(self, message: Union[dict, Message]) -> int:
+        #计算单条消息的token数量(带缓存),供Memory维护累计token数
+        if not isinstance(message, Message):
+            return self.tokens_counter.count_message_tokens(message)
+        #Message不可变,按模型缓存在消息上:与请求中一致,按格式化后的形式(含图像)计数,不会发送的空消息计为0
+        return message.cached_tokens(self.model, self._count_formatted_tokens)
+
+    def _count_formatted_tokens(self, message: Message) -> int:
+        formatted = self.format_messages([message], self.model in MULTIMODAL_MODELS)
+        return self.tokens_counter.count_message_tokens_uncached(formatted[0]) if formatted else 0
+
+    def count_messages_tokens(self, messages: Iterable[Union[dict, Message]]) -> int:
+        #计算消息列表的token数量(带缓存)
+        return self.tokens_counter.FORMAT_TOKENS + sum(self.count_message_tokens(m) for m in messages)
+
+    def update_token_count(self, input_tokens: int, completion_tokens: int = 0) -> None:
+        #更新累计token数量
+        self.total_input_tokens += input_tokens
+        self.total_output_tokens += completion_tokens
+        run = current_run.get()  #进程级累计会被并发会话共享,按会话的用量记入current_run
+        if run is not None:
+            run.record_llm_usage(input_tokens, completion_tokens)
+        logger.info(
+            f"Token使用情况：输入={input_tokens}，输出={completion_tokens}，"
+            f"累计输入={self.total_input_tokens}，累计输出={self.total_output_tokens}"
+        )
 
     def check_token_limit(self,input_tokens:int) -> bool:
+        #max_input_tokens是单次请求的上限(模型的上下文长度),累计用量由update_token_count记录
         if self.max_input_tokens is not None:
-            return (self.total_input_tokens + input_tokens) <= self.max_input_tokens
+            return input_tokens <= self.max_input_tokens
         return True
 
+    def get_limit_error_message(self, input_tokens: int) -> str:
+        #生成超出token限制时的错误信息
+        if self.max_input_tokens is not None and input_tokens > self.max_input_tokens:
+            return f"请求超出输入token限制(需要：{input_tokens}，最大：{self.max_input_tokens})"
+        return "超出token限制"
+
     @staticmethod
     def format_messages(messages: List[Union[dict, Message]],supports_images: bool = False) -> List[dict]:
         formatted_messages =[]
+        for message in messages:
+            if isinstance(message, Message):
+                message = message.to_dict()
+            if not isinstance(message, dict):
+                raise TypeError(f"不支持的消息类型: {type(message)}")
+            if "role" not in message:
+                raise ValueError("消息字典必须包含'role'字段")
+
+            if message.get("base64_image"):
+                if supports_images:
+                    #将base64图像转换为多模态content格式
+                    content = message.get("content")
+                    if not content:
+                        content = []
+                    elif isinstance(content, str):
+                        content = [{"type": "text", "text": content}]
+                    content.append(
+                        {
+                            "type": "image_url",
+                            "image_url": {"url": f"data:image/jpeg;base64,{message['base64_image']}"},
+                        }
+                    )
+                    message = {**message, "content": content}
+                message = {k: v for k, v in message.items() if k != "base64_image"}
+
+            if "content" in message or "tool_calls" in message:
+                formatted_messages.append(message)
+
+        for message in formatted_messages:
+            if message["role"] not in ROLE_VALUES:
+                raise ValueError(f"无效的角色: {message['role']}")
+        return formatted_messages
+
+    def _prepare_tool_request(
+        self,
+        messages: List[Union[dict, Message]],
+        system_msgs: Optional[List[Union[dict, Message]]],
+        timeout: int,
+        tools: Optional[List[dict]],
+        tool_choice: TOOL_CHOICE_TYPE,  # type: ignore
+        temperature: Optional[float],
+        message_tokens: Optional[int] = None,
+        **kwargs,
+    ) -> Tuple[dict, int]:
+        """校验并格式化工具调用请求,返回请求参数和输入token数量(ask_tool与ask_tool_stream共用)"""
+        #验证工具选择
+        logger.info(f"智能体(工具调用)-执行操作：验证工具选择")
+        if tool_choice not in TOOL_CHOICE_VALUES:
+            raise ValueError(f"无效的工具选择: {tool_choice}")
+
+        logger.info(f"智能体(工具调用)-执行操作：检查该模型是否支持图像")
+        #检查该模型是否支持图像
+        supports_images = self.model in MULTIMODAL_MODELS
+
+        #计算token数量：调用方传入message_tokens(如Memory.total_tokens)时只计算系统消息,否则逐条累加(Message上缓存了token数,不会重复编码)
+        if message_tokens is None:
+            input_tokens = self.count_messages_tokens(chain(system_msgs or [], messages))
+        else:
+            input_tokens = self.count_messages_tokens(system_msgs or []) + message_tokens
+
+        #格式化消息
+        logger.info(f"智能体(工具调用)-执行操作：格式化消息")
+        if  system_msgs:
+            logger.info(f"智能体(工具调用)-执行操作：添加系统消息")
+            system_msgs = self.format_messages(system_msgs, supports_images)
+            messages = system_msgs + self.format_messages(messages, supports_images)
+        else:
+            logger.info(f"智能体(工具调用)-执行操作：没有系统消息")
+            messages = self.format_messages(messages, supports_images)
+
+        input_tokens += self.count_tools(tools)
+        if not self.check_token_limit(input_tokens):
+            raise TokenLimitExceeded(self.get_limit_error_message(input_tokens))
+
+        #验证工具
+        if tools:
+            for tool in tools:
+                if not isinstance(tool, dict) or "type" not in tool:
+                    raise ValueError("每个工具必须是包含'type'字段的字典")
+
+        params = {
+            "model": self.model,
+            "messages": messages,
+            "tools": tools,
+            "tool_choice": tool_choice,
+            "timeout": timeout,
+            **kwargs,
+        }
+        if self.model in REASONING_MODELS:
+            params["max_completion_tokens"] = self.max_tokens
+        else:
+            params["max_tokens"] = self.max_tokens
+            params["temperature"] = temperature if temperature is not None else self.temperature
+        return params, input_tokens
+
+    async def _create_completion(self, params: dict, input_tokens: int) -> ChatCompletion:
+        """发送一次非流式请求(经过调度器排队),每次重试都会重新排队"""
+        async with self.scheduler.slot(tokens=input_tokens):
+            start = time.perf_counter()
+            try:
+                with tracer.span("llm.request", model=self.model):  #与外层llm.ask_tool的间隔即排队时间
+                    return await self.client.chat.completions.create(**params, stream=False)
+            finally:
+                run = current_run.get()
+                if run is not None:
+                    run.record_llm_call(time.perf_counter() - start)
 
-    @retry(
-        wait=wait_random_exponential(min=1, max=60),
-        stop=stop_after_attempt(6),
-        retry=retry_if_exception_type(
-            (OpenAIError, Exception, ValueError)
-        ),  # Don't retry TokenLimitExceeded
-    )
     async def ask_tool(
         self,
         messages: List[Union[dict, Message]],
@@ -158,6 +554,7 @@ class LLM:
         tools: Optional[List[dict]] = None,
         tool_choice: TOOL_CHOICE_TYPE = ToolChoice.AUTO,  # type: ignore
         temperature: Optional[float] = None,
+        message_tokens: Optional[int] = None,
         **kwargs,
     ) -> ChatCompletionMessage | None:
         """
@@ -169,43 +566,125 @@ class LLM:
         tools：要使用的工具列表
         tool_choice：工具选择策略
         temperature：响应的采样温度
+        message_tokens：可选，messages的token数量（如Memory.total_tokens），传入时不再逐条计算
         **kwargs：其他完成请求的参数
         返回值：
         ChatCompletionMessage：模型的响应
         可能引发的异常：
         TokenLimitExceeded：如果超过了令牌限制
         ValueError：如果工具、工具选择或消息无效
-        OpenAIError：如果在重试后 API 调用仍失败
+        CircuitOpenError：如果该接口已熔断
+        OpenAIError：如果是不可重试的错误，或重试后 API 调用仍失败
         Exception：对于意外错误
+        只有超时、连接错误、429和5xx会被重试，重试遵守Retry-After并受进程级重试预算限制。
         """
-        try:
-            #验证工具选择
-            logger.info(f"智能体(工具调用)-执行操作：验证工具选择")
-            if tool_choice not in TOOL_CHOICE_VALUES:
-                raise ValueError(f"无效的工具选择: {tool_choice}")
-
-            logger.info(f"智能体(工具调用)-执行操作：检查该模型是否支持图像")
-            #检查该模型是否支持图像
-            supports_images = self.model in MULTIMODAL_MODELS
-
-            #格式化消息
-            logger.info(f"智能体(工具调用)-执行操作：格式化消息")
-            if  system_msgs:
-                logger.info(f"智能体(工具调用)-执行操作：添加系统消息")
-                system_msgs = self.format_messages(system_msgs, supports_images)
-                messages = system_msgs + self.format_messages(messages, supports_images)
+        with tracer.span("llm.ask_tool", model=self.model) as span:
+            try:
+                params, input_tokens = self._prepare_tool_request(
+                    messages, system_msgs, timeout, tools, tool_choice, temperature, message_tokens, **kwargs
+                )
+
+                logger.info(f"智能体(工具调用)-执行操作：请求模型")
+                response: ChatCompletion = await self.retry_policy.call(self._create_completion, params, input_tokens)
+                if not response.choices or not response.choices[0].message:
+                    logger.warning(f"智能体(工具调用)-模型返回空响应：{response}")
+                    return None
+
+                if response.usage:
+                    self.scheduler.record_usage(response.usage.completion_tokens)
+                    self.update_token_count(response.usage.prompt_tokens, response.usage.completion_tokens)
+                    span.set(input_tokens=response.usage.prompt_tokens, output_tokens=response.usage.completion_tokens)
+                else:
+                    self.update_token_count(input_tokens)
+                    span.set(input_tokens=input_tokens)
+                return response.choices[0].message
+
+            except (TokenLimitExceeded, CircuitOpenError):
+                raise
+            except ValueError as ve:
+                logger.error(f"智能体(工具调用)-参数验证失败，原因：{ve}")
+                raise
+            except OpenAIError as oe:
+                logger.error(f"智能体(工具调用)-OpenAI接口错误，原因：{oe}")
+                raise
+            except Exception as e:
+                logger.exception(f"智能体(工具调用)-执行操作失败，原因：{e}")
+                raise e
+
+    async def ask_tool_stream(
+        self,
+        messages: List[Union[dict, Message]],
+        system_msgs: Optional[List[Union[dict, Message]]] = None,
+        timeout: int = 300,
+        tools: Optional[List[dict]] = None,
+        tool_choice: TOOL_CHOICE_TYPE = ToolChoice.AUTO,  # type: ignore
+        temperature: Optional[float] = None,
+        message_tokens: Optional[int] = None,
+        **kwargs,
+    ) -> AsyncIterator[LLMStreamEvent]:
+        """
+        ask_tool的流式版本。
+        边生成边产出事件：
+        content：文本增量
+        tool_call：某个工具调用的参数已完整,调用方可以立即执行它
+        done：生成结束,携带完整文本和全部工具调用
+        参数与ask_tool相同;流式请求不做自动重试(已产出的增量无法撤回),
+        但同样受熔断器保护,异常直接抛给调用方。
+        """
+        params, input_tokens = self._prepare_tool_request(
+            messages, system_msgs, timeout, tools, tool_choice, temperature, message_tokens, **kwargs
+        )
+        params["stream_options"] = {"include_usage": True}
+
+        logger.info(f"智能体(工具调用)-执行操作：流式请求模型")
+        assembler = ToolCallAssembler()
+        content_parts: List[str] = []
+        usage = None
+        #生成器在区间内会把控制权交还调用方,span不设为当前span,避免调用方此时创建的任务挂到它下面
+        with tracer.span("llm.ask_tool_stream", activate=False, model=self.model) as span:
+            self.retry_policy.breaker.before_request()
+            try:
+                async with self.scheduler.slot(tokens=input_tokens):
+                    start = time.perf_counter()
+                    stream = await self.client.chat.completions.create(**params, stream=True)
+                    async for chunk in stream:
+                        if chunk.usage:
+                            usage = chunk.usage
+                        if not chunk.choices:
+                            continue
+                        delta = chunk.choices[0].delta
+                        if delta.content:
+                            content_parts.append(delta.content)
+                            yield LLMStreamEvent(type="content", content=delta.content)
+                        if delta.tool_calls:
+                            for tool_call in assembler.add_delta(delta.tool_calls):
+                                yield LLMStreamEvent(type="tool_call", tool_call=tool_call)
+            except (asyncio.CancelledError, GeneratorExit):
+                self.retry_policy.breaker.release_probe()
+                raise
+            except Exception as e:
+                self.retry_policy.guard(e)
+                raise
+            self.retry_policy.guard()
+            run = current_run.get()
+            if run is not None:
+                run.record_llm_call(time.perf_counter() - start)
+
+            for tool_call in assembler.finish():
+                yield LLMStreamEvent(type="tool_call", tool_call=tool_call)
+
+            content = "".join(content_parts)
+            if usage:
+                self.scheduler.record_usage(usage.completion_tokens)
+                self.update_token_count(usage.prompt_tokens, usage.completion_tokens)
+                span.set(input_tokens=usage.prompt_tokens, output_tokens=usage.completion_tokens)
             else:
-                logger.info(f"智能体(工具调用)-执行操作：没有系统消息")
-
-            input_tokens = self.count_messages_tokens(messages)
-
-
-
-        except Exception as e:
-            logger.exception(f"智能体(工具调用)-执行操作：验证工具选择失败，原因：{e}")
-            raise e
-
-
-
-
-
+                #服务端未返回usage时按本地分词估算输出token
+                completion_tokens = self.count_tokens(content) + sum(
+                    self.count_tokens(call.function.name) + self.count_tokens(call.function.arguments)
+                    for call in assembler.tool_calls
+                )
+                self.scheduler.record_usage(completion_tokens)
+                self.update_token_count(input_tokens, completion_tokens)
+                span.set(input_tokens=input_tokens, output_tokens=completion_tokens)
+            yield LLMStreamEvent(type="done", content=content, tool_calls=assembler.tool_calls)
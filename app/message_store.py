@@ -0,0 +1,57 @@
+#消息存储模块：把会话的全部消息写入SQLite,Memory只在内存中保留最近的窗口
+import json
+import sqlite3
+from pathlib import Path
+from typing import List, Optional, Union
+
+from app.schema import Message
+
+
+class MessageStore:
+    """
+    单个会话的落盘消息存储(SQLite)。
+    每条消息按追加顺序的绝对序号保存一行,写入即落盘;读取按序号或区间进行,只加载需要的消息。
+    连接在首次读写时打开,close之后再次使用会重新打开(智能体每次运行结束时关闭,避免批量运行时连接和WAL文件堆积)。
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._db: Optional[sqlite3.Connection] = None
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        if self._db is None:
+            self._db = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)  #自动提交
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute("CREATE TABLE IF NOT EXISTS messages (idx INTEGER PRIMARY KEY, data TEXT NOT NULL)")
+        return self._db
+
+    @classmethod
+    def for_session(cls, directory: Union[str, Path], session_id: str) -> "MessageStore":
+        return cls(Path(directory) / f"{session_id}.sqlite")
+
+    def __len__(self) -> int:
+        row = self._conn.execute("SELECT MAX(idx) FROM messages").fetchone()
+        return 0 if row[0] is None else row[0] + 1
+
+    def append(self, index: int, message: Message) -> None:
+        self._conn.execute("INSERT OR REPLACE INTO messages (idx, data) VALUES (?, ?)", (index, message.to_json()))
+
+    def get(self, index: int) -> Optional[Message]:
+        row = self._conn.execute("SELECT data FROM messages WHERE idx = ?", (index,)).fetchone()
+        return Message(**json.loads(row[0])) if row else None
+
+    def range(self, start: int, stop: int) -> List[Message]:
+        """序号在[start, stop)之间的消息"""
+        rows = self._conn.execute(
+            "SELECT data FROM messages WHERE idx >= ? AND idx < ? ORDER BY idx", (start, stop)
+        ).fetchall()
+        return [Message(**json.loads(row[0])) for row in rows]
+
+    def close(self) -> None:
+        """关闭连接(最后一个连接关闭时SQLite会合并并删除WAL/SHM文件)"""
+        if self._db is not None:
+            self._db.close()
+            self._db = None
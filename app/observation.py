@@ -0,0 +1,167 @@
+#观察结果整形模块：按token上限裁剪工具输出(保留开头、结尾和错误行),完整输出存入旁路存储供分页查看
+import re
+import uuid
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+
+from app.logger import logger
+
+ERROR_LINE = re.compile(r"error|exception|traceback|fatal|failed|错误|异常|失败", re.IGNORECASE)
+
+
+class ObservationStore:
+    """
+    完整工具输出的旁路存储(进程内,按总字符数LRU淘汰)。
+    整形后的观察结果中只保留一个observation_id,智能体可通过read_observation工具分页读取原文。
+    """
+
+    def __init__(self, max_chars: int = 50_000_000):
+        self.max_chars = max_chars
+        self._items: "OrderedDict[str, List[str]]" = OrderedDict()
+        self._chars = 0
+
+    def put(self, lines: List[str]) -> str:
+        observation_id = f"obs-{uuid.uuid4().hex[:12]}"
+        self._items[observation_id] = lines
+        self._chars += sum(len(line) + 1 for line in lines)
+        while self._chars > self.max_chars and len(self._items) > 1:
+            _, evicted = self._items.popitem(last=False)
+            self._chars -= sum(len(line) + 1 for line in evicted)
+        return observation_id
+
+    def get(self, observation_id: str) -> Optional[List[str]]:
+        lines = self._items.get(observation_id)
+        if lines is not None:
+            self._items.move_to_end(observation_id)
+        return lines
+
+
+observation_store = ObservationStore()
+
+
+class ObservationShaper:
+    """
+    在工具执行之后、写入记忆之前整形观察结果,上限以token计(使用LLM的分词器)。
+    1. 可选地把连续重复的行合并为一行并注明重复次数;
+    2. 未超出上限时原样返回;
+    3. 超出时按行保留开头(head_ratio)和结尾(tail_ratio)的内容,中间部分只保留匹配错误模式的行,
+       其余省略,并附上完整输出的observation_id。
+    只对被保留的行计数,分词开销与上限成正比,与输出总长度无关。
+    """
+
+    def __init__(
+        self,
+        max_tokens: int,
+        count_tokens: Callable[[str], int],
+        head_ratio: float = 0.5,
+        tail_ratio: float = 0.3,
+        dedupe: bool = True,
+        store: Optional[ObservationStore] = None,
+    ):
+        self.max_tokens = max_tokens
+        self.count_tokens = count_tokens
+        self.head_ratio = head_ratio
+        self.tail_ratio = tail_ratio
+        self.dedupe = dedupe
+        self.store = store or observation_store
+
+    def shape(self, text: str, keep_full: bool = True) -> str:
+        original = text.splitlines()
+        lines, origins = self._dedupe(original) if self.dedupe else (original, list(range(len(original))))
+        joined = "\n".join(lines)
+        #字符数不超过上限时token数必然不超过(每个token至少一个字符);远超上限的输出不整体分词
+        if len(joined) <= self.max_tokens or (
+            len(joined) <= self.max_tokens * 8 and self.count_tokens(joined) <= self.max_tokens
+        ):
+            return joined
+
+        head, head_end = self._take(lines, 0, len(lines), int(self.max_tokens * self.head_ratio))
+        if head_end == len(lines):
+            return self._shape_text(joined, original, keep_full)  #行数很少但有超长行(如单行的JSON),按字符截取开头和结尾
+        tail, tail_start = self._take(lines, len(lines) - 1, head_end - 1, int(self.max_tokens * self.tail_ratio))
+        remaining = self.max_tokens - int(self.max_tokens * (self.head_ratio + self.tail_ratio))
+        errors: List[Tuple[int, str]] = []
+        for number in range(head_end, tail_start):
+            if remaining <= 0:
+                break
+            if ERROR_LINE.search(lines[number]):
+                line = self._fit(lines[number], remaining)
+                remaining -= self.count_tokens(line) + 1
+                errors.append((origins[number] + 1, line))  #原始行号,与read_observation一致
+
+        omitted = tail_start - head_end - len(errors)
+        omitted_chars = sum(len(lines[n]) + 1 for n in range(head_end, tail_start)) - sum(len(l) + 1 for _, l in errors)
+        full = ""
+        if keep_full:
+            observation_id = self.store.put(original)
+            full = f"，完整输出可用read_observation(observation_id='{observation_id}')分页查看"
+        parts = head + [f"...[已省略{omitted}行，约{omitted_chars}个字符{full}]..."]
+        if errors:
+            parts.append("[省略部分中的错误行]")
+            parts.extend(f"第{number}行：{line}" for number, line in errors)
+            parts.append("[错误行结束]")
+        parts.extend(tail)
+        logger.info(f"观察结果整形-{len(lines)}行裁剪为约{self.max_tokens}个token以内，省略{omitted}行")
+        return "\n".join(parts)
+
+    def _shape_text(self, joined: str, original: List[str], keep_full: bool) -> str:
+        """不按行切分,按token比例保留文本开头和结尾的字符,中间部分省略"""
+        tokens = self.count_tokens(joined)
+        head_chars = len(joined) * int(self.max_tokens * self.head_ratio) // tokens
+        tail_chars = len(joined) * int(self.max_tokens * self.tail_ratio) // tokens
+        omitted_chars = len(joined) - head_chars - tail_chars
+        full = ""
+        if keep_full:
+            observation_id = self.store.put(original)
+            full = f"，完整输出可用read_observation(observation_id='{observation_id}')分页查看"
+        parts = [joined[:head_chars], f"...[已省略约{omitted_chars}个字符{full}]..."]
+        if tail_chars:
+            parts.append(joined[-tail_chars:])
+        logger.info(f"观察结果整形-{len(joined)}个字符裁剪为约{self.max_tokens}个token以内，省略{omitted_chars}个字符")
+        return "\n".join(parts)
+
+    def _take(self, lines: List[str], start: int, stop: int, budget: int) -> Tuple[List[str], int]:
+        """从start向stop方向逐行累加,直到用完budget个token;返回取到的行(原顺序)和停止位置"""
+        step = 1 if stop > start else -1
+        taken: List[str] = []
+        position = start
+        while position != stop and budget > 0:
+            line = self._fit(lines[position], budget)
+            if line is not lines[position] and taken:
+                break  #放不下整行时停止;只有第一行允许被截断(如单行的超长输出)
+            budget -= self.count_tokens(line) + 1
+            taken.append(line)
+            position += step
+            if line is not lines[position - step]:
+                break
+        return (taken if step == 1 else taken[::-1]), position if step == 1 else position + 1
+
+    def _fit(self, line: str, budget: int) -> str:
+        """超长的单行按比例截断到budget个token以内"""
+        if len(line) <= budget:
+            return line
+        tokens = self.count_tokens(line)
+        if tokens <= budget:
+            return line
+        return line[: max(1, len(line) * budget // tokens)] + "...[行已截断]"
+
+    @staticmethod
+    def _dedupe(lines: List[str]) -> Tuple[List[str], List[int]]:
+        """合并连续重复的行,返回整形后的行及每行对应的原始行号(从0开始)"""
+        result: List[str] = []
+        origins: List[int] = []
+        repeats = 0
+        for index, line in enumerate(lines):
+            if index and line == lines[index - 1]:
+                repeats += 1
+                continue
+            if repeats:
+                result.append(f"...[上一行重复{repeats}次]")
+                origins.append(index - 1)
+                repeats = 0
+            result.append(line)
+            origins.append(index)
+        if repeats:
+            result.append(f"...[上一行重复{repeats}次]")
+            origins.append(len(lines) - 1)
+        return result, origins
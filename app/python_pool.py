@@ -0,0 +1,635 @@
+#Python解释器进程池：预启动并预先导入常用模块的解释器进程,通过管道提交代码、接收结果,不阻塞事件循环
+import asyncio
+import builtins
+import ctypes
+import importlib
+import io
+import multiprocessing
+import os
+import resource
+import signal
+import sys
+import threading
+from collections import OrderedDict, deque
+from multiprocessing.connection import Connection
+from pathlib import Path
+from typing import Deque, Dict, List, Optional, Tuple
+
+from app.config import SandboxSettings, config
+from app.logger import logger
+from app.sandbox import enter_sandbox, finish_sandbox, prepare_cgroups, release_cgroups
+
+STDOUT, STDERR = 1, 2
+
+
+def _new_globals() -> dict:
+    return {"__builtins__": builtins.__dict__.copy(), "__name__": "__main__"}
+
+
+def _rss() -> int:
+    """当前进程的常驻内存(字节);没有/proc时退回到峰值"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class _PipeRaw(io.RawIOBase):
+    """
+    解释器中stdout/stderr的底层输出：把写入的字节按chunk_size分块通过管道发给主进程,解释器端不保留输出。
+    上层由C实现的BufferedWriter/TextIOWrapper缓冲,大量print时也只在缓冲写满时才进入这里。
+    主进程读取较慢时管道写满,print会阻塞(背压)。
+    """
+
+    def __init__(self, stream: int, chunk_size: int = 65536):
+        self.stream = stream
+        self.chunk_size = chunk_size
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        view = memoryview(data)
+        for start in range(0, len(view), self.chunk_size):
+            _send(("out", self.stream, bytes(view[start : start + self.chunk_size])))
+        return len(view)
+
+
+_conn: Optional[Connection] = None  #解释器进程中与主进程通信的管道
+_sending = False  #正在向管道写消息,此时信号处理函数不能再写(会把消息写乱)
+_child_pid: Optional[int] = None  #fork服务器中正在执行代码的子进程
+
+
+def _send(message: tuple) -> None:
+    global _sending
+    _sending = True
+    try:
+        _conn.send(message)
+    finally:
+        _sending = False
+
+
+def _flush_output(signum, frame) -> None:
+    """SIGUSR1处理函数：执行超时、进程被结束之前,主进程请求把缓冲中的输出发回来"""
+    if _child_pid is not None:
+        os.kill(_child_pid, signal.SIGUSR1)  #代码在子进程中执行,由子进程发回输出
+        return
+    if _sending:
+        return  #缓冲的输出正在发送
+    try:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        _send(("flushed",))
+    except (RuntimeError, ValueError, OSError):
+        pass  #信号恰好打断了缓冲区内部的写入(不可重入),放弃这部分输出
+
+
+def _run_code(code: str, safe_globals: dict) -> Tuple[bool, Optional[str]]:
+    """在给定的全局命名空间中执行代码,输出流式发送给主进程;返回(是否成功, 错误信息)"""
+    original_stdout, original_stderr = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = (
+        io.TextIOWrapper(io.BufferedWriter(_PipeRaw(stream), 65536), encoding="utf-8", errors="replace")
+        for stream in (STDOUT, STDERR)
+    )
+    try:
+        exec(code, safe_globals, safe_globals)
+        return True, None
+    except Exception as e:
+        return False, str(e)
+    finally:
+        try:
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            sys.stdout, sys.stderr = original_stdout, original_stderr
+
+
+def _die_with_parent() -> None:
+    """子进程随fork服务器一起结束(Linux的PR_SET_PDEATHSIG),服务器被主进程结束时不留下孤儿进程"""
+    parent = os.getppid()
+    try:
+        ctypes.CDLL(None, use_errno=True).prctl(1, signal.SIGKILL)
+    except (OSError, AttributeError):
+        pass
+    if os.getppid() != parent:
+        os._exit(1)  #设置之前服务器已经退出
+
+
+def _fork_exec(code: str) -> int:
+    """
+    非常驻执行：fork出写时复制的子进程,在全新的命名空间中执行代码后退出,返回子进程的退出码(被信号结束时为负数)。
+    代码对模块、环境变量、工作目录、线程和打开的文件所做的修改都随子进程消失,解释器自身保持预导入后的干净状态。
+    """
+    global _child_pid
+    pid = os.fork()
+    if pid == 0:
+        _child_pid = None
+        try:
+            _die_with_parent()
+            numpy_random = sys.modules.get("numpy.random")  #numpy.random按需导入,未导入时子进程中首次导入会自行播种
+            if numpy_random is not None:
+                numpy_random.seed(int.from_bytes(os.urandom(4), "little"))  #fork会复制随机数状态(random模块会自动重新播种,numpy不会)
+            success, error = _run_code(code, _new_globals())
+            _send(("result", success, error, _rss()))
+        except BaseException as e:  #SystemExit等_run_code不捕获的异常
+            try:
+                _send(("result", False, f"{type(e).__name__}: {e}", _rss()))
+            except BaseException:
+                pass
+        finally:
+            os._exit(0)
+    _child_pid = pid
+    try:
+        _, status = os.waitpid(pid, 0)
+    finally:
+        _child_pid = None
+    return os.waitstatus_to_exitcode(status)
+
+
+def _interpreter_entry(
+    conn: Connection,
+    preload_modules: List[str],
+    sandbox: Optional[SandboxSettings] = None,
+    workdir: Optional[Path] = None,
+    cgroups: Optional[Dict[str, str]] = None,
+) -> None:
+    """
+    解释器进程入口(模块级函数,spawn方式下才能被子进程导入)。
+    消息格式：
+        主进程 -> 解释器：("exec", code, persistent)
+        解释器 -> 主进程：("ready", sandbox_info) | ("out", stream, data) | ("flushed",) | ("result", success, error, rss)
+                          | ("exited", exitcode)
+    执行期间输出以("out", STDOUT/STDERR, 字节块)流式发送,执行结束后发送result;
+    收到SIGUSR1时立即发出缓冲中的输出并回复flushed。
+    persistent为True时代码在本进程常驻的全局命名空间中执行(会话内核);
+    否则解释器作为fork服务器,每次执行fork一个子进程(见_fork_exec),子进程结束后再发送exited,
+    子进程崩溃或被结束(如超出沙箱内存限制)时没有result,只有exited。
+    给定sandbox时在预导入之前进入沙箱(网络命名空间要求进程还没有启动其他线程),ready中带回生效的限制和cgroup目录;
+    cgroups是主进程准备好的父目录,解释器只在其中创建并加入自己的叶子。
+    """
+    global _conn
+    _conn = conn
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, _flush_output)
+    sandbox_info = enter_sandbox(sandbox, workdir, cgroups) if sandbox is not None else None
+    for name in preload_modules:
+        try:
+            importlib.import_module(name)
+        except Exception:
+            pass  #未安装的模块跳过,用户代码导入时再报错
+    if sandbox_info is not None:
+        finish_sandbox(sandbox, sandbox_info)
+    persistent_globals = _new_globals()
+    try:
+        _send(("ready", sandbox_info))
+        while True:
+            message = conn.recv()
+            if message[0] == "exec":
+                _, code, persistent = message
+                if persistent:
+                    success, error = _run_code(code, persistent_globals)
+                    _send(("result", success, error, _rss()))
+                elif hasattr(os, "fork"):
+                    _send(("exited", _fork_exec(code)))
+                else:  #不支持fork的平台只能在本进程的新命名空间中执行
+                    success, error = _run_code(code, _new_globals())
+                    _send(("result", success, error, _rss()))
+                    _send(("exited", 0))
+    except (EOFError, OSError, KeyboardInterrupt):
+        pass  #主进程关闭了管道(池关闭或进程退出)
+
+
+class OutputBuffer:
+    """
+    有界的输出缓冲：保留开头和结尾各max_bytes的一半,中间的输出直接丢弃、只计字节数。
+    无论代码打印多少内容,每次执行占用的内存都不超过max_bytes。
+    """
+
+    def __init__(self, max_bytes: int):
+        self.head_limit = max_bytes // 2
+        self.tail_limit = max_bytes - self.head_limit
+        self.head = bytearray()
+        self.tail: Deque[bytes] = deque()
+        self.tail_size = 0
+        self.dropped = 0
+
+    def write(self, data: bytes) -> None:
+        if len(self.head) < self.head_limit:
+            room = self.head_limit - len(self.head)
+            self.head += data[:room]
+            data = data[room:]
+            if not data:
+                return
+        self.tail.append(data)
+        self.tail_size += len(data)
+        while self.tail_size > self.tail_limit:
+            excess = self.tail_size - self.tail_limit
+            first = self.tail[0]
+            if len(first) <= excess:
+                self.tail.popleft()
+                self.tail_size -= len(first)
+                self.dropped += len(first)
+            else:
+                self.tail[0] = first[excess:]
+                self.tail_size -= excess
+                self.dropped += excess
+
+    def getvalue(self) -> str:
+        tail = b"".join(self.tail)
+        if not self.dropped:
+            return (bytes(self.head) + tail).decode("utf-8", "replace")
+        #在截断处可能切开了多字节字符,两侧各自解码并忽略不完整的字节
+        return (
+            self.head.decode("utf-8", "ignore")
+            + f"\n...[输出过长，中间省略了{self.dropped}字节]...\n"
+            + tail.decode("utf-8", "ignore")
+        )
+
+
+class _Interpreter:
+    """主进程中对一个解释器进程的引用"""
+
+    def __init__(self, process: multiprocessing.Process, conn: Connection):
+        self.process = process
+        self.conn = conn
+        self.tasks = 0
+        self.cgroups: List[str] = []  #沙箱为该进程创建的cgroup目录,进程退出后删除
+
+    async def receive(self, timeout: Optional[float]) -> tuple:
+        """等待解释器的下一条消息;管道可读时才调用recv,等待期间不占用线程也不阻塞事件循环"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        fd = self.conn.fileno()
+
+        def on_readable():
+            loop.remove_reader(fd)
+            if future.done():
+                return
+            try:
+                future.set_result(self.conn.recv())
+            except (EOFError, OSError) as e:
+                future.set_exception(EOFError(str(e)))
+
+        try:
+            loop.add_reader(fd, on_readable)
+        except NotImplementedError:  #不支持add_reader的事件循环(如Windows的Proactor)退回到线程中等待
+            if not await loop.run_in_executor(None, self.conn.poll, timeout):
+                raise asyncio.TimeoutError
+            return self.conn.recv()
+        try:
+            return await asyncio.wait_for(future, timeout)
+        finally:
+            loop.remove_reader(fd)
+
+    def kill(self) -> None:
+        self.conn.close()
+        if self.process.is_alive():
+            self.process.kill()
+        #回收僵尸进程放到线程中,不阻塞事件循环
+        try:
+            asyncio.get_running_loop().run_in_executor(None, self._reap)
+        except RuntimeError:  #事件循环已结束(如关闭上一个循环的共享池)
+            threading.Thread(target=self._reap, daemon=True).start()
+
+    def _reap(self) -> None:
+        self.process.join(1)
+        release_cgroups(self.cgroups, timeout=1.0)  #被结束的执行子进程可能还没有退出
+
+
+class _Kernel:
+    """绑定到一个会话的常驻解释器"""
+
+    def __init__(self):
+        self.interpreter: Optional[_Interpreter] = None  #首次执行时从池中取出
+        self.lock = asyncio.Lock()  #同一内核一次只执行一段代码
+        self.idle_timer: Optional[asyncio.TimerHandle] = None
+
+
+class PythonWorkerPool:
+    """
+    预启动的Python解释器进程池。
+    - 最多size个解释器进程,同时也限制了并发执行数;空闲的解释器放在队列中,执行请求按先来后到等待;
+    - 解释器在启动时预先导入preload_modules,执行请求只需通过管道发送代码并等待结果;
+    - 每次执行都在从解释器fork出的子进程中进行,代码对进程状态(模块、环境变量、工作目录等)的修改不会影响之后的执行;
+    - 执行超时或进程崩溃时结束该进程并在后台启动新的解释器补位,执行max_tasks_per_worker次后同样回收重建。
+    会话内核(run_in_kernel)：从池中取出一个已预热的解释器绑定到会话,全局变量在多次调用之间保留;
+    执行后内存超过kernel_memory_limit_mb、空闲超过kernel_idle_timeout、超时或显式重置时回收,
+    数量超过max_kernels时回收最久未使用的空闲内核。
+    进程数：内核不计入size,取走的解释器由池补位,因此存活的解释器最多为size+max_kernels个
+    (max_kernels个内核都在执行时,新会话的内核会暂时超出上限);非常驻执行时每个解释器另有一个fork出的执行子进程。
+    执行期间的stdout/stderr从解释器分块流式传回,各自写入上限为max_output_bytes的OutputBuffer(保留开头和结尾)。
+    给定sandbox(配置中[sandbox]的use_sandbox为True)时,每个解释器在预热阶段就进入本地沙箱(见app.sandbox),
+    执行时不再有额外的启动开销;单次执行的时限不超过sandbox.timeout。
+    每个事件循环使用一个共享实例(shared),由配置中的[python]部分决定池大小和预导入模块。
+    """
+    _shared: Optional["PythonWorkerPool"] = None
+
+    def __init__(
+        self,
+        size: int = 4,
+        preload_modules: Optional[List[str]] = None,
+        max_tasks_per_worker: int = 100,
+        max_kernels: int = 8,
+        kernel_memory_limit_mb: int = 2048,
+        kernel_idle_timeout: float = 600.0,
+        max_output_bytes: int = 1_048_576,
+        sandbox: Optional[SandboxSettings] = None,
+        workdir: Optional[Path] = None,
+    ):
+        self.size = size
+        self.preload_modules = preload_modules or []
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.max_kernels = max_kernels
+        self.kernel_memory_limit_mb = kernel_memory_limit_mb
+        self.kernel_idle_timeout = kernel_idle_timeout
+        self.max_output_bytes = max_output_bytes  #每次执行stdout/stderr各自保留的字节数上限
+        self.sandbox = sandbox
+        self.workdir = workdir  #沙箱中代码的工作目录
+        self._sandbox_reported = False
+        self._cgroups: Optional[Dict[str, str]] = None  #沙箱cgroup的父目录,在主进程中准备一次
+        if sandbox is not None:
+            try:
+                self._cgroups = prepare_cgroups()
+            except (OSError, KeyError) as e:
+                logger.warning(f"Python执行池-无法准备沙箱cgroup，改用rlimit：{e}")
+        self._kernels: "OrderedDict[str, _Kernel]" = OrderedDict()  #会话ID -> 内核,按最近使用排序
+        self._context = multiprocessing.get_context("spawn")
+        self._idle: asyncio.Queue = asyncio.Queue()
+        self._total = 0  #存活及正在启动的解释器数
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._closed = False
+
+    @classmethod
+    def shared(cls) -> "PythonWorkerPool":
+        """当前事件循环的共享解释器池;首次使用时按配置创建并在后台预热"""
+        loop = asyncio.get_running_loop()
+        if cls._shared is None or cls._shared._loop is not loop:
+            if cls._shared is not None:
+                cls._shared.close()
+            settings = config.python
+            cls._shared = cls(
+                settings.pool_size,
+                settings.preload_modules,
+                settings.max_tasks_per_worker,
+                settings.max_kernels,
+                settings.kernel_memory_limit_mb,
+                settings.kernel_idle_timeout,
+                settings.max_output_bytes,
+                config.sandbox if config.sandbox.use_sandbox else None,
+                config.workspace_root,
+            )
+            cls._shared.warm()
+        return cls._shared
+
+    def warm(self) -> None:
+        """在后台把解释器补足到size个"""
+        self._loop = asyncio.get_running_loop()
+        while self._total < self.size:
+            self._start_interpreter()
+
+    def _start_interpreter(self) -> None:
+        self._total += 1
+        asyncio.get_running_loop().create_task(self._spawn())
+
+    async def _spawn(self) -> None:
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_interpreter_entry,
+            args=(child_conn, self.preload_modules, self.sandbox, self.workdir, self._cgroups),
+            name="cogniself-python",
+            daemon=True,
+        )
+        interpreter = _Interpreter(process, parent_conn)
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, process.start)
+            child_conn.close()  #主进程只保留自己一端,子进程退出时才能读到EOF
+            _, sandbox_info = await interpreter.receive(None)  #等待预导入完成
+        except Exception as e:
+            logger.error(f"Python执行池-解释器进程启动失败：{e}")
+            self._total -= 1
+            self._idle.put_nowait(e)  #唤醒一个等待者并把错误交给它
+            return
+        if sandbox_info is not None:
+            interpreter.cgroups = sandbox_info["cgroups"]
+            if not self._sandbox_reported:
+                self._sandbox_reported = True
+                logger.info(f"Python执行池-沙箱已启用：{'、'.join(sandbox_info['methods']) or '无可用的隔离机制'}")
+                for key in ("cgroup_error", "rlimit_error"):
+                    if key in sandbox_info:
+                        logger.warning(f"Python执行池-沙箱{key}：{sandbox_info[key]}")
+        if self._closed:
+            interpreter.kill()
+            return
+        self._idle.put_nowait(interpreter)
+
+    async def _acquire(self) -> _Interpreter:
+        self._loop = asyncio.get_running_loop()
+        while True:
+            if self._idle.empty() and self._total < self.size:
+                self._start_interpreter()
+            interpreter = await self._idle.get()
+            if isinstance(interpreter, Exception):
+                raise interpreter
+            if interpreter.process.is_alive():
+                return interpreter
+            self._discard(interpreter)  #空闲期间被外部结束的进程
+
+    def _release(self, interpreter: _Interpreter, healthy: bool) -> None:
+        interpreter.tasks += 1
+        if healthy and not self._closed and interpreter.tasks < self.max_tasks_per_worker:
+            self._idle.put_nowait(interpreter)
+        else:
+            self._discard(interpreter)
+            if not self._closed:
+                self._start_interpreter()  #立即补位,保持池是热的
+
+    def _discard(self, interpreter: _Interpreter) -> None:
+        self._total -= 1
+        interpreter.kill()
+
+    async def _execute(
+        self, interpreter: _Interpreter, code: str, persistent: bool, timeout: Optional[float],
+        stdout: OutputBuffer, stderr: OutputBuffer,
+    ) -> Tuple[bool, Optional[str], int]:
+        """
+        发送代码并持续接收流式输出直到执行结束(常驻执行为result,否则为执行子进程退出后的exited);
+        timeout是整次执行的时限。返回(是否成功, 错误信息, 内存占用)
+        """
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        interpreter.conn.send(("exec", code, persistent))
+        result = None
+        try:
+            while True:
+                message = await interpreter.receive(None if deadline is None else max(0.0, deadline - loop.time()))
+                if message[0] == "out":
+                    (stdout if message[1] == STDOUT else stderr).write(message[2])
+                elif message[0] == "result":
+                    result = message[1:]
+                    if persistent:
+                        return result
+                elif message[0] == "exited":
+                    if result is not None:
+                        return result
+                    error = self._exit_message(message[1])  #执行子进程崩溃或被结束,解释器本身仍可继续使用
+                    logger.warning(f"Python执行池-{error}")
+                    return False, error, 0
+        except asyncio.TimeoutError:
+            await self._drain(interpreter, stdout, stderr)
+            raise
+
+    @staticmethod
+    async def _drain(interpreter: _Interpreter, stdout: OutputBuffer, stderr: OutputBuffer, grace: float = 0.2) -> None:
+        """超时后、结束进程之前,请求解释器发回缓冲中的输出,最多等待grace秒"""
+        if not hasattr(signal, "SIGUSR1") or not interpreter.process.is_alive():
+            return
+        os.kill(interpreter.process.pid, signal.SIGUSR1)
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + grace
+        try:
+            while True:
+                message = await interpreter.receive(max(0.0, deadline - loop.time()))
+                if message[0] == "out":
+                    (stdout if message[1] == STDOUT else stderr).write(message[2])
+                elif message[0] in ("flushed", "result"):
+                    return
+        except (asyncio.TimeoutError, EOFError, OSError):
+            pass
+
+    def _limit_timeout(self, timeout: Optional[float]) -> Optional[float]:
+        if self.sandbox is None:
+            return timeout
+        return self.sandbox.timeout if timeout is None else min(timeout, self.sandbox.timeout)
+
+    def _exit_message(self, exitcode: Optional[int]) -> str:
+        message = f"执行进程意外退出(退出码{exitcode})"
+        if self.sandbox is not None and exitcode == -signal.SIGKILL:
+            message += f"，可能超出了沙箱内存限制{self.sandbox.memory_limit}"
+        return message
+
+    @staticmethod
+    def _result(success: bool, stdout: OutputBuffer, stderr: OutputBuffer, message: Optional[str] = None) -> Dict:
+        """组装工具结果：标准输出在前,错误信息在后;标准错误单独放在stderr中"""
+        output = stdout.getvalue()
+        if message:
+            separator = "" if not output or output.endswith("\n") else "\n"
+            output = f"{output}{separator}{message}"
+        result = {"observation": output, "success": success}
+        errors = stderr.getvalue()
+        if errors:
+            result["stderr"] = errors
+        return result
+
+    async def run(self, code: str, timeout: Optional[float]) -> Dict:
+        """在空闲的解释器中执行代码;超时或崩溃的解释器会被回收"""
+        timeout = self._limit_timeout(timeout)
+        interpreter = await self._acquire()
+        stdout, stderr = OutputBuffer(self.max_output_bytes), OutputBuffer(self.max_output_bytes)
+        healthy = False
+        try:
+            success, error, _ = await self._execute(interpreter, code, False, timeout, stdout, stderr)
+            healthy = True
+            return self._result(success, stdout, stderr, error)
+        except asyncio.TimeoutError:
+            return self._result(False, stdout, stderr, f"Execution timeout after {timeout} seconds")
+        except (EOFError, OSError):
+            await asyncio.get_running_loop().run_in_executor(None, interpreter.process.join, 1)
+            message = self._exit_message(interpreter.process.exitcode)
+            logger.warning(f"Python执行池-{message}")
+            return self._result(False, stdout, stderr, message)
+        finally:
+            self._release(interpreter, healthy)
+
+    async def run_in_kernel(self, session_id: str, code: str, timeout: Optional[float], reset: bool = False) -> Dict:
+        """在会话的常驻解释器中执行代码;reset为True时先丢弃该会话的内核(及其全部变量)"""
+        if reset:
+            self.evict_kernel(session_id, "显式重置")
+            if not code.strip():
+                return {"observation": "会话内核已重置，之前定义的变量已清除", "success": True}
+        timeout = self._limit_timeout(timeout)
+        kernel = self._kernels.get(session_id)
+        if kernel is None:
+            self._evict_lru_kernels()
+            kernel = self._kernels[session_id] = _Kernel()
+        self._kernels.move_to_end(session_id)
+        stdout, stderr = OutputBuffer(self.max_output_bytes), OutputBuffer(self.max_output_bytes)
+        async with kernel.lock:
+            if kernel.interpreter is None:
+                interpreter = await self._acquire()
+                if self._kernels.get(session_id) is not kernel:
+                    #等待期间内核已被回收(如并发的重置或池关闭):解释器还给池,在会话的新内核中重新执行
+                    if self._closed:
+                        self._discard(interpreter)
+                        return self._result(False, stdout, stderr, "Python执行池已关闭")
+                    self._idle.put_nowait(interpreter)
+                    return await self.run_in_kernel(session_id, code, timeout)
+                kernel.interpreter = interpreter
+                self._total -= 1  #解释器归内核所有,不再计入池;池在后台补位
+                if not self._closed:
+                    self._start_interpreter()
+            interpreter = kernel.interpreter
+            try:
+                success, error, rss = await self._execute(interpreter, code, True, timeout, stdout, stderr)
+            except asyncio.TimeoutError:
+                self.evict_kernel(session_id, "执行超时")
+                return self._result(
+                    False, stdout, stderr, f"Execution timeout after {timeout} seconds (会话内核已重启，之前定义的变量已丢失)"
+                )
+            except (EOFError, OSError):
+                await asyncio.get_running_loop().run_in_executor(None, interpreter.process.join, 1)
+                exitcode = interpreter.process.exitcode
+                self.evict_kernel(session_id, f"进程意外退出(退出码{exitcode})")
+                return self._result(False, stdout, stderr, f"{self._exit_message(exitcode)}，之前定义的变量已丢失")
+            except BaseException:
+                self.evict_kernel(session_id, "执行被取消")  #代码仍在解释器中运行,只能结束它
+                raise
+        if rss > self.kernel_memory_limit_mb * 2**20:
+            self.evict_kernel(session_id, f"内存占用{rss // 2**20}MB")
+            note = f"[会话内核内存占用{rss // 2**20}MB，超过上限{self.kernel_memory_limit_mb}MB，已回收，之前定义的变量已丢失]"
+            error = f"{error}\n{note}" if error else note
+        else:
+            self._schedule_idle_eviction(session_id, kernel)
+        return self._result(success, stdout, stderr, error)
+
+    def _schedule_idle_eviction(self, session_id: str, kernel: _Kernel) -> None:
+        if kernel.idle_timer is not None:
+            kernel.idle_timer.cancel()
+
+        def evict_if_idle():
+            if self._kernels.get(session_id) is kernel and not kernel.lock.locked():
+                self.evict_kernel(session_id, f"空闲超过{self.kernel_idle_timeout:g}秒")
+
+        kernel.idle_timer = asyncio.get_running_loop().call_later(self.kernel_idle_timeout, evict_if_idle)
+
+    def _evict_lru_kernels(self) -> None:
+        """内核数达到上限时回收最久未使用的空闲内核(正在执行的内核不回收,此时允许暂时超出上限)"""
+        for session_id in list(self._kernels):
+            if len(self._kernels) < self.max_kernels:
+                return
+            if not self._kernels[session_id].lock.locked():
+                self.evict_kernel(session_id, "内核数达到上限")
+
+    def evict_kernel(self, session_id: str, reason: str) -> None:
+        kernel = self._kernels.pop(session_id, None)
+        if kernel is None:
+            return
+        if kernel.idle_timer is not None:
+            kernel.idle_timer.cancel()
+        if kernel.interpreter is not None:
+            kernel.interpreter.kill()
+        logger.info(f"Python执行池-会话{session_id}的内核已回收({reason})")
+
+    def close(self) -> None:
+        """结束所有空闲的解释器和会话内核;正在执行的解释器在执行结束后结束"""
+        self._closed = True
+        for kernel in self._kernels.values():
+            if kernel.idle_timer is not None:
+                kernel.idle_timer.cancel()
+            if kernel.interpreter is not None:
+                kernel.interpreter.kill()
+        self._kernels.clear()
+        while not self._idle.empty():
+            interpreter = self._idle.get_nowait()
+            if isinstance(interpreter, _Interpreter):
+                interpreter.kill()
@@ -0,0 +1,96 @@
+#相关性索引模块：本地哈希TF-IDF向量,为每一步挑选与当前子目标相关的历史观察结果,不依赖网络
+import math
+import re
+import zlib
+from collections import Counter
+from typing import Dict, Iterable, List
+
+import numpy as np
+
+_WORD = re.compile(r"[a-z0-9_]+")
+_CJK = re.compile(r"[\u4e00-\u9fff]+")
+
+
+def text_features(text: str) -> Counter:
+    """英文/数字按词切分(单词+相邻词二元组),中文按字二元组切分"""
+    text = text.lower()
+    features: Counter = Counter()
+    words = _WORD.findall(text)
+    features.update(words)
+    features.update(f"{a} {b}" for a, b in zip(words, words[1:]))
+    for run in _CJK.findall(text):
+        if len(run) == 1:
+            features[run] += 1
+        else:
+            features.update(run[i : i + 2] for i in range(len(run) - 1))
+    return features
+
+
+class RelevanceIndex:
+    """
+    哈希TF-IDF索引。每个文档(一条观察结果)是矩阵中的一行,特征经crc32哈希到dim维;
+    文档频率随添加增量维护,IDF与余弦相似度在查询时用NumPy整体计算。
+    """
+
+    def __init__(self, dim: int = 2048):
+        self.dim = dim
+        self._matrix = np.zeros((64, dim), dtype=np.float32)  #按需倍增的行存储
+        self._df = np.zeros(dim, dtype=np.float32)  #文档频率
+        self._rows: Dict[str, int] = {}  #文档键 -> 行号
+        self._size = 0  #已使用的行数(含已删除的行)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._rows
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _vector(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for feature, count in text_features(text).items():
+            vector[zlib.crc32(feature.encode("utf-8")) % self.dim] += 1 + math.log(count)  #次线性TF
+        return vector
+
+    def add(self, key: str, text: str) -> None:
+        if key in self._rows:
+            return
+        if self._size == len(self._matrix):
+            self._matrix = np.concatenate([self._matrix, np.zeros_like(self._matrix)])
+        vector = self._vector(text)
+        self._matrix[self._size] = vector
+        self._df += vector > 0
+        self._rows[key] = self._size
+        self._size += 1
+
+    def retain(self, keys: Iterable[str]) -> None:
+        """只保留keys中的文档;已删除的行超过一半时压缩矩阵"""
+        keep = set(keys)
+        for key in [k for k in self._rows if k not in keep]:
+            row = self._rows.pop(key)
+            self._df -= self._matrix[row] > 0
+            self._matrix[row] = 0
+        if self._size > 64 and len(self._rows) * 2 < self._size:
+            order = sorted(self._rows.items(), key=lambda item: item[1])
+            matrix = np.zeros((max(64, len(order) * 2), self.dim), dtype=np.float32)
+            for new_row, (key, old_row) in enumerate(order):
+                matrix[new_row] = self._matrix[old_row]
+                self._rows[key] = new_row
+            self._matrix, self._size = matrix, len(order)
+
+    def scores(self, query: str, keys: List[str]) -> np.ndarray:
+        """query与keys中各文档的余弦相似度(未索引的键得分为0)"""
+        result = np.zeros(len(keys), dtype=np.float32)
+        present = [(i, self._rows[k]) for i, k in enumerate(keys) if k in self._rows]
+        if not present:
+            return result
+        idf = np.log((len(self._rows) + 1) / (self._df + 1)) + 1
+        query_vector = self._vector(query) * idf
+        query_norm = np.linalg.norm(query_vector)
+        if not query_norm:
+            return result
+        positions, rows = zip(*present)
+        documents = self._matrix[list(rows)] * idf
+        norms = np.linalg.norm(documents, axis=1)
+        norms[norms == 0] = 1
+        result[list(positions)] = documents @ query_vector / (norms * query_norm)
+        return result
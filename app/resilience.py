@@ -0,0 +1,202 @@
+#LLM请求的容错模块：错误分类、重试预算与熔断器
+import asyncio
+import email.utils
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+import httpx
+from openai import APIConnectionError, APIStatusError, APITimeoutError
+from tenacity import AsyncRetrying, RetryCallState, stop_after_attempt, wait_random_exponential
+
+from app.exceptions import CircuitOpenError
+from app.logger import logger
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+def is_retryable(error: BaseException) -> bool:
+    """可重试：超时、连接错误、429和5xx;其余(参数错误、鉴权失败、token超限等)均为致命错误"""
+    if isinstance(error, (APITimeoutError, APIConnectionError, httpx.TimeoutException, httpx.NetworkError, asyncio.TimeoutError)):
+        return True
+    if isinstance(error, APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES or error.status_code >= 500
+    return False
+
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """读取服务端的Retry-After(或retry-after-ms)响应头,没有时返回None"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+    retry_after = headers.get("retry-after")
+    if not retry_after:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        pass
+    try:
+        parsed = email.utils.parsedate_to_datetime(retry_after)  #HTTP日期格式
+    except (TypeError, ValueError):
+        return None  #格式无法识别时按没有该响应头处理
+    return max(0.0, parsed.timestamp() - time.time())
+
+
+class RetryBudget:
+    """
+    进程级重试预算：每个成功请求存入ratio个令牌,每次重试取出1个令牌,
+    余额上限为max_tokens。服务整体故障时重试量被限制在请求量的ratio倍以内,避免重试风暴。
+    """
+
+    def __init__(self, ratio: float = 0.2, max_tokens: float = 10.0):
+        self.ratio = ratio
+        self.max_tokens = max_tokens
+        self.tokens = max_tokens
+        self.exhausted = 0  #因预算耗尽而放弃的重试次数
+
+    def deposit(self) -> None:
+        self.tokens = min(self.max_tokens, self.tokens + self.ratio)
+
+    def try_withdraw(self) -> bool:
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        self.exhausted += 1
+        return False
+
+
+class CircuitBreaker:
+    """
+    单个接口地址的熔断器。
+    连续failure_threshold次可重试错误后打开,打开期间请求立即失败;
+    reset_timeout秒后进入半开状态,只放行一个探测请求,成功则关闭,失败则重新打开。
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    _breakers: Dict[str, "CircuitBreaker"] = {}
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probing = False
+
+    @classmethod
+    def for_endpoint(cls, base_url: str, failure_threshold: int = 5, reset_timeout: float = 30.0) -> "CircuitBreaker":
+        if base_url not in cls._breakers:
+            cls._breakers[base_url] = cls(base_url, failure_threshold, reset_timeout)
+        return cls._breakers[base_url]
+
+    def before_request(self) -> None:
+        """请求前检查,熔断打开时抛出CircuitOpenError"""
+        if self.state == self.OPEN:
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if remaining > 0:
+                raise CircuitOpenError(f"接口{self.name}已熔断，{remaining:.1f}秒后重试")
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            if self._probing:
+                raise CircuitOpenError(f"接口{self.name}正在探测恢复中")
+            self._probing = True
+
+    def release_probe(self) -> None:
+        """探测请求被取消(既未成功也未失败)时,允许下一个请求继续探测"""
+        self._probing = False
+
+    def record_success(self) -> None:
+        if self.state != self.CLOSED:
+            logger.info(f"熔断器-接口{self.name}已恢复")
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._probing = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != self.OPEN:
+                logger.warning(f"熔断器-接口{self.name}连续失败{self.failures}次，熔断{self.reset_timeout}秒")
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+
+class RetryPolicy:
+    """
+    LLM请求的重试策略：只重试可重试错误,优先遵守Retry-After,
+    每次重试消耗进程级重试预算,并通过熔断器在接口故障期间快速失败。
+    """
+
+    budget = RetryBudget()  #进程内所有LLM共享
+
+    def __init__(self, breaker: CircuitBreaker, max_retries: int = 3, max_wait: float = 20.0):
+        self.breaker = breaker
+        self.max_retries = max_retries
+        self.max_wait = max_wait
+        self._backoff = wait_random_exponential(min=1, max=max_wait)
+
+    def _should_retry(self, retry_state: RetryCallState) -> bool:
+        error = retry_state.outcome.exception()
+        if error is None or not is_retryable(error):
+            return False
+        if retry_state.attempt_number > self.max_retries:
+            return False  #已是最后一次尝试,不再消耗重试预算
+        retry_after = retry_after_seconds(error)
+        if retry_after is not None and retry_after > self.max_wait:
+            logger.warning(f"LLM重试-Retry-After为{retry_after:.1f}秒，超过最大等待{self.max_wait}秒，放弃重试")
+            return False
+        if not self.budget.try_withdraw():
+            logger.warning(f"LLM重试-进程重试预算已耗尽，放弃重试")
+            return False
+        return True
+
+    def _wait(self, retry_state: RetryCallState) -> float:
+        retry_after = retry_after_seconds(retry_state.outcome.exception())
+        if retry_after is not None:
+            return retry_after
+        return self._backoff(retry_state)
+
+    def guard(self, error: Optional[BaseException] = None) -> None:
+        """记录一次请求结果到熔断器(供不经过call的流式请求使用)"""
+        if error is None:
+            self.breaker.record_success()
+            self.budget.deposit()
+        elif is_retryable(error):
+            self.breaker.record_failure()
+        elif not isinstance(error, CircuitOpenError):
+            self.breaker.record_success()  #客户端错误说明服务端可达
+
+    async def call(self, fn: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        async for attempt in AsyncRetrying(
+            stop=stop_after_attempt(self.max_retries + 1),
+            wait=self._wait,
+            retry=self._should_retry,
+            before_sleep=lambda state: logger.warning(
+                f"LLM重试-第{state.attempt_number}次请求失败：{state.outcome.exception()}"
+            ),
+            reraise=True,
+        ):
+            with attempt:
+                self.breaker.before_request()
+                try:
+                    result = await fn(*args, **kwargs)
+                except asyncio.CancelledError:
+                    self.breaker.release_probe()
+                    raise
+                except Exception as e:
+                    self.guard(e)
+                    raise
+                self.guard()
+                return result
@@ -0,0 +1,201 @@
+#LLM路由模块：在多个[llm.*]配置之间按延迟和错误率路由,并对慢请求发起对冲请求
+import asyncio
+import time
+from collections import deque
+from typing import AsyncIterator, Deque, Dict, List, Optional, Union
+
+from openai.types.chat.chat_completion_message import ChatCompletionMessage
+
+from app.config import config
+from app.exceptions import TokenLimitExceeded
+from app.llm import LLM, LLMStreamEvent
+from app.logger import logger
+from app.schema import Message
+
+
+class ProfileStats:
+    """单个配置最近一段时间的延迟与错误统计(滚动窗口)"""
+
+    def __init__(self, window: int = 100):
+        self.latencies: Deque[float] = deque(maxlen=window)
+        self.errors: Deque[bool] = deque(maxlen=window)
+        self.last_error = 0.0  #最近一次失败的时间(time.monotonic)
+
+    def record(self, latency: float, error: bool = False) -> None:
+        self.latencies.append(latency)
+        self.errors.append(error)
+        if error:
+            self.last_error = time.monotonic()
+
+    def percentile(self, pct: float) -> Optional[float]:
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        index = min(len(ordered) - 1, int(len(ordered) * pct / 100))
+        return ordered[index]
+
+    @property
+    def error_rate(self) -> float:
+        return sum(self.errors) / len(self.errors) if self.errors else 0.0
+
+    def score(self) -> float:
+        """健康配置之间的路由得分,越小越好：中位延迟按错误率放大;没有样本的配置优先试探"""
+        p50 = self.percentile(50)
+        if p50 is None:
+            return 0.0
+        return p50 * (1 + 10 * self.error_rate)
+
+
+class LLMRouter:
+    """
+    把多个LLM配置当作一个池使用。
+    ask_tool先发给得分最好的配置;若超过该配置的p95延迟仍未返回(或直接失败),
+    再向次优配置发起一次对冲请求,先成功的结果胜出,另一个请求被取消。
+    熔断中、或错误率超过max_error_rate且recovery_time秒内仍有失败的配置排在所有健康配置之后,
+    避免快速失败的配置因延迟低而一直排在首位;超过recovery_time没有新的失败后重新参与排名(相当于一次探测)。
+    """
+
+    def __init__(
+        self,
+        profiles: Optional[List[str]] = None,
+        hedge: bool = True,
+        hedge_percentile: float = 95,
+        default_hedge_delay: float = 10.0,
+        min_samples: int = 5,
+        window: int = 100,
+        max_error_rate: float = 0.5,
+        recovery_time: float = 30.0,
+    ):
+        names = profiles or list(config.llm.keys())
+        self.llms: Dict[str, LLM] = {name: LLM(name) for name in names}
+        self.stats: Dict[str, ProfileStats] = {name: ProfileStats(window) for name in names}
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.default_hedge_delay = default_hedge_delay  #样本不足时的对冲等待时间
+        self.min_samples = min_samples
+        self.max_error_rate = max_error_rate
+        self.recovery_time = recovery_time
+        self.hedged_requests = 0
+        self.hedge_wins = 0
+
+    @property
+    def primary(self) -> LLM:
+        return self.llms[self.ranked()[0]]
+
+    def ranked(self) -> List[str]:
+        """按健康状况和得分排序的配置名称"""
+        return sorted(self.llms, key=lambda name: (self.unhealthy(name), self.stats[name].score()))
+
+    def unhealthy(self, name: str) -> bool:
+        """熔断器打开(且未到探测时间),或近期错误率超过max_error_rate"""
+        breaker = self.llms[name].retry_policy.breaker
+        if breaker.state == breaker.OPEN and time.monotonic() < breaker.opened_at + breaker.reset_timeout:
+            return True
+        stats = self.stats[name]
+        return stats.error_rate > self.max_error_rate and time.monotonic() - stats.last_error < self.recovery_time
+
+    def hedge_delay(self, name: str) -> float:
+        stats = self.stats[name]
+        if len(stats.latencies) < self.min_samples:
+            return self.default_hedge_delay
+        return stats.percentile(self.hedge_percentile)
+
+    async def _timed_ask(self, name: str, *args, **kwargs) -> ChatCompletionMessage | None:
+        start = time.perf_counter()
+        try:
+            result = await self.llms[name].ask_tool(*args, **kwargs)
+        except asyncio.CancelledError:
+            #被对冲请求取消：耗时至少为start以来的时间,作为样本记录以拉低该配置排名
+            self.stats[name].record(time.perf_counter() - start)
+            raise
+        except Exception:
+            self.stats[name].record(time.perf_counter() - start, error=True)
+            raise
+        self.stats[name].record(time.perf_counter() - start)
+        return result
+
+    async def ask_tool(self, *args, **kwargs) -> ChatCompletionMessage | None:
+        """与LLM.ask_tool参数相同,在配置池中路由并按需对冲"""
+        order = self.ranked()
+        primary = order[0]
+        tasks = {asyncio.create_task(self._timed_ask(primary, *args, **kwargs)): primary}
+        if not self.hedge or len(order) < 2:
+            return await next(iter(tasks))
+
+        try:
+            done, _ = await asyncio.wait(tasks, timeout=self.hedge_delay(primary))
+            if not done or next(iter(done)).exception() is not None:
+                secondary = order[1]
+                logger.info(f"LLM路由-配置{primary}响应过慢或失败，向{secondary}发起对冲请求")
+                self.hedged_requests += 1
+                tasks[asyncio.create_task(self._timed_ask(secondary, *args, **kwargs))] = secondary
+
+            last_error: Optional[BaseException] = None
+            pending = set(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if tasks[task] != primary:
+                            self.hedge_wins += 1
+                        return task.result()
+                    last_error = task.exception()
+            raise last_error
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()  #取消落败的请求
+
+    async def ask_tool_stream(self, *args, **kwargs) -> AsyncIterator[LLMStreamEvent]:
+        """流式请求不做对冲(已产出的增量无法撤回);在产出第一个事件之前失败时按排名改用下一个配置"""
+        order = self.ranked()
+        for attempt, name in enumerate(order):
+            start = time.perf_counter()
+            started = False
+            try:
+                async for event in self.llms[name].ask_tool_stream(*args, **kwargs):
+                    started = True
+                    yield event
+            except (TokenLimitExceeded, ValueError):
+                raise  #请求本身的问题,换配置也不会成功
+            except Exception as e:
+                self.stats[name].record(time.perf_counter() - start, error=True)
+                if started or attempt == len(order) - 1:
+                    raise
+                logger.warning(f"LLM路由-配置{name}流式请求失败({e})，改用{order[attempt + 1]}")
+                continue
+            self.stats[name].record(time.perf_counter() - start)
+            return
+
+    @property
+    def max_input_tokens(self) -> Optional[int]:
+        """当前首选配置的单次请求输入上限(对冲时也可能发给次优配置,各配置的上下文长度应一致)"""
+        return self.primary.max_input_tokens
+
+    def count_tokens(self, text: str) -> int:
+        return self.primary.count_tokens(text)
+
+    def count_tools(self, tools: Optional[List[dict]]) -> int:
+        return self.primary.count_tools(tools)
+
+    def count_message_tokens(self, message: Union[dict, Message]) -> int:
+        return self.primary.count_message_tokens(message)
+
+    async def warmup(self) -> None:
+        await asyncio.gather(*(llm.warmup() for llm in self.llms.values()))
+
+    def metrics(self) -> dict:
+        """各配置的滚动延迟与错误率,以及对冲次数"""
+        return {
+            "hedged_requests": self.hedged_requests,
+            "hedge_wins": self.hedge_wins,
+            "profiles": {
+                name: {
+                    "samples": len(stats.latencies),
+                    "p50": stats.percentile(50),
+                    "p95": stats.percentile(95),
+                    "error_rate": round(stats.error_rate, 4),
+                }
+                for name, stats in self.stats.items()
+            },
+        }
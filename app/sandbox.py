@@ -0,0 +1,269 @@
+#本地沙箱模块：不依赖Docker,在解释器进程内按SandboxSettings施加资源限制和网络隔离
+#资源限制优先使用cgroups(v2或v1),不可用时退回到rlimit/nice;网络隔离使用网络命名空间,不可用时禁用socket
+import ctypes
+import errno
+import os
+import resource
+import signal
+import socket
+import time
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from app.config import SandboxSettings
+
+CLONE_NEWUSER = 0x10000000
+CLONE_NEWNET = 0x40000000
+CGROUP_ROOT = Path("/sys/fs/cgroup")
+CGROUP_GROUP = "cogniself-sandbox"  #所有沙箱cgroup的父目录名
+CPU_PERIOD_US = 100_000
+
+_SIZE_UNITS = {"b": 1, "k": 2**10, "m": 2**20, "g": 2**30, "t": 2**40}
+
+
+def parse_size(value: str) -> int:
+    """解析Docker风格的大小(如'512m'、'2g'、'1048576')为字节数"""
+    value = str(value).strip().lower().removesuffix("b") or "0"
+    if value[-1] in _SIZE_UNITS:
+        return int(float(value[:-1]) * _SIZE_UNITS[value[-1]])
+    return int(value)
+
+
+def _write(path: Path, value: str) -> None:
+    with open(path, "w") as f:
+        f.write(value)
+
+
+def _own_cgroups() -> Dict[str, str]:
+    """当前进程所在的cgroup：控制器名 -> 路径;cgroup v2的统一层级记为''"""
+    groups: Dict[str, str] = {}
+    with open("/proc/self/cgroup") as f:
+        for line in f:
+            _, controllers, path = line.rstrip("\n").split(":", 2)
+            for controller in controllers.split(","):
+                groups[controller] = path
+    return groups
+
+
+CGROUP_CONTROLLERS = ("memory", "pids", "cpu")
+CGROUP_SUPERVISOR = "cogniself-supervisor"  #cgroup v2中容纳主进程的叶子目录名
+_prepared_groups: Optional[Dict[str, str]] = None  #prepare_cgroups的结果,每个进程只准备一次
+
+
+def _enable_controllers(directory: Path, supervisor: Optional[Path] = None) -> None:
+    """
+    在directory的subtree_control中启用所需的控制器(已启用的跳过)。
+    v2不允许同时有进程和启用了控制器的子cgroup(根cgroup除外):目录中仍有进程(如主进程)时返回EBUSY,
+    此时把这些进程移入supervisor叶子后重试。
+    """
+    enabled = (directory / "cgroup.subtree_control").read_text().split()
+    missing = " ".join(f"+{name}" for name in CGROUP_CONTROLLERS if name not in enabled)
+    if not missing:
+        return
+    try:
+        _write(directory / "cgroup.subtree_control", missing)
+    except OSError as e:
+        if e.errno != errno.EBUSY or supervisor is None:
+            raise
+        supervisor.mkdir(exist_ok=True)
+        for pid in (directory / "cgroup.procs").read_text().split():
+            try:
+                _write(supervisor / "cgroup.procs", pid)
+            except ProcessLookupError:
+                pass  #进程已退出
+        _write(directory / "cgroup.subtree_control", missing)
+
+
+def _prepare_cgroup_v2() -> Dict[str, str]:
+    own = CGROUP_ROOT / _own_cgroups()[""].lstrip("/")
+    if own.name == CGROUP_SUPERVISOR:
+        own = own.parent  #之前的准备已把主进程移入supervisor叶子
+    group = own / CGROUP_GROUP
+    group.mkdir(exist_ok=True)
+    _enable_controllers(own, own / CGROUP_SUPERVISOR)
+    _enable_controllers(group)
+    return {"": str(group)}
+
+
+def _prepare_cgroup_v1() -> Dict[str, str]:
+    own = _own_cgroups()
+    groups = {}
+    for controller in CGROUP_CONTROLLERS:
+        group = CGROUP_ROOT / controller / own[controller].lstrip("/") / CGROUP_GROUP
+        group.mkdir(exist_ok=True)
+        groups[controller] = str(group)
+    return groups
+
+
+def prepare_cgroups() -> Dict[str, str]:
+    """
+    在主进程中、启动解释器之前调用：创建所有沙箱cgroup的父目录cogniself-sandbox并启用所需的控制器,
+    返回控制器名 -> 父目录(cgroup v2的统一层级记为'');解释器进程只在其中创建并加入自己的叶子。
+    结果在进程内缓存,只准备一次;不可用时抛出OSError。
+    """
+    global _prepared_groups
+    if _prepared_groups is None:
+        if (CGROUP_ROOT / "cgroup.controllers").exists():
+            _prepared_groups = _prepare_cgroup_v2()
+        elif (CGROUP_ROOT / "memory").is_dir():
+            _prepared_groups = _prepare_cgroup_v1()
+        else:
+            raise OSError("没有可用的cgroup层级")
+    return _prepared_groups
+
+
+
+def join_cgroup(settings: SandboxSettings, groups: Dict[str, str]) -> List[Path]:
+    """
+    在解释器进程中调用：在prepare_cgroups准备的父目录下创建本进程的叶子py-<pid>,写入内存、进程数和CPU限制后加入,
+    返回创建的目录;失败时回到原来的cgroup、删除已创建的目录并抛出OSError。不会移动其他进程。
+    """
+    memory, cpu_quota = parse_size(settings.memory_limit), int(settings.cpu_limit * CPU_PERIOD_US)
+    if "" in groups:
+        limits = {"": {"memory.max": str(memory), "pids.max": str(settings.pids_limit), "cpu.max": f"{cpu_quota} {CPU_PERIOD_US}"}}
+    else:
+        limits = {
+            "memory": {"memory.limit_in_bytes": str(memory)},
+            "pids": {"pids.max": str(settings.pids_limit)},
+            "cpu": {"cpu.cfs_period_us": str(CPU_PERIOD_US), "cpu.cfs_quota_us": str(cpu_quota)},
+        }
+    leaves: List[Path] = []
+    joined: List[Path] = []
+    try:
+        for controller, files in limits.items():
+            leaf = Path(groups[controller]) / f"py-{os.getpid()}"
+            leaf.mkdir(exist_ok=True)
+            leaves.append(leaf)
+            for name, value in files.items():
+                _write(leaf / name, value)
+            if controller == "":
+                try:
+                    _write(leaf / "memory.swap.max", "0")
+                except OSError:
+                    pass  #未启用swap记账
+            _write(leaf / "cgroup.procs", str(os.getpid()))
+            joined.append(leaf)
+    except (OSError, KeyError):
+        for leaf in joined:  #回到原来的cgroup(父目录cogniself-sandbox的上一级)
+            try:
+                _write(leaf.parent.parent / "cgroup.procs", str(os.getpid()))
+            except OSError:
+                pass
+        release_cgroups([str(leaf) for leaf in leaves])
+        raise
+    return leaves
+
+
+def release_cgroups(directories: List[str], timeout: float = 0.0) -> None:
+    """
+    进程退出后删除它的cgroup目录。目录中仍有进程(如解释器fork出、尚未退出的执行子进程)时删除会失败,
+    此时结束这些进程并在timeout秒内重试;超时后放弃。
+    """
+    for directory in directories:
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                os.rmdir(directory)
+                break
+            except FileNotFoundError:
+                break
+            except OSError:
+                if time.monotonic() >= deadline:
+                    break
+            try:
+                for pid in Path(directory, "cgroup.procs").read_text().split():
+                    os.kill(int(pid), signal.SIGKILL)
+            except (OSError, ValueError):
+                pass
+            time.sleep(0.05)
+
+
+def isolate_network() -> str:
+    """
+    把当前进程移入新的网络命名空间(只有未启用的回环接口),返回采用的方式。
+    没有CAP_SYS_ADMIN时尝试同时创建用户命名空间;都不可用时退回到在进程内禁用socket。
+    必须在启动任何线程之前调用(如导入numpy之前),多线程进程不能加入新的用户命名空间。
+    """
+    libc = ctypes.CDLL(None, use_errno=True)
+    for flags, method in ((CLONE_NEWNET, "netns"), (CLONE_NEWUSER | CLONE_NEWNET, "userns+netns")):
+        if libc.unshare(flags) == 0:
+            return method
+
+    def blocked(*args, **kwargs):
+        raise OSError("沙箱已禁用网络访问")
+
+    socket.socket.connect = blocked
+    socket.socket.connect_ex = blocked
+    socket.create_connection = blocked
+    socket.getaddrinfo = blocked
+    return "socket"
+
+
+def _user_thread_count() -> int:
+    """当前用户的线程数(RLIMIT_NPROC按线程计数,而不是按进程)"""
+    uid = os.getuid()
+    count = 0
+    for entry in os.scandir("/proc"):
+        if entry.name.isdigit():
+            try:
+                if entry.stat().st_uid == uid:
+                    count += len(os.listdir(f"/proc/{entry.name}/task"))
+            except OSError:
+                pass  #进程已退出
+    return count
+
+
+def limit_with_rlimits(settings: SandboxSettings, memory: bool, pids: bool, cpu: bool) -> List[str]:
+    """
+    cgroup不可用时的退路,返回生效的限制：
+    memory：RLIMIT_AS设为当前虚拟内存加上memory_limit(在预导入之后调用,已映射的库不占用额度)
+    pids：RLIMIT_NPROC按当前用户的线程数加上pids_limit(对root不生效)
+    cpu：没有按比例限制CPU的rlimit,只降低调度优先级,减少对其他会话的影响
+    """
+    applied = []
+    if memory:
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+        limit = current + parse_size(settings.memory_limit)
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        applied.append("rlimit:as")
+    if pids and os.getuid() != 0:
+        limit = _user_thread_count() + settings.pids_limit
+        resource.setrlimit(resource.RLIMIT_NPROC, (limit, limit))
+        applied.append("rlimit:nproc")
+    if cpu:
+        os.nice(10)
+        applied.append("nice")
+    return applied
+
+
+def enter_sandbox(settings: SandboxSettings, workdir: Optional[Path] = None, cgroups: Optional[Dict[str, str]] = None) -> Dict:
+    """
+    在解释器进程启动时(预导入之前)调用：隔离网络、加入cgroup(cgroups为主进程prepare_cgroups的结果)、切换工作目录。
+    返回{"methods": [...], "cgroups": [...], "pending_rlimits": bool},cgroup不可用时由finish_sandbox在预导入之后补上rlimit。
+    """
+    info: Dict = {"methods": [], "cgroups": [], "pending_rlimits": False}
+    if not settings.network_enabled:
+        info["methods"].append(isolate_network())
+    try:
+        if cgroups is None:
+            raise OSError("主进程未能准备cgroup")
+        info["cgroups"] = [str(path) for path in join_cgroup(settings, cgroups)]
+        info["methods"].append("cgroup")
+    except (OSError, KeyError, ValueError) as e:
+        info["pending_rlimits"] = True
+        info["cgroup_error"] = str(e)
+    if workdir is not None:
+        workdir.mkdir(parents=True, exist_ok=True)
+        os.chdir(workdir)
+    return info
+
+
+def finish_sandbox(settings: SandboxSettings, info: Dict) -> Dict:
+    """预导入之后调用：cgroup不可用时施加rlimit"""
+    if info.pop("pending_rlimits"):
+        try:
+            info["methods"] += limit_with_rlimits(settings, memory=True, pids=True, cpu=True)
+        except (OSError, ValueError) as e:
+            info["rlimit_error"] = str(e)
+    return info
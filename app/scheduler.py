@@ -0,0 +1,228 @@
+#LLM请求调度模块：令牌桶限流 + 跨会话公平排队
+import asyncio
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+from typing import Deque, Dict, Optional, Tuple
+
+from app.accounting import current_run
+from app.logger import logger
+
+
+class Priority(IntEnum):
+    """请求优先级,数值越小越先调度"""
+    HIGH = 0
+    NORMAL = 1
+    LOW = 2
+
+
+#当前协程所属的会话及其优先级,由BaseAgent.run设置,LLM调度时读取
+current_session: ContextVar[Tuple[str, Priority]] = ContextVar(
+    "current_session", default=("default", Priority.NORMAL)
+)
+
+
+class TokenBucket:
+    """按分钟速率匀速补充的令牌桶,允许透支(实际用量事后回补)"""
+
+    def __init__(self, rate_per_minute: float, capacity: Optional[float] = None):
+        self.rate = rate_per_minute / 60.0  #每秒补充的令牌数
+        self.capacity = capacity or rate_per_minute
+        self.tokens = self.capacity
+        self._updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """取得amount个令牌还需等待的秒数,0表示可以立即取得"""
+        self._refill()
+        amount = min(amount, self.capacity)  #超过桶容量的请求在桶满时放行
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: float) -> None:
+        self._refill()
+        self.tokens -= amount
+
+
+class _Waiter:
+    __slots__ = ("session_id", "priority", "tokens", "future", "enqueued_at")
+
+    def __init__(self, session_id: str, priority: Priority, tokens: int, future: asyncio.Future):
+        self.session_id = session_id
+        self.priority = priority
+        self.tokens = tokens
+        self.future = future
+        self.enqueued_at = time.monotonic()
+
+
+class LLMScheduler:
+    """
+    同一接口地址共享的LLM请求调度器。
+    按优先级分级排队,同一优先级内按会话轮转(round-robin),
+    避免某个长会话独占配额;放行前检查并发数、每分钟请求数和每分钟token数。
+    """
+
+    _schedulers: Dict[str, "LLMScheduler"] = {}
+    quota_share: float = 1.0  #本进程可使用的配额比例;多进程工作池中每个进程为1/K
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+        max_concurrent_requests: Optional[int] = None,
+    ):
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.max_concurrent_requests = max_concurrent_requests
+        self.in_flight = 0
+        #优先级 -> 会话ID -> 等待队列;OrderedDict的顺序即轮转顺序
+        self._queues: Dict[Priority, "OrderedDict[str, Deque[_Waiter]]"] = {p: OrderedDict() for p in Priority}
+        self._timer: Optional[asyncio.TimerHandle] = None
+        #指标
+        self.granted = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @classmethod
+    def for_endpoint(
+        cls,
+        base_url: str,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+        max_concurrent_requests: Optional[int] = None,
+    ) -> "LLMScheduler":
+        """同一base_url的所有LLM实例共享一个调度器(以首次创建时的限额为准)"""
+        if base_url not in cls._schedulers:
+            share = cls.quota_share
+            cls._schedulers[base_url] = cls(
+                requests_per_minute and max(1, int(requests_per_minute * share)),
+                tokens_per_minute and max(1, int(tokens_per_minute * share)),
+                max_concurrent_requests and max(1, int(max_concurrent_requests * share)),
+            )
+        return cls._schedulers[base_url]
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(len(q) for sessions in self._queues.values() for q in sessions.values())
+
+    @asynccontextmanager
+    async def slot(self, tokens: int = 0, session_id: Optional[str] = None, priority: Optional[Priority] = None):
+        """
+        获取一个请求名额,退出上下文时归还并发名额。
+        参数：
+            tokens：预计消耗的token数量(输入token),用于每分钟token限流
+            session_id/priority：不传时取自current_session
+        """
+        default_session, default_priority = current_session.get()
+        session_id = session_id or default_session
+        priority = Priority(priority if priority is not None else default_priority)
+
+        waiter = _Waiter(session_id, priority, tokens, asyncio.get_running_loop().create_future())
+        self._queues[priority].setdefault(session_id, deque()).append(waiter)
+        self._dispatch()
+        try:
+            await waiter.future
+        except asyncio.CancelledError:
+            if waiter.future.done() and not waiter.future.cancelled():
+                self._release()  #放行后才被取消,归还名额
+            else:
+                self._remove(waiter)
+            raise
+
+        wait = time.monotonic() - waiter.enqueued_at
+        self.total_wait += wait
+        self.max_wait = max(self.max_wait, wait)
+        run = current_run.get()
+        if run is not None:
+            run.record_queue_wait(wait)
+        if wait > 1:
+            logger.info(f"LLM调度-会话{session_id}排队{wait:.2f}秒，当前队列深度：{self.queue_depth}")
+        try:
+            yield
+        finally:
+            self._release()
+
+    def record_usage(self, tokens: int) -> None:
+        """请求完成后补记放行时未计入的token(如输出token)"""
+        if self.token_bucket and tokens > 0:
+            self.token_bucket.consume(tokens)
+
+    def metrics(self) -> dict:
+        """调度器指标：队列深度、在途请求数、等待时间"""
+        return {
+            "queue_depth": self.queue_depth,
+            "queue_depth_by_priority": {
+                p.name.lower(): sum(len(q) for q in self._queues[p].values()) for p in Priority
+            },
+            "in_flight": self.in_flight,
+            "granted": self.granted,
+            "wait_seconds_total": round(self.total_wait, 6),
+            "wait_seconds_avg": round(self.total_wait / self.granted, 6) if self.granted else 0.0,
+            "wait_seconds_max": round(self.max_wait, 6),
+        }
+
+    def _release(self) -> None:
+        self.in_flight -= 1
+        self._dispatch()
+
+    def _remove(self, waiter: _Waiter) -> None:
+        sessions = self._queues[waiter.priority]
+        queue = sessions.get(waiter.session_id)
+        if queue and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del sessions[waiter.session_id]
+        self._dispatch()
+
+    def _next_waiter(self) -> Optional[_Waiter]:
+        """按优先级取出下一个会话的队首请求(不出队)"""
+        for priority in Priority:
+            sessions = self._queues[priority]
+            if sessions:
+                session_id = next(iter(sessions))
+                return sessions[session_id][0]
+        return None
+
+    def _pop(self, waiter: _Waiter) -> None:
+        """出队并把该会话轮转到同级队尾"""
+        sessions = self._queues[waiter.priority]
+        queue = sessions.pop(waiter.session_id)
+        queue.popleft()
+        if queue:
+            sessions[waiter.session_id] = queue
+
+    def _dispatch(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while True:
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            if waiter.future.done():  #已被取消
+                self._pop(waiter)
+                continue
+            if self.max_concurrent_requests and self.in_flight >= self.max_concurrent_requests:
+                return  #等待某个请求归还名额
+            delay = max(
+                self.request_bucket.wait_time(1) if self.request_bucket else 0.0,
+                self.token_bucket.wait_time(waiter.tokens) if self.token_bucket else 0.0,
+            )
+            if delay > 0:
+                self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+                return
+            self._pop(waiter)
+            if self.request_bucket:
+                self.request_bucket.consume(1)
+            if self.token_bucket:
+                self.token_bucket.consume(waiter.tokens)
+            self.in_flight += 1
+            self.granted += 1
+            waiter.future.set_result(None)
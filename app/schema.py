@@ -1,8 +1,12 @@
 #架构文件
+import hashlib
+import json
+from collections import Counter, deque
 from enum import Enum
-from typing import Any, List, Literal, Optional, Union
+from itertools import islice
+from typing import Any, Callable, Deque, Dict, Iterable, List, Literal, Optional, Tuple, Union
 from app.logger import logger
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr
 
 
 class Role(str, Enum):
@@ -45,6 +49,8 @@ class ToolCall(BaseModel):
 
 class Message(BaseModel):
     """Represents a chat message in the conversation"""#表示对话中的聊天消息
+    #消息不可变：线格式(dict/JSON)和token数在首次使用时计算并缓存,之后每次请求直接复用
+    model_config = ConfigDict(frozen=True)
 
     role: ROLE_TYPE = Field(...)  # type: ignore
     content: Optional[str] = Field(default=None)
@@ -53,6 +59,10 @@ class Message(BaseModel):
     tool_call_id: Optional[str] = Field(default=None)
     base64_image: Optional[str] = Field(default=None)
 
+    _wire: Optional[dict] = PrivateAttr(default=None)
+    _json: Optional[str] = PrivateAttr(default=None)
+    _tokens: Dict[str, int] = PrivateAttr(default_factory=dict)  #模型名 -> token数
+
     def __add__(self, other) -> List["Message"]:
         """支持 Message + list 或 Message + Message 的操作"""
         if isinstance(other, list):
@@ -74,19 +84,44 @@ class Message(BaseModel):
             )
 
     def to_dict(self) -> dict:
-        """Convert message to dictionary format"""
-        message = {"role": self.role}
-        if self.content is not None:
-            message["content"] = self.content
-        if self.tool_calls is not None:
-            message["tool_calls"] = [tool_call.dict() for tool_call in self.tool_calls]
-        if self.name is not None:
-            message["name"] = self.name
-        if self.tool_call_id is not None:
-            message["tool_call_id"] = self.tool_call_id
-        if self.base64_image is not None:
-            message["base64_image"] = self.base64_image
-        return message
+        """Convert message to dictionary format(结果被缓存,调用方不要修改返回的字典)"""
+        cache = self.__pydantic_private__  #直接读私有属性字典,绕过BaseModel.__getattr__
+        if cache["_wire"] is None:
+            message = {"role": self.role}
+            if self.content is not None:
+                message["content"] = self.content
+            if self.tool_calls is not None:
+                message["tool_calls"] = [tool_call.model_dump() for tool_call in self.tool_calls]
+            if self.name is not None:
+                message["name"] = self.name
+            if self.tool_call_id is not None:
+                message["tool_call_id"] = self.tool_call_id
+            if self.base64_image is not None:
+                message["base64_image"] = self.base64_image
+            cache["_wire"] = message
+        return cache["_wire"]
+
+    def to_json(self) -> str:
+        """消息的JSON形式(缓存)"""
+        cache = self.__pydantic_private__
+        if cache["_json"] is None:
+            cache["_json"] = json.dumps(self.to_dict(), ensure_ascii=False)
+        return cache["_json"]
+
+    def cached_tokens(self, key: str, count: Callable[["Message"], int]) -> int:
+        """按key(通常为模型名)缓存的token数,未缓存时调用count计算"""
+        tokens = self.__pydantic_private__["_tokens"]
+        if key not in tokens:
+            tokens[key] = count(self)
+        return tokens[key]
+
+    def model_copy(self, *, update: Optional[dict] = None, deep: bool = False) -> "Message":
+        """复制时丢弃缓存,避免修改后的副本沿用原消息的线格式"""
+        copied = super().model_copy(update=update, deep=deep)
+        copied._wire = None
+        copied._json = None
+        copied._tokens = {}
+        return copied
 
     @classmethod
     def user_message(cls, content: str, base64_image: Optional[str] = None) -> "Message":
@@ -136,29 +171,196 @@ class Message(BaseModel):
         )
 
 class Memory(BaseModel):  #表示对话的记忆
-    messages: List[Message] = Field(default_factory=list)  #消息列表，List类型
+    #有界双端队列：追加和从头部淘汰都是O(1),不再在达到上限后重新切片整个列表
+    messages: Deque[Message] = Field(default_factory=deque)
     max_messages: int = Field(default=100)
+    token_counter: Optional[Callable[[Message], int]] = Field(default=None, exclude=True)  #单条消息token计数函数(通常为LLM.count_message_tokens)
+    #落盘存储(app.message_store.MessageStore)：设置后每条消息都写入磁盘,messages只是最近的常驻窗口,
+    #更早的消息通过load_message/load_messages按序号读取
+    store: Optional[Any] = Field(default=None, exclude=True)
+    resident_token_budget: Optional[int] = Field(default=None, description="常驻窗口的token预算,超出后淘汰最早的消息")
+
+    _token_counts: Deque[int] = PrivateAttr(default_factory=deque)  #与messages一一对应的token数量
+    _total_tokens: int = PrivateAttr(default=0)  #当前记忆的累计token数量
+    #增量计数,供检查点等只处理新消息：累计追加数、累计从头部淘汰数、整体替换的次数
+    _appended: int = PrivateAttr(default=0)
+    _dropped: int = PrivateAttr(default=0)
+    _revision: int = PrivateAttr(default=0)
+    _indices: Deque[Optional[int]] = PrivateAttr(default_factory=deque)  #与messages一一对应的绝对序号,替换后新生成的消息为None
+
+    #卡住检测：最近fingerprint_window条assistant消息(内容+工具调用)及"工具调用+结果"循环的指纹,
+    #计数表随窗口滑动增减,追加消息和查询重复次数都是O(1),不需要重新扫描历史
+    fingerprint_window: int = Field(default=8)
+    _assistant_fingerprints: Deque[bytes] = PrivateAttr(default_factory=deque)
+    _assistant_counts: Counter = PrivateAttr(default_factory=Counter)
+    _cycle_fingerprints: Deque[bytes] = PrivateAttr(default_factory=deque)
+    _cycle_counts: Counter = PrivateAttr(default_factory=Counter)
+    _open_cycle: Optional[Any] = PrivateAttr(default=None)  #当前未结束循环的增量哈希(hashlib对象)
 
     def add_message(self, message: Message) -> None:
         """Add a message to memory"""
         #logger.info(f"add message: {message}")
+        self._sync_token_counts()
+        if self.store is not None:
+            self.store.append(self._appended, message)
         self.messages.append(message)
+        self._indices.append(self._appended)
+        self._appended += 1
+        self._fingerprint(message)
+        if self.token_counter is not None:
+            tokens = self.token_counter(message)
+            self._token_counts.append(tokens)
+            self._total_tokens += tokens
         # Optional: Implement message limit
-        if len(self.messages) > self.max_messages:
-            self.messages = self.messages[-self.max_messages :]
+        over_budget = self.resident_token_budget is not None and self._total_tokens > self.resident_token_budget
+        if len(self.messages) > self.max_messages or over_budget:
+            while len(self.messages) > self.max_messages:
+                self._drop_oldest()
+            while (
+                self.resident_token_budget is not None
+                and self._total_tokens > self.resident_token_budget
+                and len(self.messages) > 1
+            ):
+                self._drop_oldest()
+            #不保留失去对应tool_calls的tool消息
+            while len(self.messages) > 1 and self.messages[0].role == Role.TOOL:
+                self._drop_oldest()
+
+    def _drop_oldest(self) -> None:
+        self.messages.popleft()
+        if self._indices:
+            self._indices.popleft()
+        self._dropped += 1
+        if self._token_counts:
+            self._total_tokens -= self._token_counts.popleft()
 
     def add_messages(self, messages: List[Message]) -> None:
         """Add multiple messages to memory"""
-        self.messages.extend(messages)
+        for message in messages:
+            self.add_message(message)
 
     def clear(self) -> None:
         """Clear all messages"""
         self.messages.clear()
+        self._indices = deque()
+        self._token_counts = deque()
+        self._total_tokens = 0
+        self._revision += 1
+        self._assistant_fingerprints.clear()
+        self._assistant_counts.clear()
+        self._cycle_fingerprints.clear()
+        self._cycle_counts.clear()
+        self._open_cycle = None
+
+    def _fingerprint(self, message: Message) -> None:
+        """更新卡住检测的指纹窗口"""
+        if message.role == Role.TOOL:
+            if self._open_cycle is not None:
+                self._open_cycle.update(f"\x00{message.name}\x00{message.content}".encode("utf-8"))
+            return
+        self._close_cycle()
+        if message.role != Role.ASSISTANT or not (message.content or message.tool_calls):
+            return
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update((message.content or "").strip().encode("utf-8"))
+        cycle = hashlib.blake2b(digest_size=16)  #循环只看工具调用和结果,措辞不同的思考内容不影响判断
+        for call in message.tool_calls or []:
+            call_bytes = f"\x00{call.function.name}\x00{call.function.arguments}".encode("utf-8")
+            digest.update(call_bytes)
+            cycle.update(call_bytes)
+        self._push(self._assistant_fingerprints, self._assistant_counts, digest.digest())
+        if message.tool_calls:
+            self._open_cycle = cycle  #后续tool消息继续累加到同一个哈希上
+
+    def _close_cycle(self) -> None:
+        if self._open_cycle is not None:
+            self._push(self._cycle_fingerprints, self._cycle_counts, self._open_cycle.digest())
+            self._open_cycle = None
+
+    def _push(self, window: Deque[bytes], counts: Counter, fingerprint: bytes) -> None:
+        window.append(fingerprint)
+        counts[fingerprint] += 1
+        if len(window) > self.fingerprint_window:
+            evicted = window.popleft()
+            counts[evicted] -= 1
+            if not counts[evicted]:
+                del counts[evicted]
+
+    def repeated_response_count(self) -> int:
+        """最近一条assistant消息(内容+工具调用)在窗口内之前出现过的次数"""
+        if not self._assistant_fingerprints:
+            return 0
+        return self._assistant_counts[self._assistant_fingerprints[-1]] - 1
+
+    def repeated_cycle_count(self) -> int:
+        """最近一次"工具调用+相同结果"循环在窗口内之前出现过的次数"""
+        if self._open_cycle is not None:
+            return self._cycle_counts[self._open_cycle.digest()]
+        if not self._cycle_fingerprints:
+            return 0
+        return self._cycle_counts[self._cycle_fingerprints[-1]] - 1
+
+    def replace_messages(self, messages: Iterable[Message]) -> None:
+        """整体替换消息(如上下文压缩后),并重新计算逐条token数;原样保留的消息沿用原来的绝对序号"""
+        indices = dict(zip(map(id, self.messages), self._indices)) if len(self._indices) == len(self.messages) else {}
+        self.messages = deque(messages)
+        self._indices = deque(indices.get(id(message)) for message in self.messages)
+        self._token_counts = deque()
+        self._total_tokens = 0
+        self._revision += 1
+        self._sync_token_counts()
 
     def get_recent_messages(self, n: int) -> List[Message]:
         """Get n most recent messages"""
-        return self.messages[-n:]
+        return list(islice(reversed(self.messages), n))[::-1]
+
+    def attach_store(self, store: Any) -> None:
+        """挂载落盘存储;存储中已有消息(如恢复会话)时,新消息的序号接在其后"""
+        self.store = store
+        self._appended = max(self._appended, len(store))
+
+    def load_message(self, index: int) -> Optional[Message]:
+        """按追加顺序的绝对序号读取一条消息(含已淘汰出常驻窗口的);没有落盘存储时只能读取常驻窗口"""
+        if self.store is not None:
+            return self.store.get(index)
+        return next((message for message, position in self._resident_indexed() if position == index), None)
+
+    def load_messages(self, start: int, stop: Optional[int] = None) -> List[Message]:
+        """按序号区间[start, stop)读取消息"""
+        stop = self._appended if stop is None else stop
+        if self.store is not None:
+            return self.store.range(start, stop)
+        return [message for message, position in self._resident_indexed() if position is not None and start <= position < stop]
+
+    def _resident_indexed(self) -> Iterable[Tuple[Message, Optional[int]]]:
+        """常驻窗口中的(消息, 绝对序号);messages被直接修改过(序号对不上)时为空"""
+        return zip(self.messages, self._indices) if len(self._indices) == len(self.messages) else ()
+
+    @property
+    def appended_count(self) -> int:
+        return self._appended
+
+    @property
+    def dropped_count(self) -> int:
+        return self._dropped
+
+    @property
+    def revision(self) -> int:
+        return self._revision
 
     def to_dict_list(self) -> List[dict]:
         """Convert messages to list of dicts"""
-        return [msg.to_dict() for msg in self.messages]
\ No newline at end of file
+        return [msg.to_dict() for msg in self.messages]
+
+    @property
+    def total_tokens(self) -> int:
+        """当前记忆的累计token数量,每条消息只计数一次"""
+        self._sync_token_counts()
+        return self._total_tokens
+
+    def _sync_token_counts(self) -> None:
+        """messages被直接替换或修改时,重新对齐逐条token计数(计数函数本身带缓存)"""
+        if self.token_counter is None or len(self._token_counts) == len(self.messages):
+            return
+        self._token_counts = deque(self.token_counter(msg) for msg in self.messages)
+        self._total_tokens = sum(self._token_counts)
@@ -11,6 +11,9 @@ class BaseTool(ABC, BaseModel):# 继承ABC和BaseModel类, 定义抽象基类Bas
     name: str # 定义一个字符串类型的属性name
     description: str # 定义一个字符串类型的属性description
     parameters: Optional[dict] = None # 定义一个字典类型的属性parameters，用来保存运行参数
+    max_concurrency: Optional[int] = None # 同一工具实例的最大并发执行数，None表示不限制(不可重入的工具设为1)
+    cacheable: bool = False # 结果只取决于参数且没有副作用的工具(如搜索)可开启结果缓存，有副作用的工具(执行代码、终止等)不能开启
+    cache_ttl: float = 300.0 # 缓存结果的有效期(秒)
 
     class Config:
         arbitrary_types_allowed = True # 允许任意类型,types意思是类型，allowed意思是允许，arbitrary意思是任意。
@@ -23,6 +26,9 @@ class BaseTool(ABC, BaseModel):# 继承ABC和BaseModel类, 定义抽象基类Bas
     async def execute(self, **kwargs) -> Any:  #Any是任意类型
         """定义抽象方法execute，用来执行工具的功能。"""
 
+    def warmup(self) -> None:
+        """在后台预先准备工具依赖的资源(如解释器进程),不阻塞调用方;默认不做任何事。"""
+
     def to_param(self) -> Dict:  #Dict是字典类型 to_params意思是转换为参数
         """将工具的属性转换为字典类型，用于保存运行参数。"""
         return {
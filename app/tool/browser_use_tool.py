@@ -9,6 +9,7 @@ Context = TypeVar("Context")
 class BrowserUseTool(BaseTool, Generic[Context]):#浏览器使用工具
     name: str = "browser_use"
     description: str = _BROWSER_DESCRIPTION
+    max_concurrency: Optional[int] = 1 #浏览器上下文不可重入，同一时间只执行一个操作
     parameters: dict = {
         "type": "object",
         "properties": {
@@ -1,13 +1,15 @@
-import multiprocessing
-import sys
-from io import StringIO
 from typing import Dict
 from app.logger import logger
 
+from pydantic import Field, model_validator
+
+from app.config import config
+from app.python_pool import PythonWorkerPool
+from app.scheduler import current_session
 from app.tool.base import BaseTool
 
 class PythonExecute(BaseTool):    #执行python代码
-    """一个用于安全执行Python代码机超时处理的工具。"""
+    """一个用于安全执行Python代码机超时处理的工具。代码在预启动的解释器进程池中执行(见app.python_pool)。"""
 
     name: str = "执行python代码"
     description: str = "执行Python代码字符串。注意：只有打印输出可见，函数返回值不会被捕获。使用打印语句查看结果"
@@ -21,25 +23,34 @@ class PythonExecute(BaseTool):    #执行python代码
         },
         "required": ["code"],
     }
+    #常驻模式：每个会话使用一个常驻解释器,变量、导入和加载的数据在多次调用之间保留
+    persistent: bool = Field(default_factory=lambda: config.python.persistent_kernels, description="是否使用会话常驻解释器")
+
+    @model_validator(mode="after")
+    def describe_persistent_mode(self) -> "PythonExecute":
+        """常驻模式下告知模型变量会保留,并提供reset参数"""
+        if self.persistent and "reset" not in self.parameters["properties"]:
+            self.description += "。变量、导入的模块和加载的数据在同一会话的多次调用之间保留，可直接使用之前定义的变量"
+            self.parameters = {
+                **self.parameters,
+                "properties": {
+                    **self.parameters["properties"],
+                    "reset": {
+                        "type": "boolean",
+                        "description": "先重启会话解释器并清除之前定义的所有变量，再执行code(code可为空字符串)。",
+                    },
+                },
+            }
+        return self
 
-    def _run_code(self, code: str, result_dict: dict, safe_globals: dict) -> None:
-        original_stdout = sys.stdout
-        try:
-            output_buffer = StringIO()
-            sys.stdout = output_buffer
-            exec(code, safe_globals, safe_globals)
-            result_dict["observation"] = output_buffer.getvalue()
-            result_dict["success"] = True
-        except Exception as e:
-            result_dict["observation"] = str(e)
-            result_dict["success"] = False
-        finally:
-            sys.stdout = original_stdout
+    def warmup(self) -> None:
+        PythonWorkerPool.shared()  #创建共享池时即在后台启动解释器进程
 
     async def execute(
             self,
             code: str,
             timeout: int=5,
+            reset: bool=False,
     ) -> Dict:
         """
         执行携带有Python代码及超时设置。
@@ -47,29 +58,14 @@ class PythonExecute(BaseTool):    #执行python代码
         参数：
         code（str）：要执行的python代码；
         timeout（int）：执行超时（秒）；
+        reset（bool）：常驻模式下先重置当前会话的解释器；
 
         返回：
         Dict(dict)：包含带有执行输出或错误消息和“成功”状态的“输出”
         """
-
-        with multiprocessing.Manager() as manager:
-            result = manager.dict({"observation":"","success":False})
-            if isinstance(__builtins__, dict):
-                safe_globals ={"__builtins__": __builtins__}
-            else:
-                safe_globals ={"__builtins__": __builtins__.__dict__.copy()}
-            proc = multiprocessing.Process(
-                target=self._run_code, args=(code,result,safe_globals)
-            )
-            proc.start()
-            proc.join(timeout)
-
-            #超时处理
-            if proc.is_alive():
-                proc.terminate()
-                proc.join(1)
-                return {
-                    "observation": f"Execution timeout after {timeout} seconds",
-                    "success": False,
-                }
-            return dict(result)
\ No newline at end of file
+        #解释器已预先启动并导入常用模块,这里只通过管道提交代码并异步等待结果;超时或崩溃的解释器由池回收重建
+        pool = PythonWorkerPool.shared()
+        if self.persistent:
+            session_id, _ = current_session.get()
+            return await pool.run_in_kernel(session_id, code, timeout, reset=reset)
+        return await pool.run(code, timeout)
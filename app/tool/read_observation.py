@@ -0,0 +1,38 @@
+from app.observation import observation_store
+from app.tool.base import BaseTool
+
+_READ_OBSERVATION_DESCRIPTION = """Read a page of a tool output that was shortened before being shown to you.
+Use the observation_id from the '已省略' note and choose the line range you need."""
+
+
+class ReadObservation(BaseTool):#分页查看被裁剪的工具输出
+    name: str = "read_observation"
+    description: str = _READ_OBSERVATION_DESCRIPTION
+    parameters: dict = {
+        "type": "object",
+        "properties": {
+            "observation_id": {
+                "type": "string",
+                "description": "The id of the shortened observation, e.g. obs-1a2b3c4d5e6f.",
+            },
+            "start_line": {
+                "type": "integer",
+                "description": "First line to read (1-based). Default 1.",
+            },
+            "max_lines": {
+                "type": "integer",
+                "description": "Number of lines to read. Default 100.",
+            },
+        },
+        "required": ["observation_id"],
+    }
+
+    async def execute(self, observation_id: str, start_line: int = 1, max_lines: int = 100) -> str:
+        """返回完整输出中[start_line, start_line + max_lines)的行,带行号"""
+        lines = observation_store.get(observation_id)
+        if lines is None:
+            return f"错误：观察结果{observation_id}不存在或已被淘汰"
+        start = max(1, start_line)
+        page = lines[start - 1 : start - 1 + max(1, max_lines)]
+        body = "\n".join(f"{number}: {line}" for number, line in enumerate(page, start))
+        return f"{observation_id} 第{start}-{start + len(page) - 1}行(共{len(lines)}行)：\n{body}"
@@ -0,0 +1,226 @@
+#编译后的工具注册表：缓存工具参数列表及其JSON,为每个工具的parameters预编译参数校验函数
+import inspect
+import json
+import re
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from app.tool.base import BaseTool
+
+#校验函数：参数合法时返回None,否则返回可直接交给模型的错误描述
+Validator = Callable[[Any, str], Optional[str]]
+
+_TYPE_CHECKS: Dict[str, Callable[[Any], bool]] = {
+    "string": lambda v: isinstance(v, str),
+    "integer": lambda v: isinstance(v, int) and not isinstance(v, bool),
+    "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    "boolean": lambda v: isinstance(v, bool),
+    "array": lambda v: isinstance(v, list),
+    "object": lambda v: isinstance(v, dict),
+    "null": lambda v: v is None,
+}
+
+
+def _type_name(value: Any) -> str:
+    for name in ("boolean", "integer", "number", "string", "array", "object", "null"):
+        if _TYPE_CHECKS[name](value):
+            return name
+    return type(value).__name__
+
+
+def _where(path: str) -> str:
+    return f"参数'{path}'" if path else "参数"
+
+
+def compile_schema(schema: Optional[dict]) -> Validator:
+    """
+    把JSON Schema编译为校验函数(闭包),编译时展开所有关键字,校验时只做必要的判断。
+    支持工具定义中常用的关键字：type、enum、const、properties、required、additionalProperties、dependencies、
+    items、minItems/maxItems、minLength/maxLength、pattern、minimum/maximum、exclusiveMinimum/exclusiveMaximum、anyOf/oneOf;
+    其他关键字(如format、description、default)忽略。
+    """
+    if not schema:
+        return lambda value, path: None
+    checks: List[Validator] = []
+
+    if "type" in schema:
+        types = schema["type"] if isinstance(schema["type"], list) else [schema["type"]]
+        type_checks = [_TYPE_CHECKS[t] for t in types if t in _TYPE_CHECKS]
+        expected = "或".join(types)
+
+        def check_type(value, path):
+            if not any(check(value) for check in type_checks):
+                return f"{_where(path)}应为{expected}类型，实际为{_type_name(value)}：{json.dumps(value, ensure_ascii=False)[:100]}"
+        if type_checks:
+            checks.append(check_type)
+
+    if "enum" in schema:
+        options = schema["enum"]
+        allowed = set(json.dumps(option, sort_keys=True) for option in options)
+
+        def check_enum(value, path):
+            if json.dumps(value, sort_keys=True) not in allowed:
+                return f"{_where(path)}的值{json.dumps(value, ensure_ascii=False)[:100]}无效，可选值：{', '.join(map(str, options))}"
+        checks.append(check_enum)
+
+    if "const" in schema:
+        const = schema["const"]
+
+        def check_const(value, path):
+            if value != const:
+                return f"{_where(path)}必须为{json.dumps(const, ensure_ascii=False)}"
+        checks.append(check_const)
+
+    properties = {name: compile_schema(sub) for name, sub in (schema.get("properties") or {}).items()}
+    required = list(schema.get("required") or [])
+    additional = schema.get("additionalProperties", True)
+    additional_check = compile_schema(additional) if isinstance(additional, dict) else None
+    dependencies = {k: v for k, v in (schema.get("dependencies") or {}).items() if isinstance(v, list)}
+    if properties or required or additional is not True or dependencies:
+        known = ", ".join(properties) or "无"
+
+        def check_object(value, path):
+            if not isinstance(value, dict):
+                return None  #类型由type检查
+            prefix = f"{path}." if path else ""
+            for name in required:
+                if name not in value:
+                    return f"缺少必需参数'{prefix}{name}'"
+            for name, item in value.items():
+                check = properties.get(name)
+                if check is not None:
+                    error = check(item, prefix + name)
+                elif additional is False:
+                    return f"未知参数'{prefix}{name}'，可用参数：{known}"
+                elif additional_check is not None:
+                    error = additional_check(item, prefix + name)
+                else:
+                    continue
+                if error:
+                    return error
+            for name, needed in dependencies.items():
+                if name in value:
+                    for other in needed:
+                        if other not in value:
+                            return f"提供参数'{prefix}{name}'时必须同时提供'{prefix}{other}'"
+        checks.append(check_object)
+
+    if "items" in schema or "minItems" in schema or "maxItems" in schema:
+        item_check = compile_schema(schema["items"]) if isinstance(schema.get("items"), dict) else None
+        min_items, max_items = schema.get("minItems"), schema.get("maxItems")
+
+        def check_array(value, path):
+            if not isinstance(value, list):
+                return None
+            if min_items is not None and len(value) < min_items:
+                return f"{_where(path)}至少需要{min_items}项，实际为{len(value)}项"
+            if max_items is not None and len(value) > max_items:
+                return f"{_where(path)}最多允许{max_items}项，实际为{len(value)}项"
+            if item_check is not None:
+                for index, item in enumerate(value):
+                    error = item_check(item, f"{path}[{index}]")
+                    if error:
+                        return error
+        checks.append(check_array)
+
+    if "minLength" in schema or "maxLength" in schema or "pattern" in schema:
+        min_length, max_length = schema.get("minLength"), schema.get("maxLength")
+        pattern = re.compile(schema["pattern"]) if "pattern" in schema else None
+
+        def check_string(value, path):
+            if not isinstance(value, str):
+                return None
+            if min_length is not None and len(value) < min_length:
+                return f"{_where(path)}长度至少为{min_length}"
+            if max_length is not None and len(value) > max_length:
+                return f"{_where(path)}长度最多为{max_length}，实际为{len(value)}"
+            if pattern is not None and not pattern.search(value):
+                return f"{_where(path)}不匹配格式{pattern.pattern}"
+        checks.append(check_string)
+
+    bounds = [(key, schema[key]) for key in ("minimum", "maximum", "exclusiveMinimum", "exclusiveMaximum")
+              if isinstance(schema.get(key), (int, float)) and not isinstance(schema.get(key), bool)]
+    if bounds:
+        compare = {
+            "minimum": (lambda v, b: v >= b, "不能小于"),
+            "maximum": (lambda v, b: v <= b, "不能大于"),
+            "exclusiveMinimum": (lambda v, b: v > b, "必须大于"),
+            "exclusiveMaximum": (lambda v, b: v < b, "必须小于"),
+        }
+        rules = [(compare[key][0], bound, compare[key][1]) for key, bound in bounds]
+
+        def check_bounds(value, path):
+            if not _TYPE_CHECKS["number"](value):
+                return None
+            for ok, bound, text in rules:
+                if not ok(value, bound):
+                    return f"{_where(path)}{text}{bound}，实际为{value}"
+        checks.append(check_bounds)
+
+    for key in ("anyOf", "oneOf"):
+        if isinstance(schema.get(key), list):
+            alternatives = [compile_schema(sub) for sub in schema[key]]
+
+            def check_alternatives(value, path, alternatives=alternatives):
+                errors = [alternative(value, path) for alternative in alternatives]
+                if all(errors):
+                    return errors[0]
+            checks.append(check_alternatives)
+
+    if len(checks) == 1:
+        return checks[0]
+
+    def validate(value, path):
+        for check in checks:
+            error = check(value, path)
+            if error:
+                return error
+    return validate
+
+
+def _compile_tool(tool: BaseTool) -> Validator:
+    """
+    工具参数的校验函数：在parameters的基础上,execute不接受**kwargs时拒绝execute签名中也没有的参数(否则会在工具内部报TypeError);
+    签名中有、parameters中未声明的参数(如python工具的timeout)接受但不做限制,也不出现在错误提示的可用参数中。
+    """
+    schema = tool.parameters or {"type": "object"}
+    validate = compile_schema(schema)
+    signature = inspect.signature(tool.execute).parameters
+    if "additionalProperties" in schema or any(p.kind is p.VAR_KEYWORD for p in signature.values()):
+        return validate
+    advertised = schema.get("properties") or {}
+    accepted = set(signature) | set(advertised)
+    known = ", ".join(advertised) or "无"
+
+    def validate_tool(value, path):
+        error = validate(value, path)
+        if error:
+            return error
+        for name in value:
+            if name not in accepted:
+                return f"未知参数'{name}'，可用参数：{known}"
+    return validate_tool
+
+
+class ToolParams(list):
+    """编译后的工具参数列表(即请求中的tools),附带预先序列化的JSON;同一版本内是同一个对象,不应修改"""
+    __slots__ = ("json",)
+
+
+class ToolRegistry:
+    """
+    工具集编译后的只读快照：参数列表、其JSON以及各工具的参数校验函数。
+    由ToolCollection按需编译,version随add_tool/add_tools递增,版本变化前一直复用。
+    """
+
+    def __init__(self, tools: Iterable[BaseTool], version: int):
+        tools = tuple(tools)
+        self.version = version
+        self.params = ToolParams(tool.to_param() for tool in tools)
+        self.params.json = json.dumps(self.params, ensure_ascii=False)
+        self.validators: Dict[str, Validator] = {tool.name: _compile_tool(tool) for tool in tools}
+
+    def validate(self, name: str, arguments: Any) -> Optional[str]:
+        """校验工具调用的参数;合法时返回None,否则返回错误描述"""
+        if not isinstance(arguments, dict):
+            return f"参数应为JSON对象，实际为{_type_name(arguments)}"
+        return self.validators[name](arguments, "")
@@ -1,7 +1,12 @@
 from app.tool.search.baidu_search import BaiduSearchEngine
 from app.tool.search.base import WebSearchEngine
+from app.tool.search.hedged_search import EngineHealth, HedgedSearch
+from app.tool.search.stub_search import StubSearchEngine
 
 __all__ = [
     'BaiduSearchEngine',   # 百度搜索引擎
-    'WebSearchEngine'     # WEB搜索引擎基类
-]
\ No newline at end of file
+    'WebSearchEngine',     # WEB搜索引擎基类
+    'HedgedSearch',        # 多引擎对冲搜索
+    'EngineHealth',        # 搜索引擎健康统计
+    'StubSearchEngine',    # 离线测试用的桩搜索引擎
+]
@@ -1,7 +1,25 @@
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+#同步搜索引擎专用的线程池：搜索请求可能长时间挂起,不占用事件循环的默认线程池
+_search_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _search_executor
+    if _search_executor is None:
+        _search_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="web-search")
+    return _search_executor
+
+
 class WebSearchEngine:#WEB搜索引擎基类
+    name: str = "engine" # 引擎名称,用于健康统计和日志
+
     def perform_search(self, query: str, num_results: int = 10, *args, **kwargs) -> list[dict]:
         """
-        进行搜索，返回搜索结果列表
+        进行搜索，返回搜索结果列表(同步引擎实现此方法)
         参数：
             query: 搜索关键字
             num_results: 搜索结果数量
@@ -10,3 +28,10 @@ class WebSearchEngine:#WEB搜索引擎基类
         """
         raise NotImplementedError
 
+    async def search(self, query: str, num_results: int = 10) -> list:
+        """
+        异步搜索。默认在专用线程池中执行同步的perform_search,不阻塞事件循环;原生异步的引擎直接重写此方法。
+        调用方超时放弃时,线程中的同步请求仍会执行完毕,但结果被丢弃。
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(_get_executor(), functools.partial(self.perform_search, query, num_results))
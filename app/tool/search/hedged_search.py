@@ -0,0 +1,139 @@
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional, Tuple
+
+from app.exceptions import CircuitOpenError, SearchError
+from app.logger import logger
+from app.resilience import CircuitBreaker
+from app.tool.search.base import WebSearchEngine
+
+
+class EngineHealth:
+    """
+    单个搜索引擎的健康统计(进程内按引擎名共享)。
+    score是成功率的指数移动平均,latency是成功请求耗时的指数移动平均;
+    连续失败failure_threshold次后熔断cooldown秒,熔断期间该引擎被跳过而不是等待。
+    """
+    _engines: Dict[str, "EngineHealth"] = {}
+
+    def __init__(self, name: str, failure_threshold: int = 3, cooldown: float = 60.0, alpha: float = 0.3):
+        self.name = name
+        self.alpha = alpha
+        self.score = 1.0
+        self.latency: Optional[float] = None
+        self.breaker = CircuitBreaker(f"搜索引擎{name}", failure_threshold, cooldown)
+
+    @classmethod
+    def for_engine(cls, name: str) -> "EngineHealth":
+        if name not in cls._engines:
+            cls._engines[name] = cls(name)
+        return cls._engines[name]
+
+    @property
+    def available(self) -> bool:
+        """未熔断,或熔断已到期可以探测"""
+        breaker = self.breaker
+        return breaker.state != breaker.OPEN or time.monotonic() >= breaker.opened_at + breaker.reset_timeout
+
+    def record_success(self, latency: float) -> None:
+        self.score += self.alpha * (1.0 - self.score)
+        self.latency = latency if self.latency is None else self.latency + self.alpha * (latency - self.latency)
+        self.breaker.record_success()
+
+    def record_failure(self) -> None:
+        self.score -= self.alpha * self.score
+        self.breaker.record_failure()
+
+
+class HedgedSearch:
+    """
+    多引擎搜索：按健康度排序(score高、延迟低的在前),熔断中的引擎直接跳过。
+    先向排名第一的引擎发出请求,hedge_delay秒内没有结果或该引擎失败时再启动下一个,
+    已启动的请求并行进行,第一个非空结果胜出,其余请求被取消;hedge_delay为0时所有引擎同时搜索。
+    同步引擎在线程池中执行,整个过程不阻塞事件循环。
+    """
+
+    def __init__(self, engines: List[WebSearchEngine], hedge_delay: float = 1.0, timeout: float = 10.0):
+        self.engines = engines
+        self.hedge_delay = hedge_delay
+        self.timeout = timeout
+
+    def ranked(self) -> List[WebSearchEngine]:
+        """可用的引擎,按健康度排序(同分时保持配置顺序)"""
+        healths = {engine.name: EngineHealth.for_engine(engine.name) for engine in self.engines}
+        available = [engine for engine in self.engines if healths[engine.name].available]
+        return sorted(
+            available,
+            key=lambda engine: (-round(healths[engine.name].score, 2), healths[engine.name].latency or math.inf),
+        )
+
+    async def search(self, query: str, num_results: int = 10) -> Tuple[str, list]:
+        """返回(胜出的引擎名, 结果);所有引擎都失败或超时时抛出SearchError"""
+        waiting: Deque[WebSearchEngine] = deque(self.ranked())
+        if not waiting:
+            raise SearchError("所有搜索引擎都处于熔断状态，暂时不可用")
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.timeout
+        running: Dict[asyncio.Task, Tuple[WebSearchEngine, float]] = {}
+        errors: Dict[str, str] = {}
+        empty: Optional[str] = None  #返回了空结果的引擎
+
+        def launch() -> None:
+            """启动下一个可用的引擎"""
+            while waiting:
+                engine = waiting.popleft()
+                try:
+                    EngineHealth.for_engine(engine.name).breaker.before_request()
+                except CircuitOpenError as e:
+                    errors[engine.name] = str(e)
+                    continue
+                running[asyncio.ensure_future(engine.search(query, num_results))] = (engine, loop.time())
+                return
+
+        launch()
+        while self.hedge_delay <= 0 and waiting:
+            launch()
+        try:
+            while running:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                done, _ = await asyncio.wait(
+                    running, timeout=min(remaining, self.hedge_delay) if waiting else remaining,
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if not done:
+                    launch()  #当前引擎迟迟没有结果,对冲启动下一个
+                    continue
+                for task in done:
+                    engine, started = running.pop(task)
+                    health = EngineHealth.for_engine(engine.name)
+                    error = task.exception()
+                    if error is None:
+                        health.record_success(loop.time() - started)
+                        results = task.result()
+                        if results:
+                            logger.info(f"网络搜索-引擎{engine.name}胜出，耗时{loop.time() - started:.2f}秒")
+                            return engine.name, results
+                        empty = empty or engine.name
+                    else:
+                        health.record_failure()
+                        errors[engine.name] = f"{type(error).__name__}: {error}"
+                        logger.warning(f"网络搜索-引擎{engine.name}失败：{errors[engine.name]}")
+                    launch()  #失败或没有结果时立即启动下一个,不等对冲延迟
+            for engine, _ in running.values():
+                EngineHealth.for_engine(engine.name).record_failure()
+                errors[engine.name] = f"超时({self.timeout:g}秒)"
+        finally:
+            for task, (engine, _) in running.items():
+                if task.done():
+                    if not task.cancelled():
+                        task.exception()  #与胜出者同时完成的请求,取出结果避免"exception was never retrieved"
+                else:
+                    task.cancel()
+                EngineHealth.for_engine(engine.name).breaker.release_probe()
+        if empty is not None:
+            return empty, []  #有引擎正常返回,只是没有结果
+        raise SearchError("所有搜索引擎都失败：" + "；".join(f"{name}：{error}" for name, error in errors.items()))
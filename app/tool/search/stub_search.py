@@ -0,0 +1,41 @@
+import asyncio
+from typing import Dict, List, Optional
+
+from app.tool.search.base import WebSearchEngine
+
+
+class StubSearchEngine(WebSearchEngine):
+    """
+    本地的桩搜索引擎,不访问网络,用于离线测试和演示。
+    results按查询给出固定结果,未给出的查询返回根据查询生成的示例链接;
+    delay模拟延迟,error不为None时每次搜索都抛出该异常(用于测试失败切换)。
+    """
+
+    def __init__(
+        self,
+        name: str = "stub",
+        results: Optional[Dict[str, List[dict]]] = None,
+        delay: float = 0.0,
+        error: Optional[Exception] = None,
+    ):
+        self.name = name
+        self.results = results or {}
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    async def search(self, query: str, num_results: int = 10) -> list:
+        self.calls += 1
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        if query in self.results:
+            return self.results[query][:num_results]
+        return [
+            {"title": f"{query} - 示例结果{rank}", "url": f"https://example.com/{self.name}/{rank}?q={query}", "rank": rank}
+            for rank in range(1, num_results + 1)
+        ]
+
+    def perform_search(self, query: str, num_results: int = 10, *args, **kwargs) -> list:
+        return asyncio.run(self.search(query, num_results))
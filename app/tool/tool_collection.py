@@ -1,10 +1,15 @@
 #tool_collection.py是工具集，主要用于存放一些工具类，比如数据库连接池、日志记录器、缓存、消息队列等。
-from typing import Dict, Any, List
+import asyncio
+from typing import Dict, Any, List, Optional
 
+from app.accounting import current_run
 from app.exceptions import ToolError
 from app.logger import logger
 from app.tool import BaseTool
 from app.tool.base import ToolResult, ToolFailure
+from app.tool.registry import ToolParams, ToolRegistry
+from app.tool_cache import ToolResultCache
+from app.tracing import tracer
 
 class ToolCollection:#工具集类
     """工具集类"""
@@ -16,24 +21,72 @@ class ToolCollection:#工具集类
         logger.info(f"智能体(工具调用)-工具集功能-正在初始化...")
         self.tools = tools
         self.tool_map = {tool.name: tool for tool in tools}
+        self._semaphores: Dict[str, asyncio.Semaphore] = {} #按工具名限制并发执行数
+        self.version = 0  #工具集版本,add_tool/add_tools时递增
+        self._registry: Optional[ToolRegistry] = None
+        self.result_cache: Optional[ToolResultCache] = ToolResultCache.shared() #可缓存工具的结果缓存,None表示不缓存
 
     def __iter__(self):#迭代器
         logger.info(f"智能体(工具调用)-工具集功能-正在遍历所有工具")
         return iter(self.tools)
 
-    def to_params(self) -> List[Dict[str, Any]]:
-        return [tool.to_param() for tool in self.tools]
+    def warmup(self) -> None:
+        """让各工具在后台预先准备资源,首次调用时不必等待冷启动"""
+        for tool in self.tools:
+            tool.warmup()
+
+    @property
+    def registry(self) -> ToolRegistry:
+        """编译后的工具注册表,工具集变化后首次访问时重新编译"""
+        if self._registry is None or self._registry.version != self.version:
+            self._registry = ToolRegistry(self.tools, self.version)
+        return self._registry
+
+    def to_params(self) -> ToolParams:
+        """缓存的工具参数列表(工具集不变时每次返回同一个对象,调用方不应修改)"""
+        return self.registry.params
 
     async def execute(self, *, name:str, tool_input: Dict[str, Any]=None) -> ToolResult: # 执行
         logger.info(f"智能体(工具调用)-工具集功能-执行方法")
         tool = self.tool_map.get(name)
         if not tool:
             return ToolFailure(error=f"Tool {name} is invalid")
-        try:
-            result = await tool(**tool_input)
+        with tracer.span("tool.execute", tool=name) as span:
+            error = self.registry.validate(name, tool_input or {})
+            if error:
+                span.set(failed=True, invalid_arguments=True)
+                logger.warning(f"智能体(工具调用)-工具集功能-工具{name}的参数校验失败：{error}")
+                return ToolFailure(error=f"工具{name}的参数无效：{error}。请修正参数后重新调用")
+            try:
+                if tool.cacheable and self.result_cache is not None:
+                    result, cached = await self.result_cache.get_or_run(
+                        name, tool_input or {}, tool.cache_ttl, lambda: self._run(tool, tool_input)
+                    )
+                    span.set(cached=cached)
+                    run = current_run.get()
+                    if run is not None:
+                        run.record_tool_cache(name, cached)
+                else:
+                    result = await self._run(tool, tool_input)
+            except ToolError as e:
+                result = ToolFailure(error=e.message)
+            if getattr(result, "error", None):
+                span.set(failed=True)
             return result
-        except ToolError as e:
-            return ToolFailure(error=e.message)
+
+    async def _run(self, tool: BaseTool, tool_input: Optional[Dict[str, Any]]) -> Any:
+        semaphore = self._get_semaphore(tool)
+        if semaphore is None:
+            return await tool(**(tool_input or {}))
+        async with semaphore:
+            return await tool(**(tool_input or {}))
+
+    def _get_semaphore(self, tool: BaseTool) -> Optional[asyncio.Semaphore]:
+        if not tool.max_concurrency:
+            return None
+        if tool.name not in self._semaphores:
+            self._semaphores[tool.name] = asyncio.Semaphore(tool.max_concurrency)
+        return self._semaphores[tool.name]
 
     async def execute_all(self) -> List[ToolResult]:
         """Execute all tools in the collection sequentially."""
@@ -52,6 +105,7 @@ class ToolCollection:#工具集类
     def add_tool(self, tool: BaseTool):
         self.tools += (tool,)
         self.tool_map[tool.name] = tool
+        self.version += 1
         return self
 
     def add_tools(self, *tools: BaseTool):
@@ -1,10 +1,16 @@
+import asyncio
+from typing import List, Optional
+
+from app.config import config
+from app.exceptions import SearchError, ToolError
+from app.logger import logger
 from app.tool.base import BaseTool
-from app.tool.search import WebSearchEngine, BaiduSearchEngine
+from app.tool.search import BaiduSearchEngine, HedgedSearch, StubSearchEngine, WebSearchEngine
 
 
 class WebSearch(BaseTool):# 继承BaseTool类，定义网络搜索类WebSearch。
-    name = "网络搜索"
-    description = """执行网络搜索并返回相关链接的列表。尝试使用主要搜索引擎API获取最新结果。意思是如果发生错误，则回退到备用搜索引擎。"""
+    name: str = "网络搜索"
+    description: str = """执行网络搜索并返回相关链接的列表。尝试使用主要搜索引擎API获取最新结果。意思是如果发生错误，则回退到备用搜索引擎。"""
     parameters: dict = {
         "type": "object",
         "properties": {
@@ -13,15 +19,20 @@ class WebSearch(BaseTool):# 继承BaseTool类，定义网络搜索类WebSearch
         },
         "required": ["query"],
     }
+    cacheable: bool = True # 同一查询短时间内的结果基本不变，重复搜索直接使用缓存
+    cache_ttl: float = 3600.0
     _search_engine:dict[str, WebSearchEngine] ={
-        "baidu": BaiduSearchEngine()
+        "baidu": BaiduSearchEngine(),
+        "stub": StubSearchEngine(), # 不访问网络的桩引擎，用于离线测试
     }# 定义搜索引擎列表
+    _searcher: Optional[HedgedSearch] = None
 
     async def execute(self, query: str, num_results: int = 10) -> list[str]:#execute方法，执行网络搜索并返回相关链接的列表。
         """
         执行Web搜索并返回URL列表。
-        根据配置按顺序尝试引擎，如果引擎出现故障并出现错误，则回退。
-        如果所有引擎都失败，它将等待并重试配置的次数。
+        按健康度对配置的引擎(engine和fallback_engines)排序，先请求最健康的引擎，超过hedge_delay没有结果或失败时
+        并行启动下一个，第一个非空结果胜出；熔断中的引擎直接跳过。
+        如果所有引擎都失败，等待retry_delay秒后重试，最多max_retries次(没有可用引擎时不再重试)。
         参数：
             query: (必填)提交给搜索引擎的搜索查询
             num_results: (可选)要返回的搜索结果数。默认值为10
@@ -29,6 +40,45 @@ class WebSearch(BaseTool):# 继承BaseTool类，定义网络搜索类WebSearch
             一个URL列表，包含搜索结果。
         """
         # 从配置文件中获取重试设置。
-        retry_delay = 60 # 重试延迟，单位为秒
-        max_retries = 3 # 最大重试次数
+        settings = config.search_config
+        retry_delay = settings.retry_delay if settings else 1.0 # 重试延迟，单位为秒
+        max_retries = settings.max_retries if settings else 3 # 最大重试次数
+        searcher = self._get_searcher()
+        for attempt in range(max_retries + 1):
+            try:
+                engine, results = await searcher.search(query, num_results)
+                return [self._to_url(result) for result in results]
+            except SearchError as e:
+                if attempt >= max_retries or not searcher.ranked():
+                    raise ToolError(f"网络搜索失败：{e}")
+                logger.warning(f"网络搜索-第{attempt + 1}次搜索失败，{retry_delay:g}秒后重试：{e}")
+                await asyncio.sleep(retry_delay)
+
+    def _get_searcher(self) -> HedgedSearch:
+        """按配置的引擎顺序组装多引擎搜索(首次使用时创建);未实现的引擎跳过"""
+        if self._searcher is None:
+            self._searcher = self._build_searcher()
+        return self._searcher
+
+    def _build_searcher(self) -> HedgedSearch:
+        settings = config.search_config
+        names: List[str] = [settings.engine, *settings.fallback_engines] if settings else ["baidu"]
+        engines: List[WebSearchEngine] = []
+        for name in names:
+            engine: Optional[WebSearchEngine] = self._search_engine.get(name.lower())
+            if engine is None:
+                logger.warning(f"网络搜索-不支持的搜索引擎{name}，已跳过")
+            elif engine not in engines:
+                engines.append(engine)
+        if not engines:
+            engines.append(self._search_engine["baidu"])
+        if settings:
+            return HedgedSearch(engines, settings.hedge_delay, settings.timeout)
+        return HedgedSearch(engines)
 
+    @staticmethod
+    def _to_url(result) -> str:
+        """搜索结果(字典或字符串)转为URL"""
+        if isinstance(result, dict):
+            return result.get("url") or result.get("link") or str(result)
+        return str(result)
@@ -0,0 +1,207 @@
+#工具结果缓存模块：按工具名和规范化的参数缓存幂等工具(如搜索)的结果,内存LRU加可选的磁盘(SQLite)层
+import asyncio
+import copy
+import hashlib
+import json
+import sqlite3
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple, Union
+
+from app.config import config
+from app.logger import logger
+from app.tool.base import CLIResult, ToolResult
+
+_RESULT_TYPES = {cls.__name__: cls for cls in (ToolResult, CLIResult)}
+
+
+def _dump(result: Any) -> Optional[str]:
+    """序列化结果以写入磁盘;不能序列化为JSON的结果返回None(只缓存在内存中)"""
+    try:
+        if isinstance(result, ToolResult):
+            return json.dumps({"result_type": type(result).__name__, "fields": result.model_dump()}, ensure_ascii=False)
+        return json.dumps({"value": result}, ensure_ascii=False)
+    except (TypeError, ValueError):
+        return None
+
+
+def _load(data: str) -> Any:
+    payload = json.loads(data)
+    if "fields" in payload:
+        return _RESULT_TYPES.get(payload["result_type"], ToolResult)(**payload["fields"])
+    return payload["value"]
+
+
+def _succeeded(result: Any) -> bool:
+    """只缓存成功的结果：非空,且没有error(ToolResult)或success为False(字典结果)"""
+    if not result or getattr(result, "error", None):
+        return False
+    return not (isinstance(result, dict) and result.get("success") is False)
+
+
+class ToolResultCache:
+    """
+    幂等工具的结果缓存,由ToolCollection.execute使用,只对cacheable=True的工具生效。
+    - 键：工具名 + 参数的规范化JSON(键排序)的哈希,参数顺序不同的同一调用命中同一条目;
+    - 内存层：按最近使用淘汰的LRU,最多max_entries条,条目带过期时间(工具的cache_ttl);
+    - 磁盘层(可选)：SQLite文件,多个工作进程共享(WAL模式),跨会话、跨进程复用结果,内存未命中时查询;
+    - 同一键的并发调用只执行一次,其余等待其结果;
+    - 只缓存成功的结果(有error或为空的结果不缓存);缓存和返回的都是副本,调用方修改结果不会影响缓存。
+    磁盘读写在专用的单线程线程池中执行(写入不等待完成),多个进程争用文件锁时不阻塞事件循环。
+    每个进程使用一个共享实例(shared),由配置中的[tool_cache]部分决定。
+    """
+    _shared: Optional["ToolResultCache"] = None
+
+    def __init__(self, max_entries: int = 1024, disk_path: Optional[Union[str, Path]] = None):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()  #键 -> (过期时间, 结果)
+        self._pending: Dict[str, asyncio.Future] = {}  #正在执行的调用
+        self.hits: Dict[str, int] = defaultdict(int)  #工具名 -> 命中次数(含磁盘层)
+        self.disk_hits: Dict[str, int] = defaultdict(int)
+        self.misses: Dict[str, int] = defaultdict(int)
+        self._writes = 0
+        self._db: Optional[sqlite3.Connection] = None
+        self._executor: Optional[ThreadPoolExecutor] = None  #磁盘读写专用的线程(单线程,连接不会被并发使用)
+        if disk_path is not None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="tool-cache")
+            path = Path(disk_path)
+            path.parent.mkdir(parents=True, exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)  #自动提交
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS tool_results (key TEXT PRIMARY KEY, tool TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, data TEXT NOT NULL)"
+            )
+
+    @classmethod
+    def shared(cls) -> Optional["ToolResultCache"]:
+        """进程内共享的缓存;配置中关闭时返回None"""
+        settings = config.tool_cache
+        if not settings.enabled:
+            return None
+        if cls._shared is None:
+            cls._shared = cls(settings.max_entries, settings.disk_path)
+        return cls._shared
+
+    @staticmethod
+    def make_key(name: str, arguments: Dict[str, Any]) -> str:
+        canonical = json.dumps(arguments, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+        return hashlib.sha1(f"{name}\0{canonical}".encode("utf-8")).hexdigest()
+
+    async def get(self, key: str) -> Tuple[Optional[str], Any]:
+        """查找未过期的结果,返回(命中的层"memory"/"disk",未命中为None, 结果的副本);磁盘层命中的结果会放入内存层"""
+        now = time.time()
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > now:
+                self._entries.move_to_end(key)
+                return "memory", copy.deepcopy(entry[1])
+            del self._entries[key]
+        if self._db is not None:
+            row = await asyncio.get_running_loop().run_in_executor(self._executor, self._read, key, now)
+            if row is not None:
+                result = _load(row[1])
+                self._remember(key, row[0], result)
+                return "disk", copy.deepcopy(result)
+        return None, None
+
+    def _read(self, key: str, now: float) -> Optional[Tuple[float, str]]:
+        try:
+            return self._db.execute(
+                "SELECT expires_at, data FROM tool_results WHERE key = ? AND expires_at > ?", (key, now)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.warning(f"工具结果缓存-读取磁盘缓存失败：{e}")
+            return None
+
+    def put(self, name: str, key: str, result: Any, ttl: float) -> None:
+        """缓存结果的副本;磁盘写入提交到专用线程后立即返回"""
+        expires_at = time.time() + ttl
+        self._remember(key, expires_at, copy.deepcopy(result))
+        if self._db is None:
+            return
+        data = _dump(result)
+        if data is not None:
+            self._executor.submit(self._write, name, key, expires_at, data)
+
+    def _write(self, name: str, key: str, expires_at: float, data: str) -> None:
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO tool_results (key, tool, expires_at, data) VALUES (?, ?, ?, ?)",
+                (key, name, expires_at, data),
+            )
+            self._writes += 1
+            if self._writes % 256 == 0:  #定期清理过期条目
+                self._db.execute("DELETE FROM tool_results WHERE expires_at <= ?", (time.time(),))
+        except sqlite3.Error as e:
+            logger.warning(f"工具结果缓存-写入磁盘缓存失败：{e}")
+
+    def _remember(self, key: str, expires_at: float, result: Any) -> None:
+        self._entries[key] = (expires_at, result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def get_or_run(
+        self, name: str, arguments: Dict[str, Any], ttl: float, run: Callable[[], Awaitable[Any]]
+    ) -> Tuple[Any, bool]:
+        """返回(结果, 是否来自缓存);未命中时执行run并缓存成功的结果,同一键的并发调用共享一次执行"""
+        key = self.make_key(name, arguments)
+        while True:
+            source, result = await self.get(key)
+            if source is not None:
+                self.hits[name] += 1
+                if source == "disk":
+                    self.disk_hits[name] += 1
+                return result, True
+            pending = self._pending.get(key)
+            if pending is None:
+                break
+            try:
+                result = await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    raise  #等待者自己被取消
+                continue  #执行的调用被取消,由本调用重新执行
+            self.hits[name] += 1
+            return copy.deepcopy(result), True
+        self.misses[name] += 1
+        future = asyncio.get_running_loop().create_future()
+        self._pending[key] = future
+        try:
+            result = await run()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            future.exception()  #没有等待者时不报"Future exception was never retrieved"
+            raise
+        else:
+            future.set_result(result)
+            if _succeeded(result):
+                self.put(name, key, result, ttl)
+            return result, False
+        finally:
+            del self._pending[key]
+
+    def stats(self) -> Dict[str, Dict[str, int]]:
+        """各工具的命中/未命中次数"""
+        return {
+            name: {"hits": self.hits[name], "disk_hits": self.disk_hits[name], "misses": self.misses[name]}
+            for name in sorted(set(self.hits) | set(self.misses))
+        }
+
+    def clear(self) -> None:
+        self._entries.clear()
+        if self._db is not None:
+            self._executor.submit(self._db.execute, "DELETE FROM tool_results").result()  #排在未完成的写入之后
+
+    def close(self) -> None:
+        if self._db is not None:
+            self._executor.shutdown(wait=True)  #等待未完成的写入
+            self._db.close()
+            self._db = None
@@ -0,0 +1,205 @@
+#链路追踪模块：为run/step/think/act/LLM请求/工具执行记录带父子关系的span,导出为Chrome trace-event JSON
+import heapq
+import itertools
+import json
+import os
+import threading
+import time
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Union
+
+
+class TraceFile:
+    """
+    本地导出器：以Chrome trace-event的JSON数组格式追加写入span(可直接用chrome://tracing或Perfetto打开)。
+    该格式允许省略结尾的"]",因此文件只追加、不改写,进程中断后已写入的部分仍可查看。
+    同一路径在进程内共享一个实例;每个根span结束时把它的全部事件一次性写入(O_APPEND),多进程写同一文件不会交错。
+    """
+    _files: Dict[Path, "TraceFile"] = {}
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        if os.fstat(self._fd).st_size == 0:
+            os.write(self._fd, b"[\n")
+        self._pending: List[str] = []
+        self._lock = threading.Lock()
+
+    @classmethod
+    def get(cls, path: Union[str, Path]) -> "TraceFile":
+        key = Path(path).resolve()
+        if key not in cls._files:
+            cls._files[key] = cls(key)
+        return cls._files[key]
+
+    def add(self, event: dict) -> None:
+        with self._lock:
+            self._pending.append(json.dumps(event, ensure_ascii=False, separators=(",", ":"), default=str))
+
+    def flush(self) -> None:
+        with self._lock:
+            if not self._pending:
+                return
+            data = ",\n".join(self._pending) + ",\n"
+            self._pending.clear()
+        os.write(self._fd, data.encode("utf-8"))
+
+
+class Span:
+    """一个计时区间。通过Tracer.span创建,用作(同步)上下文管理器;set可在区间内补充属性(如token数)"""
+    __slots__ = ("tracer", "name", "attributes", "activate", "span_id", "parent", "trace_id", "exporter",
+                 "lane", "start", "owned", "_token")
+
+    def __init__(self, tracer: "Tracer", name: str, attributes: Dict[str, Any], activate: bool):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.activate = activate
+        self.exporter: Optional[TraceFile] = None
+        self.owned = False  #根span自带导出器
+
+    def set(self, **attributes: Any) -> "Span":
+        self.attributes.update(attributes)
+        return self
+
+    def __enter__(self) -> "Span":
+        self.tracer._open(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        self.tracer._close(self)
+        return False
+
+
+class _NoopSpan:
+    """追踪关闭时返回的共享空span,进入/退出/设置属性都不做任何事"""
+    __slots__ = ()
+
+    def set(self, **attributes: Any) -> "_NoopSpan":
+        return self
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+#当前span,随asyncio任务的上下文传递,子任务自动继承父span
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+class Tracer:
+    """
+    span记录器。
+    没有导出目标时span()直接返回NOOP_SPAN,开销只有一次属性判断;
+    export_to设置进程级导出文件,或在创建根span时通过exporter参数为单次run指定文件,子span沿用根span的导出器。
+    并发的兄弟span(如并行执行的工具)会被分配到不同的轨道(tid),保证每条轨道上的区间严格嵌套。
+    """
+
+    def __init__(self):
+        self.exporter: Optional[TraceFile] = None
+        self._active = 0  #进程级导出器(0/1) + 正在进行且自带导出器的根span数
+        self._ids = itertools.count(1)
+        self._lanes: Dict[int, List[Span]] = {}  #轨道 -> 该轨道上未结束的span(栈)
+        self._free_lanes: List[int] = []  #空闲轨道(小顶堆),优先复用编号小的轨道
+        self._pid = os.getpid()
+        self._epoch = time.time_ns() // 1000 - time.perf_counter_ns() // 1000  #perf_counter换算为墙钟(微秒)
+
+    @property
+    def enabled(self) -> bool:
+        return self._active > 0
+
+    def export_to(self, path: Optional[Union[str, Path]]) -> None:
+        """设置(或传None取消)进程级导出文件,此后所有根span都写入该文件"""
+        self._active += (path is not None) - (self.exporter is not None)
+        self.exporter = TraceFile.get(path) if path is not None else None
+
+    def span(self, name: str, exporter: Optional[TraceFile] = None, activate: bool = True, **attributes: Any):
+        """
+        创建span。
+        exporter：只对根span有效,为这次追踪指定导出文件
+        activate：为False时不把该span设为当前span(用于异步生成器等会在区间内把控制权交还调用方的场景)
+        """
+        if not self._active and exporter is None:
+            return NOOP_SPAN
+        span = Span(self, name, attributes, activate)
+        if exporter is not None:
+            span.exporter = exporter
+        return span
+
+    def _open(self, span: Span) -> None:
+        parent = _current_span.get()
+        span.span_id = next(self._ids)
+        span.parent = parent
+        if parent is not None:
+            span.trace_id = parent.trace_id
+            span.exporter = parent.exporter
+        else:
+            span.trace_id = span.span_id
+            if span.exporter is None:
+                span.exporter = self.exporter
+            else:
+                span.owned = True
+                self._active += 1
+        if span.exporter is None:  #导出器在区间开始前被取消
+            span.lane = None
+            span._token = None
+            return
+        lanes = self._lanes
+        if parent is not None and parent.lane is not None and lanes[parent.lane] and lanes[parent.lane][-1] is parent:
+            span.lane = parent.lane
+        else:
+            span.lane = heapq.heappop(self._free_lanes) if self._free_lanes else len(lanes) + 1
+            lanes.setdefault(span.lane, [])
+        lanes[span.lane].append(span)
+        span._token = _current_span.set(span) if span.activate else None
+        span.start = time.perf_counter_ns() // 1000
+
+    def _close(self, span: Span) -> None:
+        if span.lane is None:
+            return
+        end = time.perf_counter_ns() // 1000
+        if span._token is not None:
+            try:
+                _current_span.reset(span._token)
+            except ValueError:  #在其他上下文中结束(如异步生成器被垃圾回收时关闭)
+                _current_span.set(span.parent)
+        stack = self._lanes[span.lane]
+        if stack and stack[-1] is span:
+            stack.pop()
+        elif span in stack:
+            stack.remove(span)
+        if not stack:
+            heapq.heappush(self._free_lanes, span.lane)
+        args = dict(span.attributes, span_id=span.span_id, trace_id=span.trace_id)
+        if span.parent is not None:
+            args["parent_id"] = span.parent.span_id
+        span.exporter.add({
+            "name": span.name,
+            "cat": span.name.split(".", 1)[0],
+            "ph": "X",
+            "ts": self._epoch + span.start,
+            "dur": end - span.start,
+            "pid": self._pid,
+            "tid": span.lane,
+            "args": args,
+        })
+        if span.parent is None:
+            span.exporter.flush()
+            if span.owned:
+                self._active -= 1
+
+
+tracer = Tracer()
+
+
+def current_span() -> Union[Span, _NoopSpan]:
+    """当前span;追踪关闭或不在任何span中时返回NOOP_SPAN,可直接调用set"""
+    return _current_span.get() or NOOP_SPAN
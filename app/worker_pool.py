@@ -0,0 +1,222 @@
+#多进程工作池：K个工作进程各自运行一个事件循环,突破单进程GIL的吞吐上限
+import asyncio
+import multiprocessing
+import threading
+from itertools import count
+from multiprocessing.connection import Connection
+from typing import Dict, List, Optional
+
+from app.accounting import MetricsRegistry
+from app.logger import logger
+
+
+def _worker_entry(
+    conn: Connection, workers: int, concurrency: int, max_steps: Optional[int], trace_file: Optional[str] = None
+) -> None:
+    """工作进程入口(必须是模块级函数,spawn方式下才能被子进程导入)"""
+    from app.scheduler import LLMScheduler
+    from app.tracing import tracer
+
+    LLMScheduler.quota_share = 1 / workers  #各进程平分LLM限流配额,合计不超过配置值
+    if trace_file:
+        tracer.export_to(trace_file)  #各进程按pid区分,追加写入同一个trace文件
+    try:
+        asyncio.run(_worker_main(conn, concurrency, max_steps))
+    except KeyboardInterrupt:
+        pass
+
+
+async def _worker_main(conn: Connection, concurrency: int, max_steps: Optional[int]) -> None:
+    """
+    工作进程的事件循环：从管道接收任务,并发运行会话,每完成一个会话回传结果记录和本进程的指标快照。
+    消息格式：
+        主进程 -> 工作进程：("task", task) | ("stop",)
+        工作进程 -> 主进程：("result", task_id, record, snapshot)
+    """
+    from app.accounting import metrics_registry
+    from app.batch import default_tools, run_session
+
+    loop = asyncio.get_running_loop()
+    tools = default_tools()
+    semaphore = asyncio.Semaphore(concurrency)
+    send_lock = threading.Lock()  #conn.send在线程池中执行,需串行化
+    running = set()
+    sequence = count(1)  #快照序号：发送在线程中进行,主进程据此丢弃乱序到达的旧快照
+
+    async def handle(task: dict):
+        async with semaphore:
+            try:
+                record = await run_session(task, tools, max_steps)
+            except Exception as e:
+                record = {"id": task["id"], "status": "error", "error": f"{type(e).__name__}: {e}"}
+        snapshot = {**metrics_registry.snapshot(), "seq": next(sequence)}
+        message = ("result", task["id"], record, snapshot)
+        await asyncio.to_thread(_locked_send, send_lock, conn, message)
+
+    while True:
+        try:
+            message = await loop.run_in_executor(None, conn.recv)  #阻塞读取放在线程中,不阻塞事件循环
+        except EOFError:  #主进程已退出
+            break
+        if message[0] == "stop":
+            break
+        job = asyncio.create_task(handle(message[1]))
+        running.add(job)
+        job.add_done_callback(running.discard)
+
+    if running:
+        await asyncio.gather(*running, return_exceptions=True)
+    conn.close()
+
+
+def _locked_send(lock: threading.Lock, conn: Connection, message: tuple) -> None:
+    with lock:
+        conn.send(message)
+
+
+class _Worker:
+    """主进程中对一个工作进程的记录"""
+
+    def __init__(self, index: int, process: multiprocessing.Process, conn: Connection):
+        self.index = index
+        self.process = process
+        self.conn = conn
+        self.in_flight: Dict[str, dict] = {}  #任务ID -> 任务,用于崩溃后重新分配
+        self.snapshot: dict = {}  #最近一次回传的指标快照
+
+
+class WorkerPool:
+    """
+    工作进程池的监督者(运行在主进程的事件循环中)。
+    - 每个任务分配给在途任务最少的工作进程,总在途数不超过workers*concurrency;
+    - 工作进程崩溃(管道EOF)时自动重启,其在途任务重新分配一次,再次失败则返回错误记录;
+    - metrics()合并所有工作进程(包括已退出进程)的指标。
+    进程使用spawn方式创建,在Linux、macOS和Windows上行为一致。
+    """
+
+    def __init__(
+        self, workers: int, concurrency: int = 8, max_steps: Optional[int] = None, trace_file: Optional[str] = None
+    ):
+        self.workers = workers
+        self.concurrency = concurrency
+        self.max_steps = max_steps
+        self.trace_file = trace_file
+        self._context = multiprocessing.get_context("spawn")
+        self._pool: List[_Worker] = []
+        self._futures: Dict[str, asyncio.Future] = {}
+        self._retried: set = set()
+        self._retired_snapshots: List[dict] = []  #已退出进程的最后快照,保证计数器不回退
+        self._capacity: Optional[asyncio.Semaphore] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._closing = False
+        self._task_ids = count(1)
+
+    async def start(self) -> "WorkerPool":
+        self._loop = asyncio.get_running_loop()
+        self._capacity = asyncio.Semaphore(self.workers * self.concurrency)
+        for index in range(self.workers):
+            self._spawn(index)
+        logger.info(f"工作进程池-已启动{self.workers}个进程，每个进程并发{self.concurrency}个会话")
+        return self
+
+    def _spawn(self, index: int) -> _Worker:
+        parent_conn, child_conn = self._context.Pipe()
+        process = self._context.Process(
+            target=_worker_entry,
+            args=(child_conn, self.workers, self.concurrency, self.max_steps, self.trace_file),
+            name=f"cogniself-worker-{index}",
+            daemon=True,
+        )
+        process.start()
+        child_conn.close()  #主进程只保留自己一端,子进程退出时才能读到EOF
+        worker = _Worker(index, process, parent_conn)
+        if index < len(self._pool):
+            self._pool[index] = worker
+        else:
+            self._pool.append(worker)
+        threading.Thread(target=self._reader, args=(worker,), name=f"{process.name}-reader", daemon=True).start()
+        return worker
+
+    def _reader(self, worker: _Worker) -> None:
+        """每个工作进程一个读线程,把管道消息转交给事件循环"""
+        while True:
+            try:
+                message = worker.conn.recv()
+            except (EOFError, OSError):
+                self._loop.call_soon_threadsafe(self._on_exit, worker)
+                return
+            self._loop.call_soon_threadsafe(self._on_message, worker, message)
+
+    def _on_message(self, worker: _Worker, message: tuple) -> None:
+        if message[0] != "result":
+            return
+        _, task_id, record, snapshot = message
+        if snapshot.get("seq", 0) > worker.snapshot.get("seq", 0):
+            worker.snapshot = snapshot
+        worker.in_flight.pop(task_id, None)
+        future = self._futures.pop(task_id, None)
+        if future is not None and not future.done():
+            future.set_result(record)
+
+    def _on_exit(self, worker: _Worker) -> None:
+        worker.process.join(timeout=1)
+        if worker.snapshot:
+            self._retired_snapshots.append(worker.snapshot)
+            worker.snapshot = {}
+        if self._closing:
+            return
+        logger.warning(f"工作进程池-进程{worker.process.name}意外退出(退出码：{worker.process.exitcode})，正在重启")
+        orphans = list(worker.in_flight.items())
+        replacement = self._spawn(worker.index)
+        for task_id, task in orphans:
+            future = self._futures.get(task_id)
+            if future is None or future.done():
+                continue
+            if task_id in self._retried:
+                self._futures.pop(task_id)
+                future.set_result(
+                    {"id": task["id"], "status": "error", "error": "工作进程崩溃，任务重试后仍未完成"}
+                )
+                continue
+            self._retried.add(task_id)
+            logger.info(f"工作进程池-任务{task['id']}重新分配")
+            self._dispatch(replacement, task_id, task)
+
+    def _dispatch(self, worker: _Worker, task_id: str, task: dict) -> None:
+        worker.in_flight[task_id] = task
+        try:
+            worker.conn.send(("task", {**task, "id": task_id}))
+        except OSError:
+            pass  #进程已退出,读线程检测到EOF后会重新分配该任务
+
+    async def submit(self, task: dict) -> dict:
+        """提交一个任务并等待结果记录;达到总并发上限时在此等待"""
+        async with self._capacity:
+            task_id = str(task.get("id") or next(self._task_ids))
+            if task_id in self._futures:  #重复ID时附加序号,避免结果串号
+                task_id = f"{task_id}#{next(self._task_ids)}"
+            future = self._loop.create_future()
+            self._futures[task_id] = future
+            worker = min(self._pool, key=lambda w: len(w.in_flight))
+            self._dispatch(worker, task_id, task)
+            record = await future
+            self._retried.discard(task_id)
+            record["id"] = task.get("id", record.get("id"))
+            return record
+
+    def metrics(self) -> MetricsRegistry:
+        """合并所有工作进程的指标"""
+        return MetricsRegistry.merged(self._retired_snapshots + [w.snapshot for w in self._pool if w.snapshot])
+
+    async def close(self) -> None:
+        self._closing = True
+        for worker in self._pool:
+            try:
+                worker.conn.send(("stop",))
+            except (OSError, BrokenPipeError):
+                pass
+        await asyncio.gather(*(asyncio.to_thread(w.process.join, 30) for w in self._pool))
+        for worker in self._pool:
+            if worker.process.is_alive():
+                worker.process.terminate()
+        logger.info(f"工作进程池-已关闭")
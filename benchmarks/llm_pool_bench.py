@@ -0,0 +1,147 @@
+"""
+LLM连接池基准测试。
+
+在本地启动一个兼容OpenAI接口的模拟服务器，比较以下两种方式下每一步(一次ask_tool)的延迟：
+    before：AsyncOpenAI默认传输设置，不预热
+    after ：LLMSettings中的连接池配置 + 启动预热
+
+模拟服务器对每个新连接额外延迟 --handshake-ms 毫秒，用来模拟TLS握手开销。
+
+用法：
+    python benchmarks/llm_pool_bench.py --sessions 16 --steps 5
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from openai import AsyncOpenAI  # noqa: E402
+
+from app.config import LLMSettings  # noqa: E402
+from app.llm import LLM  # noqa: E402
+from app.schema import Message  # noqa: E402
+
+_COMPLETION = {
+    "id": "chatcmpl-bench",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "bench-model",
+    "choices": [
+        {
+            "index": 0,
+            "finish_reason": "stop",
+            "message": {"role": "assistant", "content": "ok"},
+        }
+    ],
+    "usage": {"prompt_tokens": 10, "completion_tokens": 1, "total_tokens": 11},
+}
+
+
+async def _handle_connection(reader, writer, handshake: float, latency: float):
+    """极简HTTP/1.1 keep-alive服务端：新连接的第一个请求额外等待handshake秒"""
+    first = True
+    try:
+        while True:
+            head = await reader.readuntil(b"\r\n\r\n")
+            lines = head.decode("latin-1").split("\r\n")
+            length = 0
+            for line in lines[1:]:
+                name, _, value = line.partition(":")
+                if name.strip().lower() == "content-length":
+                    length = int(value.strip())
+            if length:
+                await reader.readexactly(length)
+            if first:
+                await asyncio.sleep(handshake)
+                first = False
+            if " /models" in lines[0]:
+                body = json.dumps({"object": "list", "data": []}).encode()
+            else:
+                await asyncio.sleep(latency)
+                body = json.dumps(_COMPLETION).encode()
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                + f"Content-Length: {len(body)}\r\nConnection: keep-alive\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+    except (asyncio.IncompleteReadError, ConnectionResetError):
+        pass
+    finally:
+        writer.close()
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+async def _run_case(name: str, llm: LLM, sessions: int, steps: int, think_time: float):
+    await llm.warmup()
+    latencies = []
+
+    async def session():
+        messages = [Message.user_message("ping")]
+        for _ in range(steps):
+            start = time.perf_counter()
+            await llm.ask_tool(messages=messages, tools=None)
+            latencies.append(time.perf_counter() - start)
+            await asyncio.sleep(think_time)  #模拟工具执行时间
+
+    await asyncio.gather(*(session() for _ in range(sessions)))
+    p50 = _percentile(latencies, 50) * 1000
+    p99 = _percentile(latencies, 99) * 1000
+    print(f"{name:<7} steps={len(latencies):<5} p50={p50:8.2f}ms  p99={p99:8.2f}ms  mean={statistics.mean(latencies) * 1000:8.2f}ms")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=16, help="并发会话数")
+    parser.add_argument("--steps", type=int, default=5, help="每个会话的步数")
+    parser.add_argument("--handshake-ms", type=float, default=80, help="模拟的每个新连接握手开销")
+    parser.add_argument("--latency-ms", type=float, default=20, help="模拟的模型响应时间")
+    parser.add_argument("--think-ms", type=float, default=5, help="两步之间的间隔")
+    args = parser.parse_args()
+
+    server = await asyncio.start_server(
+        lambda r, w: _handle_connection(r, w, args.handshake_ms / 1000, args.latency_ms / 1000),
+        "127.0.0.1",
+        0,
+    )
+    port = server.sockets[0].getsockname()[1]
+    base_url = f"http://127.0.0.1:{port}/v1"
+
+    def settings(**overrides) -> dict:
+        llm_settings = LLMSettings(
+            model="bench-model", base_url=base_url, api_key="bench", api_type="", api_version="", **overrides
+        )
+        return {"default": llm_settings}
+
+    before = LLM("bench-before", settings())
+    before.client = AsyncOpenAI(api_key=before.api_key, base_url=before.base_url)  #原有的默认传输设置
+    after = LLM(
+        "bench-after",
+        settings(
+            max_connections=args.sessions * 2,
+            max_keepalive_connections=args.sessions,
+            warmup_connections=args.sessions,
+        ),
+    )
+
+    async with server:
+        think = args.think_ms / 1000
+        await _run_case("before", before, args.sessions, args.steps, think)
+        await _run_case("after", after, args.sessions, args.steps, think)
+        #先关闭客户端连接,服务端处理协程随之正常退出
+        await before.client.close()
+        await after.http_client.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,118 @@
+"""
+Memory基准测试。
+
+模拟一个已经积累了 --sizes 条消息的会话继续运行 --steps 步，每一步追加一组
+assistant(带工具调用)/tool/user消息，然后像ask_tool一样序列化整个记忆并计算token数。
+比较以下两种方式下每一步的耗时：
+    before：列表实现，达到上限后重新切片，每次请求重新构建所有消息的dict并按内容哈希查token缓存
+    after ：当前的Memory(有界双端队列) + Message上缓存的线格式和token数
+
+用法：
+    python benchmarks/memory_bench.py --sizes 1000 10000 --steps 50
+"""
+import argparse
+import statistics
+import sys
+import time
+from pathlib import Path
+from typing import List
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from app.llm import LLM, TokenCounter  # noqa: E402
+from app.schema import Function, Memory, Message, Role, ToolCall  # noqa: E402
+
+
+def _legacy_to_dict(message: Message) -> dict:
+    """原有的Message.to_dict：每次调用都重新构建"""
+    result = {"role": message.role}
+    if message.content is not None:
+        result["content"] = message.content
+    if message.tool_calls is not None:
+        result["tool_calls"] = [tool_call.model_dump() for tool_call in message.tool_calls]
+    if message.name is not None:
+        result["name"] = message.name
+    if message.tool_call_id is not None:
+        result["tool_call_id"] = message.tool_call_id
+    return result
+
+
+class _LegacyMemory:
+    """原有的列表实现：达到上限后重新切片整个列表"""
+
+    def __init__(self, max_messages: int):
+        self.messages: List[Message] = []
+        self.max_messages = max_messages
+
+    def add_message(self, message: Message) -> None:
+        self.messages = self.messages + [message]  #think中的 self.messages += [...] 经过setter整体替换
+        if len(self.messages) > self.max_messages:
+            dropped = len(self.messages) - self.max_messages
+            while dropped < len(self.messages) - 1 and self.messages[dropped].role == Role.TOOL:
+                dropped += 1
+            self.messages = self.messages[dropped:]
+
+
+def _turn(index: int) -> List[Message]:
+    call_id = f"call_{index}"
+    return [
+        Message.from_tool_calls(
+            content=f"第{index}步：执行代码",
+            tool_calls=[ToolCall(id=call_id, function=Function(name="python_execute", arguments='{"code": "print(1)"}'))],
+        ),
+        Message.tool_message(content=f"执行结果 {index}\n" + "输出行\n" * 20, name="python_execute", tool_call_id=call_id),
+        Message.user_message("如果你想停止调用工具，请用'terminate'工具/函数"),
+    ]
+
+
+def _run_before(size: int, steps: int, counter: TokenCounter) -> List[float]:
+    memory = _LegacyMemory(size)
+    for i in range(size // 3 + 1):
+        for message in _turn(i):
+            memory.add_message(message)
+    timings = []
+    for step in range(steps):
+        start = time.perf_counter()
+        for message in _turn(size + step):
+            memory.add_message(message)
+        counter.count_messages_tokens([_legacy_to_dict(m) for m in memory.messages])
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def _run_after(size: int, steps: int, llm: LLM) -> List[float]:
+    memory = Memory(max_messages=size, token_counter=llm.count_message_tokens)
+    for i in range(size // 3 + 1):
+        memory.add_messages(_turn(i))
+    timings = []
+    for step in range(steps):
+        start = time.perf_counter()
+        memory.add_messages(_turn(size + step))
+        llm.count_messages_tokens(memory.messages)
+        llm.format_messages(list(memory.messages))
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000], help="记忆中的消息数")
+    parser.add_argument("--steps", type=int, default=50, help="每种规模运行的步数")
+    args = parser.parse_args()
+
+    llm = LLM()
+    for size in args.sizes:
+        #缓存大小设为足以容纳全部消息,使before与after都处于缓存命中的稳定状态
+        counter = TokenCounter(llm.tokenizer)
+        counter.MESSAGE_CACHE_SIZE = size * 2
+        before = _run_before(size, args.steps, counter)
+        after = _run_after(size, args.steps, llm)
+        print(
+            f"messages={size:<6} before={statistics.mean(before) * 1000:8.3f}ms/step  "
+            f"after={statistics.mean(after) * 1000:8.3f}ms/step  "
+            f"speedup={statistics.mean(before) / statistics.mean(after):6.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,5 +1,4 @@
 import asyncio
-from time import sleep
 
 from app.agent.cogniself import CogniSelf
 from app.logger import logger
@@ -7,8 +6,7 @@ from app.logger import logger
 async def main():
     agent = CogniSelf()
     try:
-        sleep(1)
-        prompt = input("请输入要处理的请求：")
+        prompt = await asyncio.to_thread(input, "请输入要处理的请求：")  #在线程中等待输入，不阻塞事件循环
         if not prompt.strip():
             logger.warning("请求不能为空")
             return
@@ -18,4 +16,4 @@ async def main():
     except KeyboardInterrupt:
         logger.info("请求处理已完成")
 if __name__ == '__main__':
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -0,0 +1,123 @@
+"""
+批量运行入口：在一个事件循环中并发运行多个CogniSelf会话。
+
+输入为JSON Lines(文件或标准输入)，每行一个任务：
+    {"id": "task-1", "prompt": "...", "priority": "high"}
+也可以直接是一个JSON字符串："..."
+
+每个会话结束后立即输出一行结果记录(含耗时和token用量)。单进程时所有会话共享同一个LLM客户端
+(及其限流调度器、连接池)和同一个工具集;--workers大于1时启动多进程工作池,每个进程各自运行
+--concurrency个会话,LLM限流配额在进程间平分。
+
+用法：
+    python run_batch.py --input tasks.jsonl --output results.jsonl --concurrency 16
+    cat tasks.jsonl | python run_batch.py --concurrency 32
+    python run_batch.py --input tasks.jsonl --workers 4 --concurrency 16
+    python run_batch.py --input tasks.jsonl --trace trace.json  #用chrome://tracing或Perfetto打开
+"""
+import argparse
+import asyncio
+import json
+import sys
+import time
+from typing import Optional, TextIO
+
+from app.accounting import metrics_registry
+from app.batch import default_tools, parse_task, run_session
+from app.logger import logger
+from app.tracing import tracer
+from app.worker_pool import WorkerPool
+
+
+async def run_batch(
+    input_file: TextIO,
+    output_file: TextIO,
+    concurrency: int,
+    max_steps: Optional[int],
+    pool: Optional[WorkerPool] = None,
+) -> None:
+    if pool is not None:
+        run = pool.submit
+        concurrency = pool.workers * pool.concurrency
+    else:
+        tools = default_tools()  #所有会话共享的工具集
+        run = lambda task: run_session(task, tools, max_steps)
+    semaphore = asyncio.Semaphore(concurrency)
+    tasks = set()
+    counts = {"ok": 0, "error": 0}
+
+    async def worker(task: dict):
+        try:
+            record = await run(task)
+        except Exception as e:
+            logger.exception(f"批量运行-任务{task['id']}无法启动：{e}")
+            record = {"id": task["id"], "status": "error", "error": f"{type(e).__name__}: {e}"}
+        finally:
+            semaphore.release()
+        counts[record["status"]] += 1
+        output_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+        output_file.flush()
+
+    start = time.perf_counter()
+    index = 0
+    while True:
+        line = await asyncio.to_thread(input_file.readline)  #逐行读取,不阻塞事件循环
+        if not line:
+            break
+        index += 1
+        try:
+            task = parse_task(line, index)
+        except ValueError as e:  #json.JSONDecodeError是ValueError的子类
+            logger.error(f"批量运行-跳过无效任务：{e}")
+            continue
+        if task is None:
+            continue
+        await semaphore.acquire()  #达到并发上限时在此等待,控制同时运行的会话数
+        tasks.add(asyncio.create_task(worker(task)))
+        tasks = {t for t in tasks if not t.done()}
+
+    if tasks:
+        await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    total = counts["ok"] + counts["error"]
+    logger.info(
+        f"批量运行完成：{total}个会话(成功{counts['ok']}，失败{counts['error']})，"
+        f"耗时{elapsed:.2f}秒，吞吐{total / elapsed if elapsed else 0:.2f}会话/秒"
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--input", default="-", help="任务JSONL文件，'-'表示标准输入")
+    parser.add_argument("--output", default="-", help="结果JSONL文件，'-'表示标准输出")
+    parser.add_argument("--concurrency", type=int, default=8, help="同时运行的会话数(多进程时为每个进程的会话数)")
+    parser.add_argument("--workers", type=int, default=1, help="工作进程数，大于1时使用多进程工作池")
+    parser.add_argument("--max-steps", type=int, default=None, help="覆盖每个会话的最大步数")
+    parser.add_argument("--metrics-port", type=int, default=None, help="在该端口提供Prometheus指标")
+    parser.add_argument("--trace", default=None, help="把链路追踪span写入该Chrome trace-event JSON文件")
+    args = parser.parse_args()
+
+    if args.trace:
+        tracer.export_to(args.trace)  #在启动工作进程之前创建文件并写入数组开头
+    pool = None
+    if args.workers > 1:
+        pool = await WorkerPool(args.workers, args.concurrency, args.max_steps, args.trace).start()
+    if args.metrics_port:
+        render = (lambda: pool.metrics().render_prometheus()) if pool else None
+        await metrics_registry.serve(port=args.metrics_port, render=render)
+
+    input_file = sys.stdin if args.input == "-" else open(args.input, encoding="utf-8")
+    output_file = sys.stdout if args.output == "-" else open(args.output, "a", encoding="utf-8")
+    try:
+        await run_batch(input_file, output_file, args.concurrency, args.max_steps, pool)
+    finally:
+        if pool is not None:
+            await pool.close()
+        if input_file is not sys.stdin:
+            input_file.close()
+        if output_file is not sys.stdout:
+            output_file.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())